@@ -1,14 +1,22 @@
 """Anthropic Claude API client with connection pooling, retries, and concurrency control."""
 
 import asyncio
+import functools
 import logging
 import time
 from dataclasses import dataclass
 from decimal import Decimal
-from typing import AsyncIterator
+from typing import TYPE_CHECKING, Any, AsyncIterator, cast
 
 import anthropic
-from anthropic import APIError, APITimeoutError, RateLimitError
+from anthropic import (
+    APIConnectionError,
+    APIError,
+    APIStatusError,
+    APITimeoutError,
+    RateLimitError,
+)
+from anthropic.types import MessageParam, TextBlockParam
 
 from app.config import Settings, get_settings
 from app.models import UsageStats
@@ -16,13 +24,73 @@ from app.utils.async_helpers import (
     CircuitBreaker,
     CircuitBreakerOpen,
     ConcurrencyLimiter,
+    DeadlineExceeded,
+    ErrorClass,
+    LoadShed,
     RequestMetrics,
+    RetryBudget,
+    current_deadline,
     with_retry,
 )
+from app.utils.cache_keepalive import PromptCacheKeepAlive, prefix_key
 from app.utils.cost_calculator import CostCalculator
+from app.utils.http_pool import build_transport
+from app.utils.token_estimator import (
+    REQUEST_OVERHEAD_TOKENS,
+    TOOL_USE_OVERHEAD_TOKENS,
+    RequestEstimate,
+    text_length,
+    token_estimator,
+)
+
+if TYPE_CHECKING:
+    import httpx2
 
 logger = logging.getLogger(__name__)
 
+SystemPrompt = str | list[dict[str, Any]]
+
+# User turn of cache-priming requests (its content is not part of the cached prefix)
+WARMUP_MESSAGE = "Reply with OK."
+
+# Least time left before the request deadline worth starting a Claude call with
+MIN_ATTEMPT_SECONDS = 5.0
+
+RETRYABLE_EXCEPTIONS = (APIError, APITimeoutError, RateLimitError, asyncio.TimeoutError)
+
+
+def classify_error(error: BaseException) -> ErrorClass:
+    """
+    Classify a Claude call error for the circuit breaker.
+
+    Server errors, timeouts and connection failures mean the API is
+    unhealthy. A rate limit means we should send less, not stop. Other
+    client errors (invalid requests, auth) and our own load shedding say
+    nothing about the API's health.
+    """
+    if isinstance(error, (LoadShed, DeadlineExceeded)):
+        return ErrorClass.IGNORE
+    if isinstance(error, RateLimitError):
+        return ErrorClass.THROTTLE
+    if isinstance(error, APIStatusError):
+        if error.status_code >= 500 or error.status_code == 408:
+            return ErrorClass.FAILURE
+        return ErrorClass.IGNORE
+    if isinstance(error, (APIConnectionError, asyncio.TimeoutError)):
+        return ErrorClass.FAILURE
+    return ErrorClass.IGNORE
+
+
+def retry_after_seconds(error: BaseException) -> float | None:
+    """Seconds from an API error's Retry-After header, if it has one."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
 
 @dataclass
 class ClaudeResponse:
@@ -33,6 +101,9 @@ class ClaudeResponse:
     cached: bool
     model: str
     latency_ms: float
+    stop_reason: str | None = None
+    continuations: int = 0  # Extra calls made after hitting max_tokens
+    tool_input: dict[str, Any] | None = None  # Input of the first tool_use block
 
 
 class ClaudeClient:
@@ -40,9 +111,9 @@ class ClaudeClient:
     High-performance async wrapper for Anthropic Claude API.
 
     Features:
-    - Connection pooling via httpx
+    - Connection pooling via a shared, instrumented httpx transport
     - Semaphore-based concurrency limiting
-    - Exponential backoff retry with jitter
+    - Exponential backoff retry with jitter, within a shared retry budget
     - Circuit breaker pattern for failure protection
     - Request metrics tracking
     - Prompt caching support
@@ -63,40 +134,83 @@ class ClaudeClient:
         if not self.settings.anthropic_api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is required")
 
-        # Initialize async Anthropic client with custom httpx settings
+        # Initialize async Anthropic client on a shared, instrumented connection pool
+        self.timeout = anthropic.Timeout(
+            connect=10.0,
+            read=self.settings.claude_timeout_seconds,
+            write=30.0,
+            pool=10.0,
+        )
+        self.transport = build_transport(self.settings)
+        self.http_client = anthropic.DefaultAsyncHttpxClient(
+            # The transport subclasses whichever httpx package the SDK uses
+            transport=cast("httpx2.AsyncBaseTransport", self.transport),
+            timeout=self.timeout,
+        )
         self.client = anthropic.AsyncAnthropic(
             api_key=self.settings.anthropic_api_key,
+            base_url=self.settings.anthropic_base_url,
             max_retries=0,  # We handle retries ourselves
-            timeout=anthropic.Timeout(
-                connect=10.0,
-                read=self.settings.claude_timeout_seconds,
-                write=30.0,
-                pool=10.0,
-            ),
+            timeout=self.timeout,
+            http_client=self.http_client,
         )
 
         self.model = self.settings.claude_model
         self.max_tokens = self.settings.claude_max_tokens
         self.cost_calculator = CostCalculator()
+        self.token_estimator = token_estimator
 
         # Concurrency control
         self.concurrency_limiter = ConcurrencyLimiter(
-            max_concurrent=self.settings.max_concurrent_claude_calls
+            max_concurrent=self.settings.max_concurrent_claude_calls,
+            target_delay=self.settings.queue_target_delay_ms / 1000,
+            interval=self.settings.queue_interval_seconds,
         )
 
         # Circuit breaker for API protection
         self.circuit_breaker = CircuitBreaker(
-            failure_threshold=5,
-            recovery_timeout=30.0,
-            half_open_max_calls=3,
+            window_seconds=self.settings.circuit_breaker_window_seconds,
+            failure_rate_threshold=self.settings.circuit_breaker_failure_rate,
+            minimum_requests=self.settings.circuit_breaker_min_requests,
+            recovery_timeout=self.settings.circuit_breaker_recovery_seconds,
+            throttle_seconds=self.settings.rate_limit_pause_seconds,
+            classify=classify_error,
+            probe=self._probe,
         )
 
         # Metrics tracking
         self.metrics = RequestMetrics()
 
+        # Retries share one budget, so an upstream incident cannot multiply load
+        self.retry_budget = RetryBudget(
+            ratio=self.settings.retry_budget_ratio,
+            min_per_second=self.settings.retry_budget_min_per_second,
+            max_tokens=self.settings.retry_budget_max_tokens,
+        )
+        self._send_with_retry = with_retry(
+            max_retries=self.settings.max_retries,
+            base_delay=self.settings.retry_base_delay,
+            max_delay=self.settings.retry_max_delay,
+            retryable_exceptions=RETRYABLE_EXCEPTIONS,
+            min_attempt_seconds=MIN_ATTEMPT_SECONDS,
+            budget=self.retry_budget,
+        )(self._send)
+
+        # Prompt cache usage tracking and keep-alive
+        self.cache_keepalive = PromptCacheKeepAlive(
+            pricing=self.cost_calculator.get_pricing(self.model),
+            ttl_seconds=self.settings.prompt_cache_ttl_seconds,
+            margin_seconds=self.settings.cache_keepalive_margin_seconds,
+            timezone=self.settings.cache_keepalive_timezone,
+            start_hour=self.settings.cache_keepalive_start_hour,
+            end_hour=self.settings.cache_keepalive_end_hour,
+            weekdays_only=self.settings.cache_keepalive_weekdays_only,
+        )
+
         logger.info(
             f"ClaudeClient initialized: model={self.model}, "
-            f"max_concurrent={self.settings.max_concurrent_claude_calls}"
+            f"max_concurrent={self.settings.max_concurrent_claude_calls}, "
+            f"pool_max={self.transport.max_connections}, http2={self.transport.http2}"
         )
 
     @classmethod
@@ -126,6 +240,7 @@ class ClaudeClient:
 
     async def close(self) -> None:
         """Close the client and cleanup resources."""
+        await self.cache_keepalive.stop()
         await self.client.close()
         logger.info(
             f"ClaudeClient closed. Metrics: {self.metrics.to_dict()}"
@@ -134,16 +249,68 @@ class ClaudeClient:
     async def send_message(
         self,
         user_message: str,
-        system_prompt: str,
+        system_prompt: SystemPrompt,
         max_tokens: int | None = None,
+        prompt_profile: str | None = None,
+        tools: list[dict[str, Any]] | None = None,
+        tool_choice: dict[str, Any] | None = None,
+        cache_message: bool = False,
     ) -> ClaudeResponse:
         """
         Send a message to Claude with full concurrency protection.
 
         Args:
             user_message: The user's message/question.
-            system_prompt: The system prompt (will be cached).
+            system_prompt: The system prompt, either a string (cached as one block)
+                or pre-built text blocks carrying their own cache breakpoints.
+            max_tokens: Maximum tokens in response.
+            prompt_profile: Name of the system prompt module combination, used to
+                track prompt cache effectiveness per profile.
+            tools: Tool definitions offered to the model.
+            tool_choice: Tool selection policy (e.g. force a specific tool).
+            cache_message: Also put a cache breakpoint on the message, for calls
+                that open a follow-up conversation starting with it.
+
+        Returns:
+            ClaudeResponse with content, usage stats, cache status, and latency.
+
+        Raises:
+            CircuitBreakerOpen: If the circuit breaker is open.
+            Exception: If all retries fail.
+        """
+        messages: list[dict[str, Any]] = [{"role": "user", "content": user_message}]
+        return await self._execute(
+            messages=self._with_message_breakpoint(messages) if cache_message else messages,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            prompt_profile=prompt_profile,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+
+    async def send_conversation(
+        self,
+        messages: list[dict[str, Any]],
+        system_prompt: SystemPrompt,
+        max_tokens: int | None = None,
+        prompt_profile: str | None = None,
+        tools: list[dict[str, Any]] | None = None,
+        tool_choice: dict[str, Any] | None = None,
+    ) -> ClaudeResponse:
+        """
+        Send a multi-turn conversation ending in a user turn.
+
+        The last turn carries a cache breakpoint, so the whole history is
+        written to the prompt cache and the next turn of the same conversation
+        reads everything up to its new question from cache.
+
+        Args:
+            messages: Alternating user/assistant turns, ending with a user turn.
+            system_prompt: The system prompt, exactly as sent on earlier turns.
             max_tokens: Maximum tokens in response.
+            prompt_profile: Name of the system prompt module combination.
+            tools: Tool definitions, exactly as sent on earlier turns.
+            tool_choice: Tool selection policy.
 
         Returns:
             ClaudeResponse with content, usage stats, cache status, and latency.
@@ -152,8 +319,27 @@ class ClaudeClient:
             CircuitBreakerOpen: If the circuit breaker is open.
             Exception: If all retries fail.
         """
+        return await self._execute(
+            messages=self._with_message_breakpoint(messages),
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            prompt_profile=prompt_profile,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+
+    async def _execute(
+        self,
+        messages: list[dict[str, Any]],
+        system_prompt: SystemPrompt,
+        max_tokens: int | None,
+        prompt_profile: str | None,
+        tools: list[dict[str, Any]] | None,
+        tool_choice: dict[str, Any] | None,
+    ) -> ClaudeResponse:
+        """Run a request under the circuit breaker and concurrency limiter."""
         # Check circuit breaker
-        if not await self.circuit_breaker.can_execute():
+        if not self.circuit_breaker.can_execute():
             raise CircuitBreakerOpen(
                 "Claude API circuit breaker is open. Service temporarily unavailable."
             )
@@ -161,71 +347,381 @@ class ClaudeClient:
         start_time = time.perf_counter()
 
         try:
+            await self._wait_out_throttle()
+
             # Acquire concurrency slot
-            async with self.concurrency_limiter.acquire(timeout=30.0):
-                response = await self._send_with_retry(
-                    user_message=user_message,
+            async with self.concurrency_limiter.acquire(
+                timeout=self.settings.claude_queue_max_wait_seconds, reserve=MIN_ATTEMPT_SECONDS
+            ):
+                response = await self._complete(
+                    messages=messages,
                     system_prompt=system_prompt,
                     max_tokens=max_tokens or self.max_tokens,
+                    tools=tools,
+                    tool_choice=tool_choice,
                 )
 
             latency_ms = (time.perf_counter() - start_time) * 1000
             response.latency_ms = latency_ms
 
             # Record success
-            await self.circuit_breaker.record_success()
-            await self.metrics.record_request(success=True, latency_ms=latency_ms)
+            self.circuit_breaker.record_success()
+            self.metrics.record_request(success=True, latency_ms=latency_ms)
+            self.metrics.record_prompt_usage(
+                profile=prompt_profile or "full",
+                input_tokens=response.usage.input_tokens,
+                cache_read_tokens=response.usage.cache_read_input_tokens,
+                cache_write_tokens=response.usage.cache_creation_input_tokens,
+            )
+            self.cache_keepalive.record(
+                prefix_key(self._system_blocks(system_prompt), tools), response.usage
+            )
 
             logger.debug(
                 f"Claude request completed in {latency_ms:.0f}ms, "
-                f"cached={response.cached}, tokens={response.usage.output_tokens}"
+                f"cached={response.cached}, tokens={response.usage.output_tokens}, "
+                f"continuations={response.continuations}"
             )
 
             return response
 
+        except (LoadShed, DeadlineExceeded):
+            # Given up before reaching the API, so not a sign of an unhealthy upstream
+            self.metrics.record_request(
+                success=False, latency_ms=(time.perf_counter() - start_time) * 1000
+            )
+            raise
         except Exception as e:
             latency_ms = (time.perf_counter() - start_time) * 1000
-            await self.circuit_breaker.record_failure()
-            await self.metrics.record_request(success=False, latency_ms=latency_ms)
+            self.circuit_breaker.record_failure(e, retry_after=retry_after_seconds(e))
+            self.metrics.record_request(success=False, latency_ms=latency_ms)
             logger.error(f"Claude request failed after {latency_ms:.0f}ms: {e}")
             raise
 
-    @with_retry(
-        max_retries=3,
-        base_delay=1.0,
-        max_delay=30.0,
-        retryable_exceptions=(APIError, APITimeoutError, RateLimitError, asyncio.TimeoutError),
-    )
-    async def _send_with_retry(
+    async def _wait_out_throttle(self) -> None:
+        """
+        Hold a new call while the API is rate limiting us.
+
+        Raises:
+            DeadlineExceeded: If the pause would leave too little time for the call.
+        """
+        pause = self.circuit_breaker.throttle_remaining()
+        if not pause:
+            return
+        deadline = current_deadline()
+        if deadline is not None and deadline.remaining() < pause + MIN_ATTEMPT_SECONDS:
+            raise DeadlineExceeded(f"Rate limited for {pause:.1f}s, past the request deadline")
+        await asyncio.sleep(pause)
+
+    async def _probe(self) -> None:
+        """One-token request deciding whether a half-open circuit closes."""
+        await self.client.messages.create(
+            model=self.model,
+            max_tokens=1,
+            messages=[{"role": "user", "content": WARMUP_MESSAGE}],
+        )
+
+    async def open_connections(self, count: int) -> int:
+        """
+        Open pooled connections to the API ahead of traffic.
+
+        Sends count concurrent HEAD requests to the API host so that the TCP
+        and TLS handshakes happen now; the connections stay in the pool as
+        keep-alive connections (up to http_keepalive_connections).
+
+        Over HTTP/2 the pool multiplexes concurrent requests onto one
+        connection (a connecting HTTP/2 connection already counts as
+        available), so count is ignored and a single HEAD warms it.
+
+        Returns:
+            Number of connections open in the pool afterwards.
+        """
+        if self.transport.http2:
+            count = min(count, 1)
+        await asyncio.gather(*(self.http_client.head(self.client.base_url) for _ in range(count)))
+        return int(self.transport.to_dict()["connections"])
+
+    async def prime_prompt_cache(
+        self,
+        system_prompt: SystemPrompt,
+        tools: list[dict[str, Any]] | None = None,
+        source: str = "warmup",
+    ) -> UsageStats:
+        """
+        Write a system prompt (and tools) prefix to the prompt cache.
+
+        Sends a one-token request with the same tools and system blocks as real
+        requests, so their prefix is read from cache instead of written. Usage
+        is recorded under the source as prompt profile and in the keep-alive
+        spend.
+
+        Args:
+            system_prompt: System prompt to cache, as a string or blocks.
+            tools: Tools sent ahead of the system prompt, if any.
+            source: "warmup" or "keepalive".
+
+        Returns:
+            Token usage and cost of the priming request.
+        """
+        response = await self._send_with_retry(
+            messages=[{"role": "user", "content": WARMUP_MESSAGE}],
+            system_prompt=system_prompt,
+            max_tokens=1,
+            tools=tools,
+            tool_choice={"type": "none"} if tools else None,
+        )
+        self.metrics.record_prompt_usage(
+            profile=source,
+            input_tokens=response.usage.input_tokens,
+            cache_read_tokens=response.usage.cache_read_input_tokens,
+            cache_write_tokens=response.usage.cache_creation_input_tokens,
+        )
+        self.cache_keepalive.record(
+            prefix_key(self._system_blocks(system_prompt), tools), response.usage, source
+        )
+        return response.usage
+
+    def start_cache_keepalive(
+        self, prompts: list[tuple[SystemPrompt, list[dict[str, Any]] | None]]
+    ) -> None:
+        """
+        Keep prompt prefixes cached during business hours.
+
+        Args:
+            prompts: (system prompt, tools) prefixes to refresh before they lapse.
+        """
+        self.cache_keepalive.start(
+            [(self._system_blocks(system), tools) for system, tools in prompts],
+            functools.partial(self.prime_prompt_cache, source="keepalive"),
+        )
+        logger.info(
+            f"Prompt cache keep-alive started for {len(prompts)} prefix(es), "
+            f"hours {self.settings.cache_keepalive_start_hour}:00-"
+            f"{self.settings.cache_keepalive_end_hour}:00 {self.settings.cache_keepalive_timezone}"
+        )
+
+    def estimate_request(
         self,
         user_message: str,
-        system_prompt: str,
+        system_prompt: SystemPrompt,
+        max_tokens: int | None = None,
+        tools: list[dict[str, Any]] | None = None,
+    ) -> RequestEstimate:
+        """
+        Estimate a request's size and worst-case cost without sending it.
+
+        Args:
+            user_message: The user's message/question.
+            system_prompt: The system prompt, as a string or pre-built blocks.
+            max_tokens: Output budget (defaults to the configured max_tokens).
+            tools: Tool definitions sent with a forced tool_choice, if any.
+
+        Returns:
+            RequestEstimate with token counts and the uncached, full-budget cost.
+        """
+        max_tokens = max_tokens or self.max_tokens
+        system_tokens = self.token_estimator.estimate_tokens(system_prompt)
+        message_tokens = self.token_estimator.estimate_tokens(user_message)
+        tool_tokens = 0
+        if tools:
+            tool_tokens = self.token_estimator.estimate_tokens(tools) + TOOL_USE_OVERHEAD_TOKENS
+        max_cost = self.cost_calculator.calculate_cost(
+            model=self.model,
+            input_tokens=system_tokens + message_tokens + tool_tokens + REQUEST_OVERHEAD_TOKENS,
+            output_tokens=max_tokens,
+        )
+        return RequestEstimate(
+            system_tokens=system_tokens,
+            message_tokens=message_tokens,
+            max_tokens=max_tokens,
+            max_cost_usd=max_cost,
+            tool_tokens=tool_tokens,
+        )
+
+    async def _complete(
+        self,
+        messages: list[dict[str, Any]],
+        system_prompt: SystemPrompt,
         max_tokens: int,
+        tools: list[dict[str, Any]] | None = None,
+        tool_choice: dict[str, Any] | None = None,
     ) -> ClaudeResponse:
         """
-        Internal method to send message with retry logic.
+        Send messages, continuing automatically when output stops at max_tokens.
 
-        This method is decorated with retry logic for transient failures.
+        Continuation calls resend the conversation with the partial answer as an
+        assistant prefill. The system prompt is already cached by the first call,
+        and the last user turn carries its own cache breakpoint so every further
+        continuation reads the whole prefix from cache. Content is stitched and
+        usage/cost are summed across calls, up to settings.max_continuations.
+
+        Tool-use responses are never continued: a truncated tool input cannot
+        be resumed from a text prefill.
         """
+        response = await self._send_with_retry(
+            messages=messages,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            tools=tools,
+            tool_choice=tool_choice,
+        )
+        cached_messages = self._with_message_breakpoint(messages)
+
+        while (
+            response.stop_reason == "max_tokens"
+            and response.continuations < self.settings.max_continuations
+            and not tools
+        ):
+            # The API rejects a final assistant turn ending in whitespace
+            prefill = response.content.rstrip()
+            if not prefill:
+                break
+            deadline = current_deadline()
+            if deadline is not None and deadline.remaining() < MIN_ATTEMPT_SECONDS:
+                logger.warning(
+                    f"Not continuing truncated response: {deadline.remaining():.1f}s left "
+                    "before the request deadline"
+                )
+                break
+
+            continuation = await self._send_with_retry(
+                messages=[*cached_messages, {"role": "assistant", "content": prefill}],
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
+            )
+            self.metrics.continuation_calls += 1
+            response = ClaudeResponse(
+                content=prefill + continuation.content,
+                usage=self._merge_usage(response.usage, continuation.usage),
+                cached=response.cached or continuation.cached,
+                model=response.model,
+                latency_ms=0.0,
+                stop_reason=continuation.stop_reason,
+                continuations=response.continuations + 1,
+            )
+
+        if response.stop_reason == "max_tokens":
+            self.metrics.truncated_responses += 1
+            logger.warning(
+                f"Claude response still truncated after {response.continuations} "
+                f"continuation(s) of {max_tokens} tokens"
+            )
+
+        return response
+
+    @staticmethod
+    def _with_message_breakpoint(messages: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Copy messages, adding a cache breakpoint to the last turn."""
+        last = messages[-1]
+        content = last["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        content = [*content[:-1], {**content[-1], "cache_control": {"type": "ephemeral"}}]
+        return [*messages[:-1], {**last, "content": content}]
+
+    @staticmethod
+    def _merge_usage(first: UsageStats, second: UsageStats) -> UsageStats:
+        """Sum token usage and cost across calls."""
+        return UsageStats(
+            input_tokens=first.input_tokens + second.input_tokens,
+            output_tokens=first.output_tokens + second.output_tokens,
+            cache_creation_input_tokens=(
+                first.cache_creation_input_tokens + second.cache_creation_input_tokens
+            ),
+            cache_read_input_tokens=first.cache_read_input_tokens + second.cache_read_input_tokens,
+            estimated_cost_usd=first.estimated_cost_usd + second.estimated_cost_usd,
+        )
+
+    async def _send(
+        self,
+        messages: list[dict[str, Any]],
+        system_prompt: SystemPrompt,
+        max_tokens: int,
+        tools: list[dict[str, Any]] | None = None,
+        tool_choice: dict[str, Any] | None = None,
+    ) -> ClaudeResponse:
+        """
+        Send one attempt of a request.
+
+        Called through self._send_with_retry, which retries transient failures
+        within the settings' retry limits and the shared retry budget.
+        """
+        system = self._system_blocks(system_prompt)
+        tool_kwargs: dict[str, Any] = {}
+        if tools:
+            tool_kwargs["tools"] = tools
+            if tool_choice:
+                tool_kwargs["tool_choice"] = tool_choice
+
+        attempt_start = time.perf_counter()
         response = await self.client.messages.create(
             model=self.model,
             max_tokens=max_tokens,
-            system=[
+            system=cast(list[TextBlockParam], system),
+            messages=cast(list[MessageParam], messages),
+            timeout=self._attempt_timeout(),
+            **tool_kwargs,
+        )
+
+        parsed = self._parse_response(response)
+        self.metrics.record_generation(
+            model=self.model,
+            output_tokens=parsed.usage.output_tokens,
+            generation_ms=(time.perf_counter() - attempt_start) * 1000,
+        )
+        self.metrics.record_usage(
+            input_tokens=parsed.usage.input_tokens,
+            output_tokens=parsed.usage.output_tokens,
+            cache_read_tokens=parsed.usage.cache_read_input_tokens,
+            cache_write_tokens=parsed.usage.cache_creation_input_tokens,
+            cost_usd=float(parsed.usage.estimated_cost_usd),
+        )
+        self.token_estimator.calibrate(
+            prompt_chars=text_length(system) + text_length(messages) + text_length(tools or []),
+            actual_tokens=(
+                parsed.usage.input_tokens
+                + parsed.usage.cache_read_input_tokens
+                + parsed.usage.cache_creation_input_tokens
+                - (TOOL_USE_OVERHEAD_TOKENS if tools else 0)
+            ),
+        )
+        return parsed
+
+    def _attempt_timeout(self) -> anthropic.Timeout:
+        """
+        HTTP timeouts for one attempt, capped at the time left before the deadline.
+
+        Raises:
+            DeadlineExceeded: If too little time is left to be worth sending.
+        """
+        deadline = current_deadline()
+        if deadline is None:
+            return self.timeout
+        left = deadline.cap(None, MIN_ATTEMPT_SECONDS) + MIN_ATTEMPT_SECONDS
+
+        def capped(timeout: float | None) -> float:
+            # None means no timeout, so the deadline is the only limit
+            return left if timeout is None else min(timeout, left)
+
+        return anthropic.Timeout(
+            connect=capped(self.timeout.connect),
+            read=capped(self.timeout.read),
+            write=capped(self.timeout.write),
+            pool=capped(self.timeout.pool),
+        )
+
+    @staticmethod
+    def _system_blocks(system_prompt: SystemPrompt) -> list[dict[str, Any]]:
+        """Normalise a system prompt into cacheable text blocks."""
+        if isinstance(system_prompt, str):
+            return [
                 {
                     "type": "text",
                     "text": system_prompt,
                     "cache_control": {"type": "ephemeral"},
                 }
-            ],
-            messages=[
-                {
-                    "role": "user",
-                    "content": user_message,
-                }
-            ],
-        )
-
-        return self._parse_response(response)
+            ]
+        return system_prompt
 
     def _parse_response(self, response: anthropic.types.Message) -> ClaudeResponse:
         """Parse the Anthropic API response into our response model."""
@@ -246,9 +742,12 @@ class ClaudeClient:
         cached = cache_read_tokens > 0
 
         content = ""
+        tool_input = None
         for block in response.content:
             if block.type == "text":
                 content += block.text
+            elif block.type == "tool_use" and tool_input is None:
+                tool_input = block.input
 
         return ClaudeResponse(
             content=content,
@@ -262,12 +761,14 @@ class ClaudeClient:
             cached=cached,
             model=self.model,
             latency_ms=0.0,  # Will be set by caller
+            stop_reason=response.stop_reason,
+            tool_input=tool_input,
         )
 
     async def send_message_streaming(
         self,
         user_message: str,
-        system_prompt: str,
+        system_prompt: SystemPrompt,
         max_tokens: int | None = None,
     ) -> AsyncIterator[str]:
         """
@@ -275,14 +776,14 @@ class ClaudeClient:
 
         Args:
             user_message: The user's message/question.
-            system_prompt: The system prompt (will be cached).
+            system_prompt: The system prompt, as a string or pre-built cached blocks.
             max_tokens: Maximum tokens in response.
 
         Yields:
             Text chunks as they arrive.
         """
         # Check circuit breaker
-        if not await self.circuit_breaker.can_execute():
+        if not self.circuit_breaker.can_execute():
             raise CircuitBreakerOpen(
                 "Claude API circuit breaker is open. Service temporarily unavailable."
             )
@@ -290,35 +791,60 @@ class ClaudeClient:
         start_time = time.perf_counter()
 
         try:
-            async with self.concurrency_limiter.acquire(timeout=30.0):
+            async with self.concurrency_limiter.acquire(
+                timeout=self.settings.claude_queue_max_wait_seconds, reserve=MIN_ATTEMPT_SECONDS
+            ):
+                stream_start = time.perf_counter()
+                first_token_time: float | None = None
                 async with self.client.messages.stream(
                     model=self.model,
                     max_tokens=max_tokens or self.max_tokens,
-                    system=[
-                        {
-                            "type": "text",
-                            "text": system_prompt,
-                            "cache_control": {"type": "ephemeral"},
-                        }
-                    ],
+                    system=cast(list[TextBlockParam], self._system_blocks(system_prompt)),
                     messages=[
                         {
                             "role": "user",
                             "content": user_message,
                         }
                     ],
+                    timeout=self._attempt_timeout(),
                 ) as stream:
                     async for text in stream.text_stream:
+                        if first_token_time is None:
+                            first_token_time = time.perf_counter()
                         yield text
 
+                    final_message = await stream.get_final_message()
+                    stream_end = time.perf_counter()
+
+                if first_token_time is not None:
+                    self.metrics.record_generation(
+                        model=self.model,
+                        output_tokens=final_message.usage.output_tokens,
+                        generation_ms=(stream_end - stream_start) * 1000,
+                        time_to_first_token_ms=(first_token_time - stream_start) * 1000,
+                    )
+                usage = self._parse_response(final_message).usage
+                self.metrics.record_usage(
+                    input_tokens=usage.input_tokens,
+                    output_tokens=usage.output_tokens,
+                    cache_read_tokens=usage.cache_read_input_tokens,
+                    cache_write_tokens=usage.cache_creation_input_tokens,
+                    cost_usd=float(usage.estimated_cost_usd),
+                )
+
             latency_ms = (time.perf_counter() - start_time) * 1000
-            await self.circuit_breaker.record_success()
-            await self.metrics.record_request(success=True, latency_ms=latency_ms)
+            self.circuit_breaker.record_success()
+            self.metrics.record_request(success=True, latency_ms=latency_ms)
 
+        except (LoadShed, DeadlineExceeded):
+            self.metrics.record_request(
+                success=False, latency_ms=(time.perf_counter() - start_time) * 1000
+            )
+            raise
         except Exception as e:
             latency_ms = (time.perf_counter() - start_time) * 1000
-            await self.circuit_breaker.record_failure()
-            await self.metrics.record_request(success=False, latency_ms=latency_ms)
+            self.circuit_breaker.record_failure(e, retry_after=retry_after_seconds(e))
+            self.metrics.record_request(success=False, latency_ms=latency_ms)
             logger.error(f"Claude streaming request failed: {e}")
             raise
 
@@ -327,7 +853,13 @@ class ClaudeClient:
         return {
             **self.metrics.to_dict(),
             "circuit_breaker_state": self.circuit_breaker.state.value,
+            "circuit_breaker": self.circuit_breaker.to_dict(),
             "active_requests": self.concurrency_limiter.active_count,
             "available_slots": self.concurrency_limiter.available_slots,
             "total_processed": self.concurrency_limiter.total_processed,
+            "queue": self.concurrency_limiter.to_dict(),
+            "retry_budget": self.retry_budget.to_dict(),
+            "token_estimator": self.token_estimator.to_dict(),
+            "http_pool": self.transport.to_dict(),
+            "cache_keepalive": self.cache_keepalive.to_dict(),
         }
@@ -1,6 +1,7 @@
 """Configuration management for CGT Brain API."""
 
 from functools import lru_cache
+from typing import Literal
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -16,26 +17,113 @@ class Settings(BaseSettings):
 
     # API Keys
     anthropic_api_key: str = ""
+    anthropic_base_url: str | None = None  # API URL override, e.g. a local stand-in upstream
 
     # Claude Model Settings
     claude_model: str = "claude-sonnet-4-20250514"
-    claude_max_tokens: int = 4096
+    claude_max_tokens: int = 4096  # Minimum output budget; also the default for other calls
+    claude_max_tokens_ceiling: int = 16000  # Upper bound for portfolio-based budgets
+
+    # Output budget: base + per_property * properties + per_event * events
+    max_tokens_base: int = 2048
+    max_tokens_per_property: int = 1536
+    max_tokens_per_event: int = 64
+    max_continuations: int = 2  # Extra calls allowed when output stops at max_tokens
     claude_timeout_seconds: float = 120.0
 
+    # Prompt Settings
+    # compact and table use fewer tokens; keep pretty until --parity shows the same answers
+    prompt_format: Literal["pretty", "compact", "table"] = "pretty"
+    modular_system_prompt: bool = True  # Send only relevant system prompt modules
+
+    # Follow-up Session Settings
+    sessions_enabled: bool = True  # Open a follow-up session for each portfolio analysis
+    session_ttl_seconds: float = 1800.0  # Idle time before a session is discarded
+    session_max_sessions: int = 1000  # Least recently used sessions are evicted beyond this
+    session_max_turns: int = 20  # Follow-up questions allowed per session
+    session_max_tokens: int = 2048  # Output budget for a follow-up answer
+
+    # Incremental Re-analysis Settings
+    analysis_ttl_seconds: float = 3600.0  # How long structured analyses can be patched
+    analysis_max_entries: int = 1000  # Least recently used analyses are evicted beyond this
+
+    # Response Cache Settings
+    response_cache_enabled: bool = True  # Serve repeated identical analyses from memory
+    response_cache_ttl_seconds: float = 3600.0
+    response_cache_max_entries: int = 500
+    response_cache_stale_seconds: float = 86400.0  # Expired entries kept for degraded mode
+
+    # Idempotency Settings (Idempotency-Key header on POST /api/ routes)
+    idempotency_enabled: bool = True  # Replay stored responses to retries with the same key
+    idempotency_ttl_seconds: float = 3600.0  # How long a completed response is kept for its key
+    idempotency_max_entries: int = 1000  # Least recently stored responses are evicted beyond this
+
+    # Response Compression Settings
+    compression_minimum_size: int = 1024  # Bodies smaller than this (bytes) are sent uncompressed
+    compression_gzip_level: int = 6  # zlib level 1-9
+    compression_brotli_quality: int = 4  # Brotli quality 0-11 (needs the brotli package)
+
+    # Decomposed (per-property) Analysis Settings
+    # Structured portfolios this large are analysed per property (0 = never)
+    decompose_min_properties: int = 3
+    synthesis_max_tokens: int = 4096  # Output budget for the cross-property synthesis call
+
     # Concurrency Settings
     max_concurrent_requests: int = 100  # Max concurrent requests to the API
     max_concurrent_claude_calls: int = 20  # Max concurrent calls to Claude API
     request_timeout_seconds: float = 180.0  # Total request timeout
 
+    # Load Shedding Settings (CoDel-style, driven by measured queue delay)
+    queue_target_delay_ms: float = 500.0  # Standing queue delay above this signals overload
+    queue_interval_seconds: float = 5.0  # ... for this long; waits then shrink to the target
+    queue_max_wait_seconds: float = 10.0  # Longest an API request queues for a slot
+    claude_queue_max_wait_seconds: float = 30.0  # Longest a Claude call queues for a slot
+
+    # Circuit Breaker Settings (failure rate over a sliding window)
+    circuit_breaker_window_seconds: float = 30.0  # Window the failure rate is measured over
+    circuit_breaker_failure_rate: float = 0.5  # Open when this share of calls in the window fail
+    circuit_breaker_min_requests: int = 10  # ... and at least this many calls completed in it
+    circuit_breaker_recovery_seconds: float = 30.0  # Open time before a single probe request
+    rate_limit_pause_seconds: float = 5.0  # Hold new calls after a 429 without Retry-After
+
+    # Degraded Mode Settings (while the circuit breaker is open)
+    # Serve a stale cached analysis or a local estimate instead of 503
+    degraded_mode_enabled: bool = True
+    deferred_job_max_pending: int = 500  # Full analyses queued to run once the circuit closes
+    deferred_job_ttl_seconds: float = 86400.0  # How long queued jobs and their results are kept
+    deferred_job_poll_seconds: float = 5.0  # How often the queue checks if the circuit has closed
+
     # Retry Settings
     max_retries: int = 3
     retry_base_delay: float = 1.0  # Base delay for exponential backoff
     retry_max_delay: float = 30.0  # Maximum delay between retries
+    retry_budget_ratio: float = 0.2  # Retries allowed per recent request, across all calls
+    retry_budget_min_per_second: float = 0.1  # Retries always allowed at low traffic
+    retry_budget_max_tokens: float = 10.0  # Largest burst of retries after a quiet spell
+
+    # Connection Pool Settings (Anthropic API transport)
+    http_pool_connections: int = 100  # Per-host pool count (urllib3 style); unused by httpx
+    http_pool_maxsize: int = 100  # Max open connections; keep >= max_concurrent_claude_calls
+    http_keepalive_connections: int = 20  # Idle connections kept open for reuse
+    http_keepalive_expiry_seconds: float = 30.0  # Idle time before a kept-alive connection closes
+    http2_enabled: bool = True  # Negotiate HTTP/2 when the h2 package is installed
+
+    # Startup Warm-up Settings
+    warmup_enabled: bool = True  # Warm connections and the prompt cache before reporting ready
+    warmup_connections: int = 4  # Pooled connections to open at startup (HTTP/1.1 only)
+    warmup_prompt_cache: bool = True  # Write the core system prompt prefixes to the prompt cache
+    warmup_timeout_seconds: float = 30.0  # Give up warming (and report ready) after this long
 
-    # Connection Pool Settings
-    http_pool_connections: int = 100
-    http_pool_maxsize: int = 100
-    http_keepalive_connections: int = 20
+    # Prompt Cache Keep-alive Settings
+    # Refresh the core prompt prefixes before the cache lapses (needs warmup_enabled). The cache
+    # is shared by every replica using the same API key: enable this on one replica only
+    cache_keepalive_enabled: bool = True
+    prompt_cache_ttl_seconds: float = 300.0  # Ephemeral cache lifetime after the last write or read
+    cache_keepalive_margin_seconds: float = 30.0  # Refresh this long before the cache would expire
+    cache_keepalive_timezone: str = "Australia/Sydney"  # Timezone of the business hours
+    cache_keepalive_start_hour: int = 8  # Refreshes run from this hour (inclusive)
+    cache_keepalive_end_hour: int = 18  # ... until this hour (exclusive)
+    cache_keepalive_weekdays_only: bool = True  # No refreshes on weekends
 
     # CORS Settings
     cors_origins: list[str] = [
@@ -1,22 +1,43 @@
 """FastAPI application for CGT Brain API with high-concurrency support."""
 
 import asyncio
+import functools
 import logging
-import time
-import uuid
+import math
 from contextlib import asynccontextmanager
 from typing import Annotated, AsyncGenerator
 
 from fastapi import Depends, FastAPI, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
 from app.claude_client import ClaudeClient
+from app.middleware import (
+    CompressionMiddleware,
+    ConcurrencyLimitMiddleware,
+    IdempotencyMiddleware,
+    RequestContextMiddleware,
+)
 from app.config import Settings, get_settings
+from app.metrics import render_metrics
 from app.models import AnalyzeRequest, AnalyzeResponse, HealthResponse
-from app.prompts import SYSTEM_PROMPT
-from app.utils.async_helpers import CircuitBreakerOpen, ConcurrencyLimiter
-from app.routers import portfolio
+from app.prompts import select_system_prompt
+from app.utils.analysis_store import get_analysis_store
+from app.utils.async_helpers import (
+    CircuitBreakerOpen,
+    ConcurrencyLimiter,
+    LoadShed,
+    run_with_timeout,
+)
+from app.utils.prometheus import CONTENT_TYPE as PROMETHEUS_CONTENT_TYPE, get_route_metrics
+from app.utils.prompt_format import PromptFormat, as_prompt_block, format_property_timeline
+from app.utils.deferred_jobs import get_job_queue
+from app.utils.idempotency import get_idempotency_store
+from app.utils.response_cache import get_response_cache
+from app.utils.session_store import get_session_store
+from app.utils.token_estimator import choose_max_tokens
+from app.routers import portfolio, sessions
+from app.warmup import WarmupStatus, warm_up, warmup_prompts
 
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +48,9 @@ logger = logging.getLogger(__name__)
 # Global concurrency limiter for total API requests
 request_limiter: ConcurrencyLimiter | None = None
 
+# Startup warm-up progress, reported by /health/ready
+warmup_status = WarmupStatus()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
@@ -35,17 +59,39 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
 
     Handles startup and shutdown of shared resources.
     """
-    global request_limiter
+    global request_limiter, warmup_status
 
     settings = get_settings()
 
     # Initialize global request limiter
     request_limiter = ConcurrencyLimiter(
-        max_concurrent=settings.max_concurrent_requests
+        max_concurrent=settings.max_concurrent_requests,
+        target_delay=settings.queue_target_delay_ms / 1000,
+        interval=settings.queue_interval_seconds,
     )
 
     # Initialize Claude client singleton
-    await ClaudeClient.get_instance(settings)
+    claude_client = await ClaudeClient.get_instance(settings)
+
+    # Warm connections and the prompt cache in the background; /health/ready
+    # reports ready once this finishes
+    warmup_status = WarmupStatus()
+    warmup_task = None
+    if settings.warmup_enabled:
+        warmup_task = asyncio.create_task(warm_up(claude_client, settings, warmup_status))
+    else:
+        warmup_status.state = "disabled"
+
+    # Refresh the same prefixes before they lapse, within business hours
+    if settings.warmup_enabled and settings.cache_keepalive_enabled:
+        claude_client.start_cache_keepalive(warmup_prompts(settings))
+
+    # Run analyses deferred during an outage once the circuit lets calls through
+    if settings.degraded_mode_enabled:
+        get_job_queue().start(
+            functools.partial(portfolio.run_deferred_job, claude_client, settings),
+            claude_client.circuit_breaker.can_execute,
+        )
 
     logger.info(
         f"CGT Brain API started: "
@@ -56,6 +102,9 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     yield
 
     # Cleanup on shutdown
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    await get_job_queue().stop()
     await ClaudeClient.close_instance()
     logger.info("CGT Brain API shutdown complete")
 
@@ -67,8 +116,9 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Include portfolio analysis router
+# Include portfolio analysis and follow-up session routers
 app.include_router(portfolio.router)
+app.include_router(sessions.router)
 
 
 # ============================================================================
@@ -76,63 +126,30 @@ app.include_router(portfolio.router)
 # ============================================================================
 
 
-@app.middleware("http")
-async def request_middleware(request: Request, call_next):
-    """
-    Middleware for request tracking, timing, and concurrency control.
-
-    - Assigns unique request ID
-    - Tracks request timing
-    - Enforces global concurrency limits
-    - Handles request timeouts
-    """
-    request_id = str(uuid.uuid4())[:8]
-    request.state.request_id = request_id
-    start_time = time.perf_counter()
-
-    # Add request ID to logs
-    logger.info(f"[{request_id}] {request.method} {request.url.path} started")
-
-    try:
-        # Enforce global concurrency limit
-        if request_limiter is not None and request.url.path.startswith("/api/"):
-            try:
-                async with request_limiter.acquire(timeout=10.0):
-                    response = await call_next(request)
-            except asyncio.TimeoutError:
-                logger.warning(
-                    f"[{request_id}] Request rejected: concurrency limit reached"
-                )
-                return JSONResponse(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    content={
-                        "detail": "Server is at capacity. Please retry shortly.",
-                        "request_id": request_id,
-                    },
-                )
-        else:
-            response = await call_next(request)
-
-        # Add timing and request ID headers
-        duration_ms = (time.perf_counter() - start_time) * 1000
-        response.headers["X-Request-ID"] = request_id
-        response.headers["X-Response-Time-Ms"] = f"{duration_ms:.0f}"
-
-        logger.info(
-            f"[{request_id}] {request.method} {request.url.path} "
-            f"completed in {duration_ms:.0f}ms - {response.status_code}"
-        )
+# Global concurrency limit (innermost, so retries waiting on an Idempotency-Key hold no slot)
+app.add_middleware(
+    ConcurrencyLimitMiddleware,
+    get_limiter=lambda: request_limiter,
+    acquire_timeout=get_settings().queue_max_wait_seconds,
+)
 
-        return response
+# Idempotency-Key replay (inside compression, so stored bodies are uncompressed)
+app.add_middleware(
+    IdempotencyMiddleware,
+    get_store=lambda: get_idempotency_store() if get_settings().idempotency_enabled else None,
+    wait_timeout=get_settings().request_timeout_seconds,
+)
 
-    except Exception as e:
-        duration_ms = (time.perf_counter() - start_time) * 1000
-        logger.error(
-            f"[{request_id}] {request.method} {request.url.path} "
-            f"failed after {duration_ms:.0f}ms: {e}"
-        )
-        raise
+# gzip/Brotli for large bodies (inside the request context, so timing includes compression)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=get_settings().compression_minimum_size,
+    compresslevel=get_settings().compression_gzip_level,
+    brotli_quality=get_settings().compression_brotli_quality,
+)
 
+# Request ID, timing headers and per-route metrics (pure ASGI)
+app.add_middleware(RequestContextMiddleware, metrics=get_route_metrics())
 
 # CORS middleware
 app.add_middleware(
@@ -141,7 +158,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
-    expose_headers=["X-Request-ID", "X-Response-Time-Ms"],
+    expose_headers=["X-Request-ID", "X-Response-Time-Ms", "Idempotent-Replayed"],
 )
 
 
@@ -188,6 +205,23 @@ async def circuit_breaker_exception_handler(
     )
 
 
+@app.exception_handler(LoadShed)
+async def load_shed_exception_handler(request: Request, exc: LoadShed) -> JSONResponse:
+    """Handle requests shed by a concurrency limiter."""
+    request_id = getattr(request.state, "request_id", "unknown")
+    retry_after = math.ceil(exc.retry_after)
+    logger.warning(f"[{request_id}] Load shed: {exc}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "detail": f"Server is at capacity. Please retry in {retry_after} seconds.",
+            "request_id": request_id,
+            "retry_after": retry_after,
+        },
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
 @app.exception_handler(asyncio.TimeoutError)
 async def timeout_exception_handler(
     request: Request, exc: asyncio.TimeoutError
@@ -223,6 +257,24 @@ async def health_check() -> HealthResponse:
     )
 
 
+@app.get("/health/ready", tags=["Health"])
+async def readiness_check() -> JSONResponse:
+    """
+    Readiness probe.
+
+    Returns 503 until the startup warm-up has opened API connections and
+    written the system prompt to the prompt cache, then 200.
+    """
+    ready = warmup_status.ready
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if ready else "warming",
+            "warmup": warmup_status.to_dict(),
+        },
+    )
+
+
 @app.get("/health/detailed", tags=["Health"])
 async def detailed_health_check(claude_client: ClaudeClientDep) -> dict:
     """
@@ -232,13 +284,7 @@ async def detailed_health_check(claude_client: ClaudeClientDep) -> dict:
     """
     metrics = claude_client.get_metrics()
 
-    request_limiter_info = {}
-    if request_limiter is not None:
-        request_limiter_info = {
-            "active_requests": request_limiter.active_count,
-            "available_slots": request_limiter.available_slots,
-            "total_processed": request_limiter.total_processed,
-        }
+    request_limiter_info = request_limiter.to_dict() if request_limiter is not None else {}
 
     return {
         "status": "healthy",
@@ -246,9 +292,27 @@ async def detailed_health_check(claude_client: ClaudeClientDep) -> dict:
         "service": "cgt-brain-api",
         "claude_client": metrics,
         "request_limiter": request_limiter_info,
+        "sessions": get_session_store().to_dict(),
+        "analyses": get_analysis_store().to_dict(),
+        "response_cache": get_response_cache().to_dict(),
+        "deferred_jobs": get_job_queue().to_dict(),
+        "idempotency": get_idempotency_store().to_dict(),
     }
 
 
+@app.get("/metrics", tags=["Health"], response_class=Response)
+async def prometheus_metrics(claude_client: ClaudeClientDep) -> Response:
+    """
+    Metrics in the Prometheus text exposition format.
+
+    Request, Claude and queue-wait latency histograms, token and cost
+    counters, cache hit ratios, circuit breaker state and limiter occupancy.
+    """
+    return Response(
+        render_metrics(claude_client, request_limiter), media_type=PROMETHEUS_CONTENT_TYPE
+    )
+
+
 @app.post("/api/analyze", response_model=AnalyzeResponse, tags=["Analysis"])
 async def analyze_property(
     request: Request,
@@ -271,11 +335,11 @@ async def analyze_property(
     request_id = getattr(request.state, "request_id", "unknown")
 
     try:
+        prompt_format = PromptFormat(settings.prompt_format)
+        property_data = format_property_timeline(body.property_data, prompt_format)
         user_message = f"""Please analyze the following property timeline data and calculate the Capital Gains Tax implications:
 
-```json
-{body.property_data.model_dump_json(indent=2)}
-```
+{as_prompt_block(property_data, prompt_format)}
 
 {f"Additional context: {body.additional_context}" if body.additional_context else ""}
 
@@ -286,11 +350,28 @@ Please provide:
 4. Any relevant ITAA97 sections that apply
 5. The final CGT outcome"""
 
+        system_prompt, profile = select_system_prompt(
+            body.property_data.model_dump(mode="json"),
+            modular=settings.modular_system_prompt,
+        )
+
+        max_tokens = choose_max_tokens(
+            property_count=1,
+            event_count=len(body.property_data.events),
+            base=settings.max_tokens_base,
+            per_property=settings.max_tokens_per_property,
+            per_event=settings.max_tokens_per_event,
+            ceiling=settings.claude_max_tokens_ceiling,
+            floor=settings.claude_max_tokens,
+        )
+
         # Send to Claude with timeout
-        response = await asyncio.wait_for(
+        response = await run_with_timeout(
             claude_client.send_message(
                 user_message=user_message,
-                system_prompt=SYSTEM_PROMPT,
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
+                prompt_profile=profile,
             ),
             timeout=settings.request_timeout_seconds,
         )
@@ -298,7 +379,8 @@ Please provide:
         logger.info(
             f"[{request_id}] Analysis completed: "
             f"tokens={response.usage.input_tokens}+{response.usage.output_tokens}, "
-            f"cached={response.cached}, latency={response.latency_ms:.0f}ms"
+            f"cached={response.cached}, latency={response.latency_ms:.0f}ms, "
+            f"prompt_profile={profile}"
         )
 
         return AnalyzeResponse(
@@ -306,8 +388,11 @@ Please provide:
             usage=response.usage,
             cached=response.cached,
             model=response.model,
+            stop_reason=response.stop_reason,
         )
 
+    except LoadShed:
+        raise
     except asyncio.TimeoutError:
         logger.error(f"[{request_id}] Analysis request timed out")
         raise HTTPException(
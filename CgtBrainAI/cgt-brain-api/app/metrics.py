@@ -0,0 +1,181 @@
+"""Prometheus metrics for the /metrics endpoint."""
+
+from app.claude_client import ClaudeClient
+from app.utils.async_helpers import CircuitState, ConcurrencyLimiter
+from app.utils.deferred_jobs import get_job_queue
+from app.utils.idempotency import get_idempotency_store
+from app.utils.prometheus import MetricsWriter, get_route_metrics
+from app.utils.response_cache import get_response_cache
+
+MS = 0.001  # Histograms record milliseconds; Prometheus convention is seconds
+
+
+def _write_http(writer: MetricsWriter) -> None:
+    routes = get_route_metrics()
+    writer.counter(
+        "http_requests_total",
+        "HTTP requests by method, route template and status.",
+        [
+            ({"method": method, "route": route, "status": str(status)}, count)
+            for (method, route, status), count in routes.responses.items()
+        ],
+    )
+    writer.histogram(
+        "http_request_duration_seconds",
+        "End-to-end HTTP request latency by method and route template.",
+        [
+            ({"method": method, "route": route}, histogram)
+            for (method, route), histogram in routes.latency_s.items()
+        ],
+    )
+
+
+def _write_limiters(writer: MetricsWriter, limiters: dict[str, ConcurrencyLimiter]) -> None:
+    writer.gauge(
+        "limiter_active",
+        "Concurrency slots in use.",
+        [({"limiter": name}, limiter.active_count) for name, limiter in limiters.items()],
+    )
+    writer.gauge(
+        "limiter_capacity",
+        "Concurrency slots available in total.",
+        [({"limiter": name}, limiter.max_concurrent) for name, limiter in limiters.items()],
+    )
+    writer.gauge(
+        "limiter_waiting",
+        "Requests queued for a concurrency slot.",
+        [({"limiter": name}, limiter.waiting_count) for name, limiter in limiters.items()],
+    )
+    writer.counter(
+        "limiter_shed_total",
+        "Requests rejected instead of queued.",
+        [
+            ({"limiter": name}, limiter.to_dict()["shed_requests"])
+            for name, limiter in limiters.items()
+        ],
+    )
+    writer.histogram(
+        "limiter_queue_wait_seconds",
+        "Time admitted and timed-out requests waited for a concurrency slot.",
+        [({"limiter": name}, limiter.queue_delay_ms) for name, limiter in limiters.items()],
+        scale=MS,
+    )
+
+
+def _write_claude(writer: MetricsWriter, claude_client: ClaudeClient) -> None:
+    metrics = claude_client.metrics
+    writer.histogram(
+        "claude_request_duration_seconds",
+        "Claude request latency, including queueing, retries and continuations.",
+        [
+            ({"outcome": "success"}, metrics.success_latency_ms),
+            ({"outcome": "failure"}, metrics.failure_latency_ms),
+        ],
+        scale=MS,
+    )
+    writer.histogram(
+        "claude_time_to_first_token_seconds",
+        "Time to the first streamed token.",
+        [
+            ({"model": model}, stats.time_to_first_token_ms)
+            for model, stats in metrics.generation.items()
+        ],
+        scale=MS,
+    )
+    writer.histogram(
+        "claude_output_tokens_per_second",
+        "Output generation speed per API response.",
+        [
+            ({"model": model}, stats.output_tokens_per_second)
+            for model, stats in metrics.generation.items()
+        ],
+    )
+    writer.counter(
+        "claude_tokens_total",
+        "Tokens billed across all API responses, by type.",
+        [
+            ({"type": "input"}, metrics.input_tokens),
+            ({"type": "output"}, metrics.output_tokens),
+            ({"type": "cache_read"}, metrics.cache_read_tokens),
+            ({"type": "cache_write"}, metrics.cache_write_tokens),
+        ],
+    )
+    writer.counter(
+        "claude_cost_usd_total",
+        "Estimated API spend in USD (CostCalculator pricing).",
+        metrics.cost_usd,
+    )
+    writer.counter("claude_continuations_total", "Continuation calls.", metrics.continuation_calls)
+    writer.gauge(
+        "prompt_cache_hit_ratio",
+        "Share of requests that read the system prompt from the prompt cache, by profile.",
+        [
+            ({"profile": profile}, stats.cache_hits / stats.requests)
+            for profile, stats in metrics.prompt_profiles.items()
+            if stats.requests
+        ],
+    )
+
+    breaker = claude_client.circuit_breaker
+    writer.gauge(
+        "circuit_breaker_state",
+        "Circuit breaker state (1 for the current state).",
+        [({"state": state.value}, int(breaker.state is state)) for state in CircuitState],
+    )
+    writer.gauge(
+        "circuit_breaker_failure_rate", "Failure rate in the window.", breaker.failure_rate()
+    )
+    writer.counter(
+        "circuit_breaker_opened_total", "Times the circuit opened.", breaker.times_opened
+    )
+
+    budget = claude_client.retry_budget
+    writer.counter("claude_retries_total", "Retries made.", budget.retries)
+    writer.gauge("retry_budget_balance", "Retries currently available.", budget.balance)
+
+
+def _write_caches(writer: MetricsWriter) -> None:
+    response_cache = get_response_cache().to_dict()
+    writer.counter(
+        "response_cache_lookups_total",
+        "Response cache lookups by result.",
+        [
+            ({"result": "hit"}, response_cache["hits"]),
+            ({"result": "miss"}, response_cache["misses"]),
+            ({"result": "stale_hit"}, response_cache["stale_hits"]),
+        ],
+    )
+    writer.gauge(
+        "response_cache_hit_ratio", "Response cache hit ratio.", response_cache["hit_ratio"]
+    )
+    writer.gauge("response_cache_entries", "Responses cached.", response_cache["entries"])
+
+    idempotency = get_idempotency_store().to_dict()
+    writer.counter(
+        "idempotency_requests_total",
+        "Requests with an Idempotency-Key, by how they were answered.",
+        [
+            ({"result": result}, idempotency[result])
+            for result in ("started", "replayed", "joined", "conflicts")
+        ],
+    )
+    writer.gauge(
+        "deferred_jobs_pending",
+        "Analyses queued until the circuit closes.",
+        get_job_queue().to_dict()["pending"],
+    )
+
+
+def render_metrics(
+    claude_client: ClaudeClient, request_limiter: ConcurrencyLimiter | None
+) -> str:
+    """Collect the process's metrics in the Prometheus text format."""
+    writer = MetricsWriter()
+    _write_http(writer)
+    limiters = {"claude": claude_client.concurrency_limiter}
+    if request_limiter is not None:
+        limiters = {"request": request_limiter, **limiters}
+    _write_limiters(writer, limiters)
+    _write_claude(writer, claude_client)
+    _write_caches(writer)
+    return writer.render()
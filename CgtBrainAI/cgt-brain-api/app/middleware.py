@@ -0,0 +1,404 @@
+"""Pure ASGI middleware for request tracking, concurrency control, idempotency and compression."""
+
+import asyncio
+import logging
+import math
+import time
+import uuid
+from collections.abc import Callable
+
+from fastapi import status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import (
+    DEFAULT_EXCLUDED_CONTENT_TYPES,
+    GZipMiddleware,
+    IdentityResponder,
+)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.async_helpers import ConcurrencyLimiter, LoadShed
+from app.utils.idempotency import (
+    IdempotencyKeyReusedError,
+    IdempotencyRecord,
+    IdempotencyStore,
+    StoredResponse,
+    is_storable,
+    request_fingerprint,
+)
+from app.utils.prometheus import RouteMetrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class RequestContextMiddleware:
+    """
+    Request tracking and timing as a pure ASGI middleware.
+
+    - Assigns a unique request ID (available as request.state.request_id)
+    - Adds X-Request-ID and X-Response-Time-Ms headers
+    - Records per-route request counts and latency for /metrics
+
+    Unlike @app.middleware("http"), the request is passed straight through
+    without wrapping it in a separate task and response stream, so streaming
+    responses are not buffered and each request avoids that overhead.
+    """
+
+    def __init__(self, app: ASGIApp, metrics: RouteMetrics | None = None):
+        """
+        Args:
+            app: The wrapped ASGI application.
+            metrics: Per-route request metrics to record into, if any.
+        """
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = str(uuid.uuid4())[:8]
+        scope.setdefault("state", {})["request_id"] = request_id
+        method, path = scope["method"], scope["path"]
+        start_time = time.perf_counter()
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+
+        logger.info(f"[{request_id}] {method} {path} started")
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                duration_ms = (time.perf_counter() - start_time) * 1000
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+                headers.append("X-Response-Time-Ms", f"{duration_ms:.0f}")
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            logger.info(
+                f"[{request_id}] {method} {path} completed in {duration_ms:.0f}ms - {status_code}"
+            )
+
+        except Exception as e:
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            logger.error(f"[{request_id}] {method} {path} failed after {duration_ms:.0f}ms: {e}")
+            raise
+
+        finally:
+            if self.metrics is not None:
+                # Label by route template so path parameters don't multiply series
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                self.metrics.observe(
+                    method, route, status_code, time.perf_counter() - start_time
+                )
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Global concurrency limit on /api/ routes as a pure ASGI middleware.
+
+    Install it inside IdempotencyMiddleware: a retry that waits for an
+    in-flight request with its key, or gets a stored response replayed, then
+    never holds a slot. The slot is held until the response body has been
+    fully sent, so streaming responses count until they finish.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        get_limiter: Callable[[], ConcurrencyLimiter | None],
+        acquire_timeout: float = 10.0,
+        limited_prefix: str = "/api/",
+    ):
+        """
+        Args:
+            app: The wrapped ASGI application.
+            get_limiter: Returns the global limiter (None until startup has run).
+            acquire_timeout: Longest wait for a slot; the limiter may shed sooner.
+                Shed requests get a 503 with Retry-After.
+            limited_prefix: Path prefix subject to the concurrency limit.
+        """
+        self.app = app
+        self.get_limiter = get_limiter
+        self.acquire_timeout = acquire_timeout
+        self.limited_prefix = limited_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limiter = (
+            self.get_limiter()
+            if scope["type"] == "http" and scope["path"].startswith(self.limited_prefix)
+            else None
+        )
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        admitted = False
+        try:
+            async with limiter.acquire(timeout=self.acquire_timeout):
+                admitted = True
+                await self.app(scope, receive, send)
+        except LoadShed as e:
+            if admitted:
+                raise
+            request_id = scope.get("state", {}).get("request_id", "unknown")
+            retry_after = math.ceil(e.retry_after)
+            logger.warning(f"[{request_id}] Request rejected: {e}")
+            response = JSONResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content={
+                    "detail": f"Server is at capacity. Please retry in {retry_after} seconds.",
+                    "request_id": request_id,
+                    "retry_after": retry_after,
+                },
+                headers={"Retry-After": str(retry_after)},
+            )
+            await response(scope, receive, send)
+
+
+class IdempotencyMiddleware:
+    """
+    Idempotency-Key support for POST requests as a pure ASGI middleware.
+
+    The first request with a key runs and its response is stored. A retry
+    with the same key waits for it if it is still running, then gets the same
+    status, headers and body (plus Idempotent-Replayed: true) without running
+    the route again. Errors, 5xx and 429 responses are not stored, so a retry
+    after one runs afresh. Reusing a key for a different request gets a 422.
+
+    Install it inside the compression middleware so stored bodies are
+    uncompressed and each replay is encoded for its own client, and outside
+    ConcurrencyLimitMiddleware so waiting retries do not hold a slot.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        get_store: Callable[[], IdempotencyStore | None],
+        wait_timeout: float = 180.0,
+        prefix: str = "/api/",
+        max_key_length: int = 255,
+    ):
+        """
+        Args:
+            app: The wrapped ASGI application.
+            get_store: Returns the idempotency store (None = disabled).
+            wait_timeout: Longest a retry waits for the in-flight request with its key.
+            prefix: Path prefix whose POST requests honour Idempotency-Key.
+            max_key_length: Longer keys are rejected with 400.
+        """
+        self.app = app
+        self.get_store = get_store
+        self.wait_timeout = wait_timeout
+        self.prefix = prefix
+        self.max_key_length = max_key_length
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(self.prefix)
+        ):
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get("Idempotency-Key")
+        store = self.get_store() if key is not None else None
+        if store is None:
+            await self.app(scope, receive, send)
+            return
+        if not key or len(key) > self.max_key_length:
+            await self._error(
+                scope, receive, send, status.HTTP_400_BAD_REQUEST,
+                f"Idempotency-Key must be 1-{self.max_key_length} characters",
+            )
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        fingerprint = request_fingerprint(
+            scope["method"], scope["path"], scope.get("query_string", b""), body
+        )
+
+        body_sent = False
+
+        async def receive_body() -> Message:
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        request_id = scope.get("state", {}).get("request_id", "unknown")
+        while True:
+            try:
+                record, owner = store.begin(key, fingerprint)
+            except IdempotencyKeyReusedError as e:
+                await self._error(
+                    scope, receive, send, status.HTTP_422_UNPROCESSABLE_CONTENT, str(e)
+                )
+                return
+            if owner:
+                await self._run(scope, receive_body, send, store, key, record)
+                return
+
+            try:
+                async with asyncio.timeout(self.wait_timeout):
+                    await record.done.wait()
+            except asyncio.TimeoutError:
+                await self._error(
+                    scope, receive, send, status.HTTP_409_CONFLICT,
+                    "A request with this Idempotency-Key is still in progress",
+                )
+                return
+            if record.response is not None:
+                logger.info(f"[{request_id}] Replaying stored response for Idempotency-Key")
+                await self._replay(record.response, send)
+                return
+            # The first attempt failed without a stored response: take the key over
+
+    async def _run(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        store: IdempotencyStore,
+        key: str,
+        record: IdempotencyRecord,
+    ) -> None:
+        """Run the request that owns key, storing its response for retries."""
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        headers: list[tuple[bytes, bytes]] = []
+        chunks: list[bytes] = []
+
+        async def send_and_capture(message: Message) -> None:
+            nonlocal status_code, headers
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_capture)
+        except BaseException:
+            store.abandon(key, record)
+            raise
+        if is_storable(status_code):
+            store.complete(key, record, StoredResponse(status_code, headers, b"".join(chunks)))
+        else:
+            store.abandon(key, record)
+
+    @staticmethod
+    async def _replay(response: StoredResponse, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status,
+                "headers": [*response.headers, (b"idempotent-replayed", b"true")],
+            }
+        )
+        await send({"type": "http.response.body", "body": response.body})
+
+    @staticmethod
+    async def _error(
+        scope: Scope, receive: Receive, send: Send, status_code: int, detail: str
+    ) -> None:
+        response = JSONResponse(status_code=status_code, content={"detail": detail})
+        await response(scope, receive, send)
+
+
+def accepts_encoding(accept_encoding: str, coding: str) -> bool:
+    """Whether an Accept-Encoding header allows a content coding (q=0 refuses it)."""
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() != coding:
+            continue
+        quality = params.strip().removeprefix("q=").strip()
+        try:
+            return not quality or float(quality) > 0
+        except ValueError:
+            return True
+    return False
+
+
+class BrotliResponder(IdentityResponder):
+    """Starlette compression responder that encodes the body with Brotli."""
+
+    content_encoding = "br"
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int,
+        quality: int = 4,
+        *,
+        exclude_content_types: tuple[str, ...] = DEFAULT_EXCLUDED_CONTENT_TYPES,
+    ):
+        super().__init__(app, minimum_size, exclude_content_types=exclude_content_types)
+        self.quality = quality
+        self._compressor: brotli.Compressor = brotli.Compressor(
+            mode=brotli.MODE_TEXT, quality=quality
+        )
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        data: bytes = self._compressor.process(body)
+        tail: bytes = self._compressor.flush() if more_body else self._compressor.finish()
+        return data + tail
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress response bodies at or above minimum_size with Brotli or gzip.
+
+    Brotli is preferred when the client accepts it and the brotli package is
+    installed; otherwise Starlette's gzip handling applies. Smaller bodies,
+    already-encoded responses and streaming media types are sent as-is.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        compresslevel: int = 6,
+        brotli_quality: int = 4,
+    ):
+        """
+        Args:
+            app: The wrapped ASGI application.
+            minimum_size: Smallest body (bytes) worth compressing.
+            compresslevel: gzip level (1-9).
+            brotli_quality: Brotli quality (0-11).
+        """
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and brotli is not None:
+            accept_encoding = Headers(scope=scope).get("Accept-Encoding", "")
+            if accepts_encoding(accept_encoding, "br"):
+                responder = BrotliResponder(
+                    self.app,
+                    self.minimum_size,
+                    self.brotli_quality,
+                    exclude_content_types=self.exclude_content_types,
+                )
+                await responder(scope, receive, send)
+                return
+        await super().__call__(scope, receive, send)
@@ -10,12 +10,29 @@ from .schemas import (
     HealthResponse,
 )
 
+from .analysis_schemas import (
+    ClarificationAnswer,
+    ClarificationAnswersRequest,
+    ClarificationPeriod,
+    ClarificationQuestion,
+    PropertyCGTResult,
+    StructuredAnalysis,
+)
+
 from .portfolio_schemas import (
     PropertyHistoryEvent,
     TimelineProperty,
     AdditionalInfo,
     PortfolioAnalyzeRequest,
     PortfolioAnalyzeResponse,
+    PortfolioEstimateResponse,
+    AnalysisPatchRequest,
+    DeferredJobResponse,
+)
+
+from .session_schemas import (
+    SessionMessageRequest,
+    SessionMessageResponse,
 )
 
 __all__ = [
@@ -33,4 +50,17 @@ __all__ = [
     "AdditionalInfo",
     "PortfolioAnalyzeRequest",
     "PortfolioAnalyzeResponse",
+    "PortfolioEstimateResponse",
+    "AnalysisPatchRequest",
+    "DeferredJobResponse",
+    # Structured analysis schemas
+    "ClarificationAnswer",
+    "ClarificationAnswersRequest",
+    "ClarificationPeriod",
+    "ClarificationQuestion",
+    "PropertyCGTResult",
+    "StructuredAnalysis",
+    # Follow-up session schemas
+    "SessionMessageRequest",
+    "SessionMessageResponse",
 ]
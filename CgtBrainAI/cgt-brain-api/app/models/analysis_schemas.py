@@ -0,0 +1,97 @@
+"""Pydantic models for structured (tool-use) CGT analysis output."""
+
+from decimal import Decimal
+from typing import Literal, Optional
+
+from pydantic import BaseModel, Field, computed_field
+
+
+class ClarificationPeriod(BaseModel):
+    """Date range a clarification question refers to."""
+
+    start_date: str = Field(..., description="Start date (YYYY-MM-DD)")
+    end_date: str = Field(..., description="End date (YYYY-MM-DD)")
+    days: Optional[int] = Field(None, description="Days in the period")
+
+
+class ClarificationQuestion(BaseModel):
+    """A question the user must answer before the analysis can be finalised."""
+
+    question_id: str = Field(..., description="Stable identifier, e.g. q_<suburb>_<year>_<year>")
+    property_address: Optional[str] = Field(None, description="Property the question is about")
+    period: Optional[ClarificationPeriod] = Field(None, description="Period the question is about")
+    question: str = Field(..., description="Question text shown to the user")
+    options: list[str] = Field(default_factory=list, description="Suggested answers")
+    severity: Literal["critical", "warning", "info"] = Field(
+        "critical", description="critical = result cannot be calculated without an answer"
+    )
+
+
+class ClarificationAnswer(BaseModel):
+    """User's answer to a clarification question (frontend verification_responses format)."""
+
+    question_id: Optional[str] = Field(None, description="Question being answered")
+    property_address: Optional[str] = Field(None, description="Property the answer is about")
+    issue_period: Optional[ClarificationPeriod] = Field(
+        None, description="Period the answer covers"
+    )
+    resolution_question: Optional[str] = Field(None, description="Question as shown to the user")
+    user_response: str = Field(..., min_length=1, description="The user's answer")
+    resolved_at: Optional[str] = Field(None, description="When the user answered (ISO 8601)")
+
+
+class ClarificationAnswersRequest(BaseModel):
+    """Answers submitted against a pending clarification."""
+
+    answers: list[ClarificationAnswer] = Field(
+        ..., min_length=1, description="Answers to the questions"
+    )
+
+
+class PropertyCGTResult(BaseModel):
+    """CGT outcome for a single property."""
+
+    address: str = Field(..., description="Property address as given in the input")
+    cgt_event_date: Optional[str] = Field(None, description="Date of CGT event A1 (contract date)")
+    capital_proceeds: Decimal = Field(..., description="Capital proceeds in AUD")
+    cost_base: Decimal = Field(..., description="Total cost base (all five elements) in AUD")
+    gross_capital_gain: Decimal = Field(
+        ..., description="Capital proceeds minus cost base in AUD (negative for a loss)"
+    )
+    exempt_fraction: Decimal = Field(
+        ..., ge=0, le=1, description="Share of the gain exempt as main residence (0-1)"
+    )
+    discount_percentage: Decimal = Field(
+        ..., ge=0, le=50, description="CGT discount applied in percent (50, 33.33 or 0)"
+    )
+    net_capital_gain: Decimal = Field(
+        ..., description="Gain after exemption and discount in AUD (negative for a loss)"
+    )
+    itaa97_sections: list[str] = Field(
+        default_factory=list, description="ITAA97 sections applied, e.g. s118-145"
+    )
+    notes: list[str] = Field(default_factory=list, description="Short caveats or assumptions")
+
+
+class StructuredAnalysis(BaseModel):
+    """Complete structured CGT analysis for a portfolio."""
+
+    summary: str = Field(..., description="Plain-language summary of the outcome (2-4 sentences)")
+    properties: list[PropertyCGTResult] = Field(
+        default_factory=list, description="One result per property that has a CGT event"
+    )
+    clarification_questions: list[ClarificationQuestion] = Field(
+        default_factory=list, description="Questions that block or qualify the result"
+    )
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def total_net_capital_gain(self) -> Decimal:
+        """Sum of per-property net capital gains (computed server-side)."""
+        return sum((prop.net_capital_gain for prop in self.properties), Decimal("0"))
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def needs_clarification(self) -> bool:
+        """Whether any question must be answered before the result is final."""
+        return any(q.severity == "critical" for q in self.clarification_questions)
@@ -1,9 +1,11 @@
 """Pydantic models for CGT Timeline Frontend format."""
 
 from decimal import Decimal
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Any, Literal, Optional
 
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
+
+from .analysis_schemas import ClarificationAnswer, StructuredAnalysis
 
 if TYPE_CHECKING:
     from .schemas import UsageStats
@@ -99,6 +101,28 @@ class PortfolioAnalyzeRequest(BaseModel):
     use_claude: Optional[bool] = Field(
         default=True, description="Whether to use Claude for analysis"
     )
+    output_format: Literal["markdown", "structured"] = Field(
+        default="markdown",
+        description="markdown = free-text analysis; structured = typed per-property results",
+    )
+    clarification_id: Optional[str] = Field(
+        default=None, description="Pending clarification these answers resolve"
+    )
+    verification_responses: list[ClarificationAnswer] = Field(
+        default_factory=list, description="Answers to clarification questions"
+    )
+    decompose: Optional[bool] = Field(
+        default=None,
+        description="Analyse properties in parallel then synthesise (structured output); "
+        "None = decide by portfolio size",
+    )
+
+    @model_validator(mode="after")
+    def check_decompose_format(self) -> "PortfolioAnalyzeRequest":
+        """Decomposed analyses are structured; reject decompose=true with markdown."""
+        if self.decompose and self.output_format != "structured":
+            raise ValueError('decompose=true requires output_format="structured"')
+        return self
 
 
 class PortfolioAnalyzeResponse(BaseModel):
@@ -106,10 +130,80 @@ class PortfolioAnalyzeResponse(BaseModel):
 
     analysis: str = Field(..., description="The CGT analysis from Claude")
     properties: list[TimelineProperty] = Field(
-        ..., description="The analyzed properties (echoed back)"
+        ..., description="The analyzed properties (echoed back; omitted when shape=slim)"
+    )
+    request_hash: Optional[str] = Field(
+        default=None,
+        description="SHA-256 of the analysed request, identifying it without the echo",
     )
     input_tokens: int = Field(..., description="Number of input tokens")
     output_tokens: int = Field(..., description="Number of output tokens")
     cached: bool = Field(..., description="Whether the system prompt was cached")
     model: str = Field(..., description="Model used for analysis")
     estimated_cost_usd: Decimal = Field(..., description="Estimated cost in USD")
+    stop_reason: Optional[str] = Field(
+        default=None, description="Why generation stopped (max_tokens = truncated)"
+    )
+    structured: Optional[StructuredAnalysis] = Field(
+        default=None, description="Typed results (output_format=structured only)"
+    )
+    session_id: Optional[str] = Field(
+        default=None, description="Follow-up session for questions about this analysis"
+    )
+    clarification_id: Optional[str] = Field(
+        default=None, description="Submit answers against this id to resume the analysis"
+    )
+    analysis_id: Optional[str] = Field(
+        default=None, description="Patch this analysis to re-analyse only edited properties"
+    )
+    reanalysed_properties: Optional[list[str]] = Field(
+        default=None, description="Properties recomputed by an incremental re-analysis"
+    )
+    analysis_mode: Literal["single", "decomposed"] = Field(
+        default="single", description="decomposed = per-property calls plus a synthesis step"
+    )
+    degraded: bool = Field(
+        default=False,
+        description="Served while the AI analysis is unavailable (stale cache or local estimate)",
+    )
+    job_id: Optional[str] = Field(
+        default=None,
+        description="Full analysis queued for when the AI is back; poll /api/v1/jobs/{job_id}",
+    )
+
+
+class AnalysisPatchRequest(BaseModel):
+    """Incremental edit to the event histories of an analysed portfolio."""
+
+    patch: list[dict[str, Any]] = Field(
+        ...,
+        min_length=1,
+        description="JSON Patch (RFC 6902) operations on /properties/<index>/property_history",
+    )
+    user_query: Optional[str] = Field(None, description="Replaces the original question if set")
+
+
+class PortfolioEstimateResponse(BaseModel):
+    """Pre-flight size and cost estimate for a portfolio analysis."""
+
+    input_tokens: int = Field(..., description="Estimated prompt tokens")
+    system_tokens: int = Field(..., description="Estimated system prompt tokens")
+    message_tokens: int = Field(..., description="Estimated user message tokens")
+    tool_tokens: int = Field(0, description="Estimated tool definition tokens (structured output)")
+    max_tokens: int = Field(..., description="Output budget that would be requested")
+    max_cost_usd: Decimal = Field(
+        ..., description="Cost if the prompt is uncached and the budget is used"
+    )
+    prompt_profile: str = Field(..., description="Selected system prompt modules")
+    model: str = Field(..., description="Model that would be used")
+
+
+class DeferredJobResponse(BaseModel):
+    """Status of a full analysis deferred during an outage."""
+
+    job_id: str = Field(..., description="Job identifier")
+    status: Literal["pending", "running", "done", "failed"] = Field(..., description="Job state")
+    result: Optional[PortfolioAnalyzeResponse] = Field(
+        None, description="The full analysis, once done"
+    )
+    error: Optional[str] = Field(None, description="Why the job failed")
@@ -132,6 +132,9 @@ class AnalyzeResponse(BaseModel):
     usage: UsageStats = Field(..., description="Token usage statistics")
     cached: bool = Field(..., description="Whether the system prompt was cached")
     model: str = Field(..., description="Model used for analysis")
+    stop_reason: Optional[str] = Field(
+        None, description="Why generation stopped (max_tokens = truncated)"
+    )
 
 
 class HealthResponse(BaseModel):
@@ -0,0 +1,33 @@
+"""Pydantic models for follow-up conversation sessions."""
+
+from decimal import Decimal
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class SessionMessageRequest(BaseModel):
+    """Follow-up question about a completed analysis."""
+
+    message: str = Field(
+        ..., min_length=1, max_length=4000, description="Follow-up question"
+    )
+
+
+class SessionMessageResponse(BaseModel):
+    """Answer to a follow-up question."""
+
+    session_id: str = Field(..., description="Session the answer belongs to")
+    answer: str = Field(..., description="Claude's answer")
+    turn: int = Field(..., description="Follow-up questions answered in this session")
+    input_tokens: int = Field(..., description="Uncached input tokens")
+    output_tokens: int = Field(..., description="Number of output tokens")
+    cache_read_input_tokens: int = Field(0, description="Tokens read from the prompt cache")
+    cache_creation_input_tokens: int = Field(0, description="Tokens written to the prompt cache")
+    cached: bool = Field(..., description="Whether the conversation prefix was cached")
+    model: str = Field(..., description="Model used")
+    estimated_cost_usd: Decimal = Field(..., description="Estimated cost of this turn in USD")
+    session_cost_usd: Decimal = Field(..., description="Estimated cost of all follow-ups in USD")
+    stop_reason: Optional[str] = Field(
+        None, description="Why generation stopped (max_tokens = truncated)"
+    )
@@ -1,5 +1,29 @@
 """Prompt templates for CGT Brain API."""
 
+from .modules import (
+    PROMPT_SECTIONS,
+    build_system_blocks,
+    prompt_profile,
+    select_sections,
+    select_system_prompt,
+)
+from .structured_output import (
+    CGT_ANALYSIS_TOOL,
+    CGT_ANALYSIS_TOOL_CHOICE,
+    CGT_ANALYSIS_TOOL_NAME,
+    STRUCTURED_OUTPUT_INSTRUCTION,
+)
 from .system_prompt import SYSTEM_PROMPT
 
-__all__ = ["SYSTEM_PROMPT"]
+__all__ = [
+    "CGT_ANALYSIS_TOOL",
+    "CGT_ANALYSIS_TOOL_CHOICE",
+    "CGT_ANALYSIS_TOOL_NAME",
+    "STRUCTURED_OUTPUT_INSTRUCTION",
+    "PROMPT_SECTIONS",
+    "SYSTEM_PROMPT",
+    "build_system_blocks",
+    "prompt_profile",
+    "select_sections",
+    "select_system_prompt",
+]
@@ -0,0 +1,258 @@
+"""
+Modular view of the system prompt.
+
+SYSTEM_PROMPT is split into addressable sections (the preamble plus Parts A-Q).
+Core sections are always sent; optional modules are only sent when the
+portfolio contains events, flags or wording that make them relevant.
+
+The system prompt is sent as two cached blocks: the core (identical for every
+request, so it stays in the prompt cache) followed by the selected optional
+modules in canonical order (cached per module combination).
+"""
+
+import re
+from collections.abc import Iterable
+from datetime import date
+from typing import Any
+
+from .system_prompt import SYSTEM_PROMPT
+
+PART_HEADING = re.compile(r"^# PART ([A-Z]):", re.MULTILINE)
+CLOSING_MARKER = "\n---\n\n*You are now ready"
+
+
+def _split_sections(prompt: str) -> dict[str, str]:
+    """Split the prompt into preamble, Parts A-Q and closing instruction."""
+    closing_start = prompt.rindex(CLOSING_MARKER)
+    body, closing = prompt[:closing_start], prompt[closing_start:]
+
+    matches = list(PART_HEADING.finditer(body))
+    sections = {"preamble": body[: matches[0].start()]}
+    for match, following in zip(matches, [*matches[1:], None]):
+        end = following.start() if following else len(body)
+        sections[match.group(1)] = body[match.start() : end]
+    sections["closing"] = closing
+    return sections
+
+
+PROMPT_SECTIONS: dict[str, str] = _split_sections(SYSTEM_PROMPT)
+
+# Always sent (in this order) as the first cached block
+CORE_SECTIONS: tuple[str, ...] = (
+    "preamble", "A", "F", "H", "I", "L", "M", "N", "O", "P", "closing",
+)
+
+# Sent only when relevant, in this canonical order, as the second cached block
+OPTIONAL_SECTIONS: tuple[str, ...] = ("B", "C", "D", "E", "G", "J", "K", "Q")
+
+CORE_PROMPT = "".join(PROMPT_SECTIONS[name] for name in CORE_SECTIONS)
+
+# Structured (tool-use) output has its own schema, so the markdown response
+# format in Part O is left out
+STRUCTURED_CORE_PROMPT = "".join(
+    PROMPT_SECTIONS[name] for name in CORE_SECTIONS if name != "O"
+)
+
+# Whole prompt for structured requests when modular selection is off
+STRUCTURED_FULL_PROMPT = "".join(
+    text for name, text in PROMPT_SECTIONS.items() if name != "O"
+)
+
+# Event types that bring in Part K (special situations)
+SPECIAL_EVENTS = frozenset({
+    "inheritance", "gift", "death_of_owner", "marriage", "divorce",
+    "ownership_change", "subdivision",
+})
+
+# Keyword triggers matched against descriptions, notes, queries and extra info
+SECTION_KEYWORDS: dict[str, tuple[str, ...]] = {
+    "B": ("six-year", "six year", "6 year", "6-year", "absence", "absent", "overseas"),
+    "C": ("first use", "first used", "produce income"),
+    "D": ("overlap", "six-month", "six month", "6 month", "6-month"),
+    "E": ("foreign", "non-resident", "expat"),
+    "G": (
+        "airbnb", "rent a room", "renting a room", "room rental", "boarder", "lodger",
+        "home office", "home business", "business use", "floor area",
+    ),
+    "J": ("construct", "demolish", "rebuild", "knock down", "vacant land"),
+    "K": (
+        "inherit", "deceased", "death", "gift", "subdivi", "granny", "spouse",
+        "divorce", "separation", "relationship breakdown", "destroy", "compulsory",
+        "pre-cgt", "pre cgt", "small business",
+    ),
+}
+
+# Checkbox/flag triggers from the frontend checkboxState and additional_info
+SECTION_FLAGS: dict[str, tuple[str, ...]] = {
+    "C": ("purchaseAsRent", "firstUseToProduceIncome", "market_value_at_first_rental"),
+    "D": ("other_property_owned", "overlap_period_days"),
+    "E": ("foreign_resident_from",),
+    "G": (
+        "partialRental", "partialBusiness", "mixedUse", "purchaseAsBusiness",
+        "floorAreaData", "business_use_percentage",
+    ),
+    "J": ("purchaseAsConstruction", "purchaseAsVacant", "construction_start"),
+    "K": (
+        "inheritedProperty", "preCGTProperty", "pre_cgt_property", "date_of_death",
+        "market_value_at_death", "subdivisionDetails",
+    ),
+}
+
+
+def _normalise(data: dict[str, Any]) -> tuple[list[list[dict[str, Any]]], dict[str, Any]]:
+    """Return (per-property event lists, additional info) for either request shape."""
+    if "properties" in data:
+        histories = [prop.get("property_history") or [] for prop in data["properties"]]
+        return histories, data.get("additional_info") or {}
+
+    # Legacy PropertyTimeline shape
+    events = [
+        {**event, "event": event.get("event_type"), "date": event.get("event_date")}
+        for event in data.get("events") or []
+    ]
+    if data.get("is_pre_cgt"):
+        events.append({"event": "other", "preCGTProperty": True})
+    return [events], {}
+
+
+def _truthy_keys(value: Any, found: set[str]) -> None:
+    """Collect keys whose values are truthy, at any depth."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if item not in (None, False, "", 0, [], {}):
+                found.add(key)
+            _truthy_keys(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _truthy_keys(item, found)
+
+
+def _strings(value: Any) -> Iterable[str]:
+    """Yield every string value, at any depth."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _strings(item)
+
+
+def _first_date(events: list[dict[str, Any]], event_type: str) -> date | None:
+    """Earliest date of the given event type, ignoring unparseable dates."""
+    dates = []
+    for event in events:
+        if event.get("event") != event_type or not event.get("date"):
+            continue
+        try:
+            dates.append(date.fromisoformat(str(event["date"])[:10]))
+        except ValueError:
+            continue
+    return min(dates) if dates else None
+
+
+def select_sections(data: dict[str, Any]) -> tuple[str, ...]:
+    """
+    Select the optional prompt modules relevant to a request.
+
+    Args:
+        data: JSON-mode dump of a PortfolioAnalyzeRequest or PropertyTimeline.
+
+    Returns:
+        Selected optional section names in canonical order.
+    """
+    histories, additional_info = _normalise(data)
+    selected: set[str] = set()
+
+    flags: set[str] = set()
+    _truthy_keys(data, flags)
+    for section, section_flags in SECTION_FLAGS.items():
+        if flags.intersection(section_flags):
+            selected.add(section)
+
+    text = " ".join(_strings(data)).lower()
+    for section, keywords in SECTION_KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            selected.add(section)
+
+    if additional_info.get("australian_resident") is False:
+        selected.add("E")
+
+    properties_lived_in = 0
+    for events in histories:
+        event_types = {event.get("event") for event in events}
+        if event_types & SPECIAL_EVENTS:
+            selected.add("K")
+        if "move_in" in event_types:
+            properties_lived_in += 1
+            if event_types & {"move_out", "rent_start"}:
+                selected.add("B")
+
+        first_rent = _first_date(events, "rent_start")
+        first_move_in = _first_date(events, "move_in")
+        if first_rent and (first_move_in is None or first_rent < first_move_in):
+            selected.add("C")
+
+    if properties_lived_in > 1:
+        selected.add("D")
+
+    # Worked examples cover the six-year and first-use rules
+    if selected & {"B", "C"}:
+        selected.add("Q")
+
+    return tuple(name for name in OPTIONAL_SECTIONS if name in selected)
+
+
+def prompt_profile(sections: Iterable[str], structured: bool = False) -> str:
+    """Stable name for a module combination, e.g. 'core+B+Q' or 'structured+B'."""
+    return "+".join(("structured" if structured else "core", *sections))
+
+
+def build_system_blocks(
+    sections: Iterable[str], structured: bool = False
+) -> list[dict[str, Any]]:
+    """
+    Build system prompt blocks with one cache breakpoint per block.
+
+    Args:
+        sections: Optional section names (unknown and core names are ignored).
+        structured: Use the core without the markdown response format (Part O).
+
+    Returns:
+        List of text blocks for the Messages API ``system`` parameter.
+    """
+    wanted = set(sections)
+    core = STRUCTURED_CORE_PROMPT if structured else CORE_PROMPT
+    blocks = [{"type": "text", "text": core, "cache_control": {"type": "ephemeral"}}]
+    optional = [name for name in OPTIONAL_SECTIONS if name in wanted]
+    if optional:
+        blocks.append({
+            "type": "text",
+            "text": "".join(PROMPT_SECTIONS[name] for name in optional),
+            "cache_control": {"type": "ephemeral"},
+        })
+    return blocks
+
+
+def select_system_prompt(
+    data: dict[str, Any], modular: bool = True, structured: bool = False
+) -> tuple[list[dict[str, Any]], str]:
+    """
+    Choose system prompt blocks and their profile name for a request.
+
+    Args:
+        data: JSON-mode dump of a PortfolioAnalyzeRequest or PropertyTimeline.
+        modular: If False, send the full monolithic prompt as one block.
+        structured: Whether the response is returned through the analysis tool
+            (the markdown response format in Part O is then left out).
+
+    Returns:
+        Tuple of (system blocks, prompt profile name).
+    """
+    if not modular:
+        text = STRUCTURED_FULL_PROMPT if structured else SYSTEM_PROMPT
+        blocks = [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+        return blocks, "structured-full" if structured else "full"
+    sections = select_sections(data)
+    return build_system_blocks(sections, structured), prompt_profile(sections, structured)
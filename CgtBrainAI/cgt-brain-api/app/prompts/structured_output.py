@@ -0,0 +1,48 @@
+"""Tool definition used to obtain structured CGT analysis output."""
+
+from typing import Any
+
+from pydantic.json_schema import GenerateJsonSchema
+
+from app.models.analysis_schemas import StructuredAnalysis
+
+CGT_ANALYSIS_TOOL_NAME = "record_cgt_analysis"
+
+STRUCTURED_OUTPUT_INSTRUCTION = (
+    f"Record your analysis by calling the {CGT_ANALYSIS_TOOL_NAME} tool. Do all working "
+    "internally; the tool input is the only output. Amounts are plain numbers in AUD. "
+    "If required information is missing, add clarification questions instead of guessing."
+)
+
+
+class _ToolJsonSchema(GenerateJsonSchema):
+    """JSON schema generator that emits money as numbers and drops titles."""
+
+    def decimal_schema(self, schema: Any) -> dict[str, Any]:
+        json_schema: dict[str, Any] = {"type": "number"}
+        self.update_with_validations(json_schema, schema, self.ValidationsMapping.numeric)
+        return json_schema
+
+    def field_title_should_be_set(self, schema: Any) -> bool:
+        return False
+
+    def generate(self, schema: Any, mode: Any = "validation") -> dict[str, Any]:
+        json_schema = super().generate(schema, mode=mode)
+        json_schema.pop("title", None)
+        for definition in json_schema.get("$defs", {}).values():
+            definition.pop("title", None)
+        return json_schema
+
+
+CGT_ANALYSIS_TOOL: dict[str, Any] = {
+    "name": CGT_ANALYSIS_TOOL_NAME,
+    "description": (
+        "Record the final CGT analysis: one result per property with a CGT event, "
+        "plus any clarification questions."
+    ),
+    "input_schema": StructuredAnalysis.model_json_schema(
+        schema_generator=_ToolJsonSchema, mode="validation"
+    ),
+}
+
+CGT_ANALYSIS_TOOL_CHOICE: dict[str, Any] = {"type": "tool", "name": CGT_ANALYSIS_TOOL_NAME}
@@ -1,5 +1,6 @@
 """CGT Brain API routers package."""
 
 from .portfolio import router as portfolio_router
+from .sessions import router as sessions_router
 
-__all__ = ["portfolio_router"]
+__all__ = ["portfolio_router", "sessions_router"]
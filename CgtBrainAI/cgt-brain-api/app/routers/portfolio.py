@@ -3,19 +3,70 @@
 import asyncio
 import json
 import logging
-from typing import Annotated
+from decimal import Decimal
+from typing import Annotated, Any, Literal
 
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
 
-from app.claude_client import ClaudeClient
+from app.claude_client import ClaudeClient, ClaudeResponse
 from app.config import Settings, get_settings
-from app.models import PortfolioAnalyzeRequest, PortfolioAnalyzeResponse
-from app.prompts import SYSTEM_PROMPT
-from app.utils.async_helpers import CircuitBreakerOpen
+from app.models import (
+    AnalysisPatchRequest,
+    ClarificationAnswer,
+    ClarificationAnswersRequest,
+    DeferredJobResponse,
+    PortfolioAnalyzeRequest,
+    PortfolioAnalyzeResponse,
+    PortfolioEstimateResponse,
+    PropertyCGTResult,
+    StructuredAnalysis,
+    TimelineProperty,
+    UsageStats,
+)
+from app.prompts import (
+    CGT_ANALYSIS_TOOL,
+    CGT_ANALYSIS_TOOL_CHOICE,
+    STRUCTURED_OUTPUT_INSTRUCTION,
+    select_system_prompt,
+)
+from app.utils.analysis_store import (
+    AnalysisStore,
+    StoredAnalysis,
+    address_key,
+    fingerprint_properties,
+    get_analysis_store,
+)
+from app.utils.async_helpers import CircuitBreakerOpen, LoadShed, run_with_timeout
+from app.utils.deferred_jobs import DeferredJob, DeferredJobQueue, get_job_queue
+from app.utils.fast_json import FastJSONResponse, RawJSONResponse, model_bytes
+from app.utils.json_patch import JsonPatchError, apply_history_patch
+from app.utils.local_estimate import LOCAL_ESTIMATE_MODEL, local_cgt_estimate
+from app.utils.prompt_format import (
+    PromptFormat,
+    as_prompt_block,
+    dump_json,
+    format_event_table,
+    format_scalars,
+)
+from app.utils.response_cache import (
+    SLIM_EXCLUDE,
+    CachedAnalysis,
+    ResponseCache,
+    analysis_cache_key,
+    get_response_cache,
+    request_hash,
+)
+from app.utils.session_store import ConversationSession, SessionStore, get_session_store
+from app.utils.token_estimator import choose_max_tokens
 
 logger = logging.getLogger(__name__)
 
-router = APIRouter(prefix="/api/v1", tags=["Portfolio Analysis"])
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["Portfolio Analysis"],
+    default_response_class=FastJSONResponse,
+)
 
 
 async def get_claude_client() -> ClaudeClient:
@@ -26,11 +77,38 @@ async def get_app_settings() -> Settings:
     return get_settings()
 
 
+async def get_sessions() -> SessionStore:
+    return get_session_store()
+
+
+async def get_analyses() -> AnalysisStore:
+    return get_analysis_store()
+
+
+async def get_responses() -> ResponseCache:
+    return get_response_cache()
+
+
+async def get_jobs() -> DeferredJobQueue:
+    return get_job_queue()
+
+
 ClaudeClientDep = Annotated[ClaudeClient, Depends(get_claude_client)]
 SettingsDep = Annotated[Settings, Depends(get_app_settings)]
+SessionStoreDep = Annotated[SessionStore, Depends(get_sessions)]
+AnalysisStoreDep = Annotated[AnalysisStore, Depends(get_analyses)]
+ResponseCacheDep = Annotated[ResponseCache, Depends(get_responses)]
+JobQueueDep = Annotated[DeferredJobQueue, Depends(get_jobs)]
+ResponseShapeQuery = Annotated[
+    Literal["full", "slim"],
+    Query(description="slim = omit the echoed properties to save bandwidth"),
+]
 
 
-def format_portfolio_for_claude(body: PortfolioAnalyzeRequest) -> str:
+def format_portfolio_for_claude(
+    body: PortfolioAnalyzeRequest,
+    prompt_format: PromptFormat = PromptFormat.PRETTY,
+) -> str:
     formatted_data = {
         "properties": [],
         "user_query": body.user_query or "Please analyze my CGT obligations",
@@ -56,50 +134,1001 @@ def format_portfolio_for_claude(body: PortfolioAnalyzeRequest) -> str:
             if event.improvement_cost is not None: event_data["improvement_cost"] = float(event.improvement_cost)
             property_data["property_history"].append(event_data)
         formatted_data["properties"].append(property_data)
-    
-    return json.dumps(formatted_data, indent=2)
+
+    if prompt_format is PromptFormat.TABLE:
+        return format_portfolio_tables(formatted_data)
+    return dump_json(formatted_data, prompt_format)
+
+
+def format_portfolio_tables(formatted_data: dict[str, Any]) -> str:
+    """Render formatted portfolio data as one event table per property."""
+    sections = [
+        f"user_query: {formatted_data['user_query']}",
+        f"additional_info: {format_scalars(formatted_data['additional_info'])}",
+    ]
+    for index, prop in enumerate(formatted_data["properties"], start=1):
+        section = f"### Property {index}: {prop['address']}"
+        if prop["notes"]:
+            section += f"\nnotes: {prop['notes']}"
+        section += "\n" + format_event_table(prop["property_history"])
+        sections.append(section)
+    return "\n\n".join(sections)
+
+
+def build_portfolio_message(body: PortfolioAnalyzeRequest, settings: Settings) -> str:
+    """Build the user message for a portfolio analysis."""
+    prompt_format = PromptFormat(settings.prompt_format)
+    formatted_data = format_portfolio_for_claude(body, prompt_format)
+    user_query = body.user_query or "Please analyze my CGT obligations"
+    instruction = (
+        STRUCTURED_OUTPUT_INSTRUCTION
+        if body.output_format == "structured"
+        else "Provide comprehensive CGT analysis following your system prompt format."
+    )
+
+    answers = ""
+    if body.verification_responses:
+        answers = (
+            "\n\nAnswers to earlier clarification questions:\n"
+            + format_clarification_answers(body.verification_responses)
+        )
+
+    return f"""Please analyze the following property portfolio:
+
+{as_prompt_block(formatted_data, prompt_format)}
+
+User Question: {user_query}{answers}
+
+{instruction}"""
+
+
+def format_clarification_answers(answers: list[ClarificationAnswer]) -> str:
+    """Render clarification answers as a bullet list."""
+    lines = []
+    for answer in answers:
+        subject = " ".join(
+            part
+            for part in (
+                f"[{answer.question_id}]" if answer.question_id else "",
+                answer.property_address or "",
+                (
+                    f"({answer.issue_period.start_date} to {answer.issue_period.end_date})"
+                    if answer.issue_period
+                    else ""
+                ),
+            )
+            if part
+        )
+        question = answer.resolution_question or "Clarification"
+        prefix = f"{subject}: " if subject else ""
+        lines.append(f"- {prefix}{question}\n  Answer: {answer.user_response}")
+    return "\n".join(lines)
+
+
+def build_clarification_message(answers: list[ClarificationAnswer]) -> str:
+    """Build the user turn that resumes an analysis with clarification answers."""
+    return f"""Answers to your clarification questions:
+
+{format_clarification_answers(answers)}
+
+Update the analysis using these answers. {STRUCTURED_OUTPUT_INSTRUCTION}"""
+
+
+def build_incremental_message(
+    body: PortfolioAnalyzeRequest,
+    changed: list[int],
+    reused: list[PropertyCGTResult],
+    previous_summary: str,
+    settings: Settings,
+) -> str:
+    """
+    Build the user message that re-analyses only the edited properties.
+
+    The stored summary is sent as context and a whole-portfolio summary is
+    requested, because the merged analysis keeps the summary of this call.
+    """
+    prompt_format = PromptFormat(settings.prompt_format)
+    subset = body.model_copy(update={"properties": [body.properties[i] for i in changed]})
+    formatted_data = format_portfolio_for_claude(subset, prompt_format)
+    unchanged = dump_json(
+        [result.model_dump(mode="json") for result in reused], PromptFormat.COMPACT
+    )
+
+    return f"""Please update an existing CGT analysis. These properties have new event histories:
+
+{as_prompt_block(formatted_data, prompt_format)}
+
+Results already calculated for the unchanged properties (context only):
+
+{as_prompt_block(unchanged, PromptFormat.COMPACT)}
+
+Previous summary of the whole portfolio:
+
+{previous_summary}
+
+Record results for the changed properties. Include an unchanged property only if these changes
+alter its result (for example through the main residence choice).
+Write the summary for the whole portfolio by updating the previous summary, not only for the
+changed properties.
+{STRUCTURED_OUTPUT_INSTRUCTION}"""
+
+
+def merge_incremental_results(
+    body: PortfolioAnalyzeRequest,
+    stored: StoredAnalysis,
+    fingerprints: list[str],
+    partial: StructuredAnalysis,
+) -> StructuredAnalysis:
+    """
+    Combine reused per-property results with a partial re-analysis.
+
+    Results returned by the partial analysis take precedence (matched by
+    address); other properties keep their stored result. Clarification
+    questions about unchanged properties are carried over. The summary comes
+    from the partial analysis, which is asked to cover the whole portfolio.
+    """
+    fresh = {address_key(result.address): result for result in partial.properties}
+    properties: list[PropertyCGTResult] = []
+    unchanged_addresses = set()
+    for prop, fingerprint in zip(body.properties, fingerprints):
+        key = address_key(prop.address)
+        found, result = stored.result_for(fingerprint)
+        if found:
+            unchanged_addresses.add(key)
+        result = fresh.pop(key, result if found else None)
+        if result is not None:
+            properties.append(result)
+    properties.extend(fresh.values())
+
+    carried_questions = [
+        question
+        for question in stored.analysis.clarification_questions
+        if question.property_address
+        and address_key(question.property_address) in unchanged_addresses
+    ]
+    return StructuredAnalysis(
+        summary=partial.summary,
+        properties=properties,
+        clarification_questions=[*partial.clarification_questions, *carried_questions],
+    )
+
+
+def parse_structured_analysis(response: ClaudeResponse) -> StructuredAnalysis:
+    """Validate the analysis tool input into typed results."""
+    if response.tool_input is None:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Claude did not return a structured analysis",
+        )
+    try:
+        return StructuredAnalysis.model_validate(response.tool_input)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail=f"Claude returned an invalid structured analysis: {e.error_count()} error(s)",
+        )
+
+
+def portfolio_max_tokens(body: PortfolioAnalyzeRequest, settings: Settings) -> int:
+    """Output budget proportional to the properties and events, at least claude_max_tokens."""
+    return choose_max_tokens(
+        property_count=len(body.properties),
+        event_count=sum(len(prop.property_history) for prop in body.properties),
+        base=settings.max_tokens_base,
+        per_property=settings.max_tokens_per_property,
+        per_event=settings.max_tokens_per_event,
+        ceiling=settings.claude_max_tokens_ceiling,
+        floor=settings.claude_max_tokens,
+    )
+
+
+def analysis_answer(response: ClaudeResponse, structured: bool) -> str:
+    """Assistant turn recorded for an analysis call (tool input JSON or markdown)."""
+    return json.dumps(response.tool_input) if structured else response.content.rstrip()
+
+
+def open_session(
+    sessions: SessionStore,
+    settings: Settings,
+    answer: str,
+    structured_analysis: StructuredAnalysis | None,
+    body: PortfolioAnalyzeRequest,
+    system_prompt: list[dict[str, Any]],
+    profile: str,
+    user_message: str,
+) -> ConversationSession | None:
+    """Open a follow-up session (and clarification round, if needed) for an analysis."""
+    if not settings.sessions_enabled or not answer:
+        return None
+
+    # Same system blocks and tools as this call, so follow-ups reuse its cache
+    session = sessions.create(
+        system_prompt=system_prompt,
+        prompt_profile=profile,
+        user_message=user_message,
+        answer=answer,
+        tools=[CGT_ANALYSIS_TOOL] if structured_analysis is not None else None,
+        portfolio=body,
+    )
+    if structured_analysis is not None and structured_analysis.needs_clarification:
+        sessions.open_clarification(session, structured_analysis.clarification_questions)
+    return session
+
+
+def should_decompose(body: PortfolioAnalyzeRequest, settings: Settings) -> bool:
+    """Whether to analyse properties separately and then synthesise."""
+    if len(body.properties) < 2:
+        return False
+    if body.decompose is not None:
+        return body.decompose
+    return (
+        body.output_format == "structured"
+        and settings.decompose_min_properties > 0
+        and len(body.properties) >= settings.decompose_min_properties
+    )
+
+
+def summarise_timeline(prop: TimelineProperty) -> str:
+    """One-line event summary, e.g. "purchase 2015-01-01, move_in 2015-02-01"."""
+    return ", ".join(f"{event.event} {event.date}" for event in prop.property_history)
+
+
+def build_property_message(body: PortfolioAnalyzeRequest, settings: Settings) -> str:
+    """
+    Build the message for a standalone single-property analysis.
+
+    Only the property itself (and portfolio-wide additional_info) is included,
+    so the result can be cached and reused whatever the other properties are.
+    """
+    prompt_format = PromptFormat(settings.prompt_format)
+    formatted_data = format_portfolio_for_claude(body, prompt_format)
+
+    return f"""Please analyze this property from a larger portfolio on its own:
+
+{as_prompt_block(formatted_data, prompt_format)}
+
+Treat it as the main residence for every period the owner lived in it; main residence choices
+and loss offsets across properties are resolved in a later step. {STRUCTURED_OUTPUT_INSTRUCTION}"""
+
+
+def needs_synthesis(body: PortfolioAnalyzeRequest, analyses: list[StructuredAnalysis]) -> bool:
+    """
+    Whether per-property results interact.
+
+    True if more than one property was lived in (competing main residence
+    periods) or the results mix capital gains and losses (loss offsets).
+    """
+    lived_in = sum(
+        1
+        for prop in body.properties
+        if any(event.event == "move_in" for event in prop.property_history)
+    )
+    gains = [result.net_capital_gain for analysis in analyses for result in analysis.properties]
+    return lived_in > 1 or (any(g < 0 for g in gains) and any(g > 0 for g in gains))
+
+
+def build_synthesis_message(
+    body: PortfolioAnalyzeRequest, results: list[PropertyCGTResult]
+) -> str:
+    """Build the message that reconciles independently calculated property results."""
+    results_json = dump_json(
+        [result.model_dump(mode="json") for result in results], PromptFormat.COMPACT
+    )
+    timelines = "\n".join(
+        f"- {prop.address}: {summarise_timeline(prop)}" for prop in body.properties
+    )
+    user_query = body.user_query or "Please analyze my CGT obligations"
+
+    return f"""These CGT results were calculated separately for each property in one portfolio:
+
+{as_prompt_block(results_json, PromptFormat.COMPACT)}
+
+Property timelines:
+{timelines}
+
+User Question: {user_query}
+
+Resolve interactions between the properties: where main residence periods overlap, nominate one
+main residence at a time (allowing the 6-month overlap in s118-140) to minimise total tax, and
+apply capital losses against capital gains before the CGT discount (s102-5). Return the final
+result for every property with a CGT event. {STRUCTURED_OUTPUT_INSTRUCTION}"""
+
+
+def combine_responses(responses: list[ClaudeResponse], model: str) -> ClaudeResponse:
+    """Sum usage across the calls of a decomposed analysis."""
+    return ClaudeResponse(
+        content="",
+        usage=UsageStats(
+            input_tokens=sum(r.usage.input_tokens for r in responses),
+            output_tokens=sum(r.usage.output_tokens for r in responses),
+            cache_creation_input_tokens=sum(r.usage.cache_creation_input_tokens for r in responses),
+            cache_read_input_tokens=sum(r.usage.cache_read_input_tokens for r in responses),
+            estimated_cost_usd=sum((r.usage.estimated_cost_usd for r in responses), Decimal("0")),
+        ),
+        # No calls at all means every property came from the result cache
+        cached=all(r.cached for r in responses),
+        model=model,
+        latency_ms=0.0,
+        stop_reason=responses[-1].stop_reason if responses else None,
+    )
+
+
+async def analyze_property(
+    body: PortfolioAnalyzeRequest,
+    fingerprint: str,
+    claude_client: ClaudeClient,
+    settings: Settings,
+    analyses: AnalysisStore,
+) -> tuple[StructuredAnalysis, ClaudeResponse | None]:
+    """Analyse a single-property portfolio, reusing a cached standalone result."""
+    cached = analyses.get_property_analysis(fingerprint)
+    if cached is not None:
+        return cached, None
+
+    system_prompt, profile = select_system_prompt(
+        body.model_dump(mode="json"),
+        modular=settings.modular_system_prompt,
+        structured=True,
+    )
+    response = await claude_client.send_message(
+        user_message=build_property_message(body, settings),
+        system_prompt=system_prompt,
+        max_tokens=portfolio_max_tokens(body, settings),
+        prompt_profile=profile,
+        tools=[CGT_ANALYSIS_TOOL],
+        tool_choice=CGT_ANALYSIS_TOOL_CHOICE,
+    )
+    analysis = parse_structured_analysis(response)
+    analyses.save_property_analysis(fingerprint, analysis)
+    return analysis, response
+
+
+async def analyze_decomposed(
+    request_id: str,
+    body: PortfolioAnalyzeRequest,
+    claude_client: ClaudeClient,
+    settings: Settings,
+    sessions: SessionStore,
+    analyses: AnalysisStore,
+) -> PortfolioAnalyzeResponse:
+    """
+    Map-reduce analysis: one concurrent call per property, then a synthesis call.
+
+    Per-property calls run concurrently under the client's concurrency limit,
+    so latency tracks the slowest property rather than the sum. If one fails,
+    the rest are cancelled and its error is raised. The synthesis
+    call is skipped when the results cannot interact.
+    """
+    fingerprints = fingerprint_properties(body)
+    try:
+        # A failed property cancels the others, so no upstream call runs unobserved
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(
+                    analyze_property(
+                        body.model_copy(update={"properties": [prop]}),
+                        fingerprint,
+                        claude_client,
+                        settings,
+                        analyses,
+                    )
+                )
+                for prop, fingerprint in zip(body.properties, fingerprints)
+            ]
+    except ExceptionGroup as errors:
+        raise errors.exceptions[0]
+    outcomes = [task.result() for task in tasks]
+    property_analyses = [analysis for analysis, _ in outcomes]
+    responses = [response for _, response in outcomes if response is not None]
+    results = [result for analysis in property_analyses for result in analysis.properties]
+    questions = [q for analysis in property_analyses for q in analysis.clarification_questions]
+
+    system_prompt, profile = select_system_prompt(
+        body.model_dump(mode="json"),
+        modular=settings.modular_system_prompt,
+        structured=True,
+    )
+    synthesised = needs_synthesis(body, property_analyses)
+    if synthesised:
+        synthesis = await claude_client.send_message(
+            user_message=build_synthesis_message(body, results),
+            system_prompt=system_prompt,
+            max_tokens=settings.synthesis_max_tokens,
+            prompt_profile=profile,
+            tools=[CGT_ANALYSIS_TOOL],
+            tool_choice=CGT_ANALYSIS_TOOL_CHOICE,
+        )
+        responses.append(synthesis)
+        reconciled = parse_structured_analysis(synthesis)
+        structured_analysis = reconciled.model_copy(
+            update={"clarification_questions": [*reconciled.clarification_questions, *questions]}
+        )
+    else:
+        structured_analysis = StructuredAnalysis(
+            summary=" ".join(analysis.summary for analysis in property_analyses),
+            properties=results,
+            clarification_questions=questions,
+        )
+
+    cached_properties = len(body.properties) - len(responses) + synthesised
+    logger.info(
+        f"[{request_id}] Decomposed analysis completed: properties={len(body.properties)}, "
+        f"calls={len(responses)}, cached_properties={cached_properties}, "
+        f"synthesis={synthesised}"
+    )
+
+    stored = analyses.save(body, structured_analysis)
+    session = open_session(
+        sessions,
+        settings,
+        structured_analysis.model_dump_json(
+            exclude={"total_net_capital_gain", "needs_clarification"}
+        ),
+        structured_analysis,
+        body,
+        system_prompt,
+        profile,
+        build_portfolio_message(body.model_copy(update={"output_format": "structured"}), settings),
+    )
+    return build_analysis_response(
+        combine_responses(responses, claude_client.model),
+        structured_analysis,
+        body,
+        session,
+        stored,
+        analysis_mode="decomposed",
+    )
+
+
+def shape_response(
+    result: PortfolioAnalyzeResponse, shape: str
+) -> PortfolioAnalyzeResponse | RawJSONResponse:
+    """Return the full response model, or its slim form serialised without the echo."""
+    if shape == "slim":
+        return RawJSONResponse(model_bytes(result, exclude=SLIM_EXCLUDE))
+    return result
+
+
+def build_analysis_response(
+    response: ClaudeResponse,
+    structured_analysis: StructuredAnalysis | None,
+    body: PortfolioAnalyzeRequest,
+    session: ConversationSession | None,
+    stored: StoredAnalysis | None = None,
+    reanalysed_properties: list[str] | None = None,
+    analysis_mode: Literal["single", "decomposed"] = "single",
+) -> PortfolioAnalyzeResponse:
+    """Assemble the API response for a resumed, incremental or decomposed analysis."""
+    return PortfolioAnalyzeResponse(
+        analysis=structured_analysis.summary if structured_analysis else response.content,
+        structured=structured_analysis,
+        properties=body.properties,
+        request_hash=request_hash(body),
+        input_tokens=response.usage.input_tokens,
+        output_tokens=response.usage.output_tokens,
+        cached=response.cached,
+        model=response.model,
+        estimated_cost_usd=response.usage.estimated_cost_usd,
+        stop_reason=response.stop_reason,
+        session_id=session.session_id if session else None,
+        clarification_id=session.clarification_id if session else None,
+        analysis_id=stored.analysis_id if stored else None,
+        reanalysed_properties=reanalysed_properties,
+        analysis_mode=analysis_mode,
+    )
 
 
 @router.post("/analyze-portfolio", response_model=PortfolioAnalyzeResponse)
-async def analyze_portfolio(request: Request, body: PortfolioAnalyzeRequest, claude_client: ClaudeClientDep, settings: SettingsDep) -> PortfolioAnalyzeResponse:
+async def analyze_portfolio(
+    request: Request,
+    body: PortfolioAnalyzeRequest,
+    claude_client: ClaudeClientDep,
+    settings: SettingsDep,
+    sessions: SessionStoreDep,
+    analyses: AnalysisStoreDep,
+    response_cache: ResponseCacheDep,
+    jobs: JobQueueDep,
+    shape: ResponseShapeQuery = "full",
+) -> PortfolioAnalyzeResponse | Response:
     request_id = getattr(request.state, "request_id", "unknown")
     logger.info(f"[{request_id}] Portfolio analysis request: {len(body.properties)} properties")
 
     try:
-        formatted_data = format_portfolio_for_claude(body)
-        user_query = body.user_query or "Please analyze my CGT obligations"
-        
-        user_message = f"""Please analyze the following property portfolio:
+        if body.clarification_id and body.verification_responses:
+            session = sessions.get_clarification(body.clarification_id)
+            if session is not None:
+                result = await resume_analysis(
+                    request_id, session, body.verification_responses,
+                    claude_client, settings, sessions, analyses,
+                )
+                return shape_response(result, shape)
+            logger.info(
+                f"[{request_id}] Clarification {body.clarification_id} not found, "
+                "re-running full analysis with answers"
+            )
 
-```json
-{formatted_data}
-```
+        cache_key = None
+        if settings.response_cache_enabled and not body.verification_responses:
+            cache_key = analysis_cache_key(body, settings)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                session, analysis_id = fork_cached_analysis(cached, settings, sessions, analyses)
+                logger.info(f"[{request_id}] Portfolio analysis served from response cache")
+                return RawJSONResponse(
+                    ResponseCache.render(cached, session, analysis_id, slim=shape == "slim"),
+                    headers={"X-Cache": "HIT"},
+                )
 
-User Question: {user_query}
+        result = await analyze_and_cache(
+            request_id, body, claude_client, settings, sessions, analyses, response_cache, cache_key
+        )
+        return shape_response(result, shape)
+
+    except LoadShed:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Timeout")
+    except CircuitBreakerOpen:
+        if not settings.degraded_mode_enabled:
+            raise
+        return degraded_response(
+            request_id, body, settings, sessions, analyses, response_cache, jobs, shape
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"[{request_id}] Error: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
-Provide comprehensive CGT analysis following your system prompt format."""
 
-        response = await asyncio.wait_for(
-            claude_client.send_message(user_message=user_message, system_prompt=SYSTEM_PROMPT),
+async def analyze_and_cache(
+    request_id: str,
+    body: PortfolioAnalyzeRequest,
+    claude_client: ClaudeClient,
+    settings: Settings,
+    sessions: SessionStore,
+    analyses: AnalysisStore,
+    response_cache: ResponseCache,
+    cache_key: str | None,
+) -> PortfolioAnalyzeResponse:
+    """Run a full analysis, single or decomposed, and cache it under cache_key if given."""
+    if should_decompose(body, settings):
+        result = await run_with_timeout(
+            analyze_decomposed(request_id, body, claude_client, settings, sessions, analyses),
             timeout=settings.request_timeout_seconds,
         )
+    else:
+        result = await analyze_single(request_id, body, claude_client, settings, sessions, analyses)
+
+    # Truncated answers are not worth replaying
+    if cache_key is not None and result.stop_reason != "max_tokens":
+        session = sessions.get(result.session_id) if result.session_id else None
+        stored = analyses.get(result.analysis_id) if result.analysis_id else None
+        response_cache.put(cache_key, result, session, stored)
+    return result
+
+
+def fork_cached_analysis(
+    cached: CachedAnalysis,
+    settings: Settings,
+    sessions: SessionStore,
+    analyses: AnalysisStore,
+) -> tuple[ConversationSession | None, str | None]:
+    """Give a cache hit its own follow-up session and patchable analysis_id."""
+    session = None
+    if cached.session_template is not None and settings.sessions_enabled:
+        session = sessions.fork(cached.session_template)
+    analysis_id = None
+    if cached.analysis_template is not None:
+        template = cached.analysis_template
+        analysis_id = analyses.save(template.request, template.analysis).analysis_id
+    return session, analysis_id
+
+
+def degraded_response(
+    request_id: str,
+    body: PortfolioAnalyzeRequest,
+    settings: Settings,
+    sessions: SessionStore,
+    analyses: AnalysisStore,
+    response_cache: ResponseCache,
+    jobs: DeferredJobQueue,
+    shape: str,
+) -> RawJSONResponse:
+    """
+    Answer while the circuit breaker is open instead of failing with 503.
+
+    Serves the last cached analysis of the same request however stale, or
+    else a local estimate. Either way the full analysis is queued to run once
+    the circuit closes; its job_id lets the client fetch it, and its result
+    refreshes the response cache.
+    """
+    key = analysis_cache_key(body, settings)
+    job = jobs.enqueue(key, body)
+    job_id = job.job_id if job else None
+    slim = shape == "slim"
+
+    stale = None
+    if settings.response_cache_enabled and not body.verification_responses:
+        stale = response_cache.get_stale(key)
+    if stale is not None:
+        session, analysis_id = fork_cached_analysis(stale, settings, sessions, analyses)
+        logger.warning(f"[{request_id}] Circuit open, serving stale cached analysis (job {job_id})")
+        return RawJSONResponse(
+            ResponseCache.render(
+                stale, session, analysis_id, slim=slim, degraded=True, job_id=job_id
+            ),
+            headers={"X-Degraded": "stale-cache"},
+        )
 
-        logger.info(f"[{request_id}] Portfolio analysis completed")
+    estimate = local_cgt_estimate(body)
+    logger.warning(f"[{request_id}] Circuit open, serving local estimate (job {job_id})")
+    result = PortfolioAnalyzeResponse(
+        analysis=estimate.summary,
+        structured=estimate,
+        properties=body.properties,
+        request_hash=request_hash(body),
+        input_tokens=0,
+        output_tokens=0,
+        cached=False,
+        model=LOCAL_ESTIMATE_MODEL,
+        estimated_cost_usd=Decimal("0"),
+        degraded=True,
+        job_id=job_id,
+    )
+    return RawJSONResponse(
+        model_bytes(result, exclude=SLIM_EXCLUDE if slim else None),
+        headers={"X-Degraded": "local-estimate"},
+    )
 
-        return PortfolioAnalyzeResponse(
-            analysis=response.content,
-            properties=body.properties,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-            cached=response.cached,
-            model=response.model,
-            estimated_cost_usd=response.usage.estimated_cost_usd,
+
+async def run_deferred_job(
+    claude_client: ClaudeClient, settings: Settings, job: DeferredJob
+) -> PortfolioAnalyzeResponse:
+    """Run a full analysis deferred during an outage, refreshing the response cache."""
+    cacheable = settings.response_cache_enabled and not job.request.verification_responses
+    return await analyze_and_cache(
+        f"job-{job.job_id}",
+        job.request,
+        claude_client,
+        settings,
+        get_session_store(),
+        get_analysis_store(),
+        get_response_cache(),
+        job.key if cacheable else None,
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=DeferredJobResponse)
+async def get_deferred_job(job_id: str, jobs: JobQueueDep) -> DeferredJobResponse:
+    """Poll a full analysis queued while the AI analysis was unavailable."""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found or expired",
         )
+    return DeferredJobResponse(
+        job_id=job.job_id, status=job.status, result=job.result, error=job.error
+    )
+
+
+async def analyze_single(
+    request_id: str,
+    body: PortfolioAnalyzeRequest,
+    claude_client: ClaudeClient,
+    settings: Settings,
+    sessions: SessionStore,
+    analyses: AnalysisStore,
+) -> PortfolioAnalyzeResponse:
+    """Analyse the whole portfolio in one call."""
+    structured = body.output_format == "structured"
+    user_message = build_portfolio_message(body, settings)
+    system_prompt, profile = select_system_prompt(
+        body.model_dump(mode="json"),
+        modular=settings.modular_system_prompt,
+        structured=structured,
+    )
+    max_tokens = portfolio_max_tokens(body, settings)
+
+    response = await run_with_timeout(
+        claude_client.send_message(
+            user_message=user_message,
+            system_prompt=system_prompt,
+            max_tokens=max_tokens,
+            prompt_profile=profile,
+            tools=[CGT_ANALYSIS_TOOL] if structured else None,
+            tool_choice=CGT_ANALYSIS_TOOL_CHOICE if structured else None,
+            cache_message=settings.sessions_enabled,
+        ),
+        timeout=settings.request_timeout_seconds,
+    )
 
+    logger.info(
+        f"[{request_id}] Portfolio analysis completed: "
+        f"prompt_profile={profile}, max_tokens={max_tokens}"
+    )
+
+    structured_analysis = parse_structured_analysis(response) if structured else None
+    stored = analyses.save(body, structured_analysis) if structured_analysis else None
+    session = open_session(
+        sessions, settings, analysis_answer(response, structured), structured_analysis,
+        body, system_prompt, profile, user_message,
+    )
+
+    return build_analysis_response(response, structured_analysis, body, session, stored)
+
+
+@router.post("/clarifications/{clarification_id}/answers", response_model=PortfolioAnalyzeResponse)
+async def answer_clarification(
+    request: Request,
+    clarification_id: str,
+    body: ClarificationAnswersRequest,
+    claude_client: ClaudeClientDep,
+    settings: SettingsDep,
+    sessions: SessionStoreDep,
+    analyses: AnalysisStoreDep,
+    shape: ResponseShapeQuery = "full",
+) -> PortfolioAnalyzeResponse | Response:
+    """
+    Resume a structured analysis with answers to its clarification questions.
+
+    The first-pass conversation is continued from its cached prefix instead of
+    re-analysing the portfolio from scratch.
+    """
+    request_id = getattr(request.state, "request_id", "unknown")
+
+    session = sessions.get_clarification(clarification_id)
+    if session is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Clarification not found, already answered or expired",
+        )
+
+    try:
+        result = await resume_analysis(
+            request_id, session, body.answers, claude_client, settings, sessions, analyses
+        )
+        return shape_response(result, shape)
+    except LoadShed:
+        raise
     except asyncio.TimeoutError:
         raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Timeout")
-    except CircuitBreakerOpen:
+    except (CircuitBreakerOpen, HTTPException):
         raise
     except Exception as e:
-        logger.error(f"[{request_id}] Error: {e}")
+        logger.error(f"[{request_id}] Clarification error: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+async def resume_analysis(
+    request_id: str,
+    session: ConversationSession,
+    answers: list[ClarificationAnswer],
+    claude_client: ClaudeClient,
+    settings: Settings,
+    sessions: SessionStore,
+    analyses: AnalysisStore,
+) -> PortfolioAnalyzeResponse:
+    """
+    Continue a session waiting on clarification with the user's answers.
+
+    Raises:
+        HTTPException: 409 if the round was already answered or the session is
+            out of turns, 422 if an answer names an unknown question.
+    """
+    clarification_id = session.clarification_id
+    pending_ids = {question.question_id for question in session.pending_questions}
+    unknown = sorted(
+        answer.question_id
+        for answer in answers
+        if answer.question_id and answer.question_id not in pending_ids
+    )
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail=f"Unknown question_id(s): {', '.join(unknown)}",
+        )
+
+    async with session.lock:
+        if session.clarification_id != clarification_id:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Clarification was already answered",
+            )
+        if session.turns >= settings.session_max_turns:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Session reached the limit of {settings.session_max_turns} turns",
+            )
+
+        message = build_clarification_message(answers)
+        response = await run_with_timeout(
+            claude_client.send_conversation(
+                messages=[*session.messages, {"role": "user", "content": message}],
+                system_prompt=session.system_prompt,
+                max_tokens=portfolio_max_tokens(session.portfolio, settings),
+                prompt_profile=session.prompt_profile,
+                tools=session.tools,
+                tool_choice=CGT_ANALYSIS_TOOL_CHOICE,
+            ),
+            timeout=settings.request_timeout_seconds,
+        )
+        structured_analysis = parse_structured_analysis(response)
+
+        session.add_turn(
+            message, json.dumps(response.tool_input), response.usage.estimated_cost_usd
+        )
+        sessions.close_clarification(session)
+        if structured_analysis.needs_clarification:
+            sessions.open_clarification(session, structured_analysis.clarification_questions)
+
+    logger.info(
+        f"[{request_id}] Resumed analysis for session {session.session_id}: "
+        f"{len(answers)} answer(s), cache_read={response.usage.cache_read_input_tokens}, "
+        f"needs_clarification={structured_analysis.needs_clarification}"
+    )
+
+    stored = analyses.save(session.portfolio, structured_analysis)
+    return build_analysis_response(
+        response, structured_analysis, session.portfolio, session, stored
+    )
+
+
+@router.post("/analyses/{analysis_id}/patch", response_model=PortfolioAnalyzeResponse)
+async def patch_analysis(
+    request: Request,
+    analysis_id: str,
+    body: AnalysisPatchRequest,
+    claude_client: ClaudeClientDep,
+    settings: SettingsDep,
+    sessions: SessionStoreDep,
+    analyses: AnalysisStoreDep,
+    shape: ResponseShapeQuery = "full",
+) -> PortfolioAnalyzeResponse | Response:
+    """
+    Re-analyse a structured analysis after editing property event histories.
+
+    Properties whose inputs are unchanged keep their stored result; only the
+    edited ones are sent to Claude, with the other results as context. A patch
+    that leaves every property unchanged returns the stored analysis without
+    calling Claude.
+    """
+    request_id = getattr(request.state, "request_id", "unknown")
+
+    stored = analyses.get(analysis_id)
+    if stored is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Analysis not found or expired",
+        )
+
+    base = stored.request.model_dump(mode="json")
+    try:
+        patched_data, _ = apply_history_patch({"properties": base["properties"]}, body.patch)
+        patched = PortfolioAnalyzeRequest.model_validate(
+            {
+                **base,
+                "properties": patched_data["properties"],
+                "user_query": body.user_query or base["user_query"],
+                "clarification_id": None,
+                "verification_responses": [],
+            }
+        )
+    except JsonPatchError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_CONTENT, detail=str(e))
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_CONTENT,
+            detail=f"Patched portfolio is invalid: {e.error_count()} error(s)",
+        )
+
+    fingerprints = fingerprint_properties(patched)
+    changed: list[int] = []
+    reused: list[PropertyCGTResult] = []
+    for index, fingerprint in enumerate(fingerprints):
+        found, result = stored.result_for(fingerprint)
+        if not found:
+            changed.append(index)
+        elif result is not None:
+            reused.append(result)
+
+    if not changed and body.user_query is None:
+        logger.info(f"[{request_id}] Patch left analysis {analysis_id} unchanged")
+        unchanged = PortfolioAnalyzeResponse(
+            analysis=stored.analysis.summary,
+            structured=stored.analysis,
+            properties=patched.properties,
+            request_hash=request_hash(patched),
+            input_tokens=0,
+            output_tokens=0,
+            cached=True,
+            model=claude_client.model,
+            estimated_cost_usd=Decimal("0"),
+            analysis_id=stored.analysis_id,
+            reanalysed_properties=[],
+        )
+        return shape_response(unchanged, shape)
+
+    # A new question may change every answer, so re-run all properties
+    if not changed:
+        changed = list(range(len(patched.properties)))
+        reused = []
+
+    try:
+        user_message = build_incremental_message(
+            patched, changed, reused, stored.analysis.summary, settings
+        )
+        system_prompt, profile = select_system_prompt(
+            patched.model_dump(mode="json"),
+            modular=settings.modular_system_prompt,
+            structured=True,
+        )
+        subset = patched.model_copy(update={"properties": [patched.properties[i] for i in changed]})
+        max_tokens = portfolio_max_tokens(subset, settings)
+
+        response = await run_with_timeout(
+            claude_client.send_message(
+                user_message=user_message,
+                system_prompt=system_prompt,
+                max_tokens=max_tokens,
+                prompt_profile=profile,
+                tools=[CGT_ANALYSIS_TOOL],
+                tool_choice=CGT_ANALYSIS_TOOL_CHOICE,
+                cache_message=settings.sessions_enabled,
+            ),
+            timeout=settings.request_timeout_seconds,
+        )
+
+        partial = parse_structured_analysis(response)
+        merged = merge_incremental_results(patched, stored, fingerprints, partial)
+        stored_patched = analyses.save(patched, merged)
+        session = open_session(
+            sessions, settings, analysis_answer(response, structured=True), merged,
+            patched, system_prompt, profile, user_message,
+        )
+
+        reanalysed = [patched.properties[i].address for i in changed]
+        logger.info(
+            f"[{request_id}] Incremental analysis of {analysis_id}: "
+            f"reanalysed={len(changed)}/{len(patched.properties)}, max_tokens={max_tokens}"
+        )
+
+        return shape_response(
+            build_analysis_response(response, merged, patched, session, stored_patched, reanalysed),
+            shape,
+        )
+
+    except LoadShed:
+        raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Timeout")
+    except (CircuitBreakerOpen, HTTPException):
+        raise
+    except Exception as e:
+        logger.error(f"[{request_id}] Incremental analysis error: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@router.post("/estimate", response_model=PortfolioEstimateResponse)
+async def estimate_portfolio(
+    body: PortfolioAnalyzeRequest, claude_client: ClaudeClientDep, settings: SettingsDep
+) -> PortfolioEstimateResponse:
+    """Estimate request size, output budget and worst-case cost without calling Claude."""
+    structured = body.output_format == "structured"
+    system_prompt, profile = select_system_prompt(
+        body.model_dump(mode="json"),
+        modular=settings.modular_system_prompt,
+        structured=structured,
+    )
+    estimate = claude_client.estimate_request(
+        user_message=build_portfolio_message(body, settings),
+        system_prompt=system_prompt,
+        max_tokens=portfolio_max_tokens(body, settings),
+        tools=[CGT_ANALYSIS_TOOL] if structured else None,
+    )
+    return PortfolioEstimateResponse(
+        **estimate.to_dict(),
+        prompt_profile=profile,
+        model=claude_client.model,
+    )
@@ -0,0 +1,115 @@
+"""Follow-up conversation router for questions about a completed analysis."""
+
+import asyncio
+import logging
+
+from fastapi import APIRouter, HTTPException, Request, status
+
+from app.models import SessionMessageRequest, SessionMessageResponse
+from app.routers.portfolio import ClaudeClientDep, SessionStoreDep, SettingsDep
+from app.utils.async_helpers import CircuitBreakerOpen, LoadShed, run_with_timeout
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/v1", tags=["Follow-up Sessions"])
+
+# Follow-ups on structured analyses keep the tool definition (it is part of the
+# cached prefix) but answer in text
+FOLLOW_UP_TOOL_CHOICE = {"type": "none"}
+
+
+@router.post("/sessions/{session_id}/messages", response_model=SessionMessageResponse)
+async def send_session_message(
+    request: Request,
+    session_id: str,
+    body: SessionMessageRequest,
+    claude_client: ClaudeClientDep,
+    settings: SettingsDep,
+    sessions: SessionStoreDep,
+) -> SessionMessageResponse:
+    """
+    Ask a follow-up question about an analysis.
+
+    The system prompt, portfolio and earlier turns are resent unchanged as a
+    cached prefix, so only the new question and answer are billed at full rate.
+    """
+    request_id = getattr(request.state, "request_id", "unknown")
+
+    session = sessions.get(session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or expired",
+        )
+
+    # One turn at a time per session: concurrent questions would fork the history
+    async with session.lock:
+        if session.turns >= settings.session_max_turns:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=(
+                    f"Session reached the limit of {settings.session_max_turns} "
+                    "follow-up questions"
+                ),
+            )
+
+        try:
+            response = await run_with_timeout(
+                claude_client.send_conversation(
+                    messages=[*session.messages, {"role": "user", "content": body.message}],
+                    system_prompt=session.system_prompt,
+                    max_tokens=settings.session_max_tokens,
+                    prompt_profile=session.prompt_profile,
+                    tools=session.tools,
+                    tool_choice=FOLLOW_UP_TOOL_CHOICE if session.tools else None,
+                ),
+                timeout=settings.request_timeout_seconds,
+            )
+        except LoadShed:
+            raise
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail="Timeout")
+        except (CircuitBreakerOpen, HTTPException):
+            raise
+        except Exception as e:
+            logger.error(f"[{request_id}] Follow-up error: {e}")
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+        answer = response.content.rstrip()
+        if not answer:
+            raise HTTPException(
+                status_code=status.HTTP_502_BAD_GATEWAY,
+                detail="Claude returned an empty answer",
+            )
+        session.add_turn(body.message, answer, response.usage.estimated_cost_usd)
+
+    logger.info(
+        f"[{request_id}] Follow-up {session.turns} on session {session_id}: "
+        f"cache_read={response.usage.cache_read_input_tokens}, "
+        f"input={response.usage.input_tokens}"
+    )
+
+    return SessionMessageResponse(
+        session_id=session_id,
+        answer=answer,
+        turn=session.turns,
+        input_tokens=response.usage.input_tokens,
+        output_tokens=response.usage.output_tokens,
+        cache_read_input_tokens=response.usage.cache_read_input_tokens,
+        cache_creation_input_tokens=response.usage.cache_creation_input_tokens,
+        cached=response.cached,
+        model=response.model,
+        estimated_cost_usd=response.usage.estimated_cost_usd,
+        session_cost_usd=session.total_cost_usd,
+        stop_reason=response.stop_reason,
+    )
+
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def close_session(session_id: str, sessions: SessionStoreDep) -> None:
+    """Discard a follow-up session before its TTL expires."""
+    if not sessions.delete(session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or expired",
+        )
@@ -1,19 +1,54 @@
 """Utility functions for CGT Brain API."""
 
+from .analysis_store import AnalysisStore
 from .async_helpers import (
     CircuitBreaker,
     CircuitBreakerOpen,
     ConcurrencyLimiter,
+    Deadline,
+    DeadlineExceeded,
+    GenerationMetrics,
+    Histogram,
+    LoadShed,
     RequestMetrics,
+    RetryBudget,
     with_retry,
 )
 from .cost_calculator import CostCalculator
+from .deferred_jobs import DeferredJob, DeferredJobQueue
+from .json_patch import JsonPatchError
+from .prompt_format import PromptFormat
+from .quantile_sketch import QuantileSketch, RollingQuantiles
+from .response_cache import ResponseCache
+from .session_store import ConversationSession, SessionStore
+from .token_estimator import RequestEstimate, TokenEstimator, estimate_tokens
+from .ttl_store import TTLStore
 
 __all__ = [
+    "AnalysisStore",
     "CostCalculator",
     "CircuitBreaker",
     "CircuitBreakerOpen",
     "ConcurrencyLimiter",
+    "ConversationSession",
+    "Deadline",
+    "DeadlineExceeded",
+    "DeferredJob",
+    "DeferredJobQueue",
+    "GenerationMetrics",
+    "Histogram",
+    "JsonPatchError",
+    "LoadShed",
+    "PromptFormat",
+    "QuantileSketch",
+    "RequestEstimate",
     "RequestMetrics",
+    "ResponseCache",
+    "RetryBudget",
+    "RollingQuantiles",
+    "SessionStore",
+    "TTLStore",
+    "TokenEstimator",
+    "estimate_tokens",
     "with_retry",
 ]
@@ -0,0 +1,119 @@
+"""Completed structured analyses, kept for incremental re-analysis."""
+
+import hashlib
+import json
+import uuid
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+from app.config import get_settings
+from app.models import PortfolioAnalyzeRequest, PropertyCGTResult, StructuredAnalysis
+from app.utils.ttl_store import TTLStore
+
+
+def property_fingerprint(prop: dict[str, Any], context: dict[str, Any] | None = None) -> str:
+    """
+    Stable hash of one property's inputs.
+
+    Args:
+        prop: JSON-mode TimelineProperty.
+        context: Portfolio-wide inputs that also affect the result (additional_info).
+    """
+    canonical = json.dumps([prop, context], sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def address_key(address: str) -> str:
+    """Normalise an address for matching results to properties."""
+    return " ".join(address.lower().split())
+
+
+@dataclass
+class StoredAnalysis:
+    """A structured analysis with its results indexed by property fingerprint."""
+
+    analysis_id: str
+    request: PortfolioAnalyzeRequest
+    analysis: StructuredAnalysis
+    fingerprints: list[str]
+    results: dict[str, PropertyCGTResult | None]  # fingerprint -> result (None = no CGT event)
+
+    def result_for(self, fingerprint: str) -> tuple[bool, PropertyCGTResult | None]:
+        """Return (found, result) for a property fingerprint."""
+        if fingerprint in self.results:
+            return True, self.results[fingerprint]
+        return False, None
+
+
+def fingerprint_properties(request: PortfolioAnalyzeRequest) -> list[str]:
+    """Fingerprint every property of a request, in order."""
+    data = request.model_dump(mode="json", include={"properties", "additional_info"})
+    return [
+        property_fingerprint(prop, data.get("additional_info"))
+        for prop in data["properties"]
+    ]
+
+
+class AnalysisStore:
+    """TTL-bounded store of structured analyses."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self._store: TTLStore[StoredAnalysis] = TTLStore(
+            ttl_seconds=ttl_seconds, max_entries=max_entries
+        )
+        # Standalone single-property analyses from decomposed runs, by fingerprint
+        self._property_analyses: TTLStore[StructuredAnalysis] = TTLStore(
+            ttl_seconds=ttl_seconds, max_entries=max_entries * 4
+        )
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def save(
+        self, request: PortfolioAnalyzeRequest, analysis: StructuredAnalysis
+    ) -> StoredAnalysis:
+        """Store an analysis, matching per-property results to inputs by address."""
+        fingerprints = fingerprint_properties(request)
+        by_address = {address_key(result.address): result for result in analysis.properties}
+        stored = StoredAnalysis(
+            analysis_id=uuid.uuid4().hex,
+            request=request,
+            analysis=analysis,
+            fingerprints=fingerprints,
+            results={
+                fingerprint: by_address.get(address_key(prop.address))
+                for prop, fingerprint in zip(request.properties, fingerprints)
+            },
+        )
+        self._store.set(stored.analysis_id, stored)
+        return stored
+
+    def get(self, analysis_id: str) -> StoredAnalysis | None:
+        """Return a stored analysis, or None if unknown or expired."""
+        return self._store.get(analysis_id)
+
+    def get_property_analysis(self, fingerprint: str) -> StructuredAnalysis | None:
+        """Return a cached standalone analysis of one property, or None."""
+        return self._property_analyses.get(fingerprint)
+
+    def save_property_analysis(self, fingerprint: str, analysis: StructuredAnalysis) -> None:
+        """Cache the standalone analysis of one property."""
+        self._property_analyses.set(fingerprint, analysis)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert store statistics to dictionary."""
+        return {
+            **self._store.to_dict(),
+            "property_analyses": self._property_analyses.to_dict(),
+        }
+
+
+@lru_cache
+def get_analysis_store() -> AnalysisStore:
+    """Get the process-wide analysis store."""
+    settings = get_settings()
+    return AnalysisStore(
+        ttl_seconds=settings.analysis_ttl_seconds,
+        max_entries=settings.analysis_max_entries,
+    )
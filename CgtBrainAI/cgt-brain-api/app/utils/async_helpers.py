@@ -4,13 +4,18 @@ import asyncio
 import logging
 import random
 import time
-from collections.abc import Awaitable, Callable
-from contextlib import asynccontextmanager
+from bisect import bisect_left
+from collections import deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 from enum import Enum
 from functools import wraps
 from typing import Any, ParamSpec, TypeVar
 
+from app.utils.quantile_sketch import RollingQuantiles
+
 logger = logging.getLogger(__name__)
 
 P = ParamSpec("P")
@@ -25,71 +30,194 @@ class CircuitState(Enum):
     HALF_OPEN = "half_open"  # Testing if service recovered
 
 
+class ErrorClass(Enum):
+    """How an error counts towards the circuit breaker."""
+
+    FAILURE = "failure"  # Upstream fault: counts towards the failure rate
+    THROTTLE = "throttle"  # Upstream asked for less traffic: pause new calls, don't trip
+    IGNORE = "ignore"  # Says nothing about upstream health (e.g. an invalid request)
+
+
+def count_all_errors(error: BaseException) -> ErrorClass:
+    """Default classification: every error is a failure."""
+    return ErrorClass.FAILURE
+
+
 @dataclass
 class CircuitBreaker:
     """
-    Circuit breaker pattern implementation for protecting against cascading failures.
+    Failure-rate circuit breaker over a sliding time window.
+
+    The circuit opens when at least minimum_requests calls completed within
+    the last window_seconds and at least failure_rate_threshold of them
+    failed. Errors are classified first: only FAILURE counts towards the
+    rate, THROTTLE pauses new calls for the upstream's Retry-After instead,
+    and IGNORE leaves the window untouched.
+
+    After recovery_timeout the circuit goes half-open and a single probe
+    decides whether it closes: the probe callable if one is given, otherwise
+    the next real call. Every other call is rejected until the probe is done.
 
-    When failures exceed the threshold, the circuit opens and rejects requests
-    immediately. After a timeout, it enters half-open state to test recovery.
+    State is only touched from the event loop and no method awaits, so each
+    update is atomic without a lock.
     """
 
-    failure_threshold: int = 5
+    window_seconds: float = 30.0
+    failure_rate_threshold: float = 0.5
+    minimum_requests: int = 10
     recovery_timeout: float = 30.0
-    half_open_max_calls: int = 3
+    throttle_seconds: float = 5.0  # Pause after a throttle without Retry-After
+    classify: Callable[[BaseException], ErrorClass] = count_all_errors
+    probe: Callable[[], Awaitable[Any]] | None = None
+    clock: Callable[[], float] = time.monotonic
 
     _state: CircuitState = field(default=CircuitState.CLOSED, init=False)
-    _failure_count: int = field(default=0, init=False)
-    _last_failure_time: float = field(default=0.0, init=False)
-    _half_open_calls: int = field(default=0, init=False)
-    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+    # Per-second [start, calls, failures] buckets within the window
+    _buckets: deque[list[float]] = field(default_factory=deque, init=False)
+    _calls: int = field(default=0, init=False)
+    _failures: int = field(default=0, init=False)
+    _opened_at: float = field(default=0.0, init=False)
+    _probe_in_flight: bool = field(default=False, init=False)
+    _probe_task: asyncio.Task[None] | None = field(default=None, init=False)
+    _throttled_until: float = field(default=0.0, init=False)
+    times_opened: int = field(default=0, init=False)
+    throttled: int = field(default=0, init=False)
+    ignored: int = field(default=0, init=False)
 
     @property
     def state(self) -> CircuitState:
         """Get current circuit state."""
         return self._state
 
-    async def _check_state(self) -> None:
-        """Check and potentially transition circuit state."""
-        async with self._lock:
-            if self._state == CircuitState.OPEN:
-                if time.time() - self._last_failure_time >= self.recovery_timeout:
-                    logger.info("Circuit breaker transitioning to HALF_OPEN")
-                    self._state = CircuitState.HALF_OPEN
-                    self._half_open_calls = 0
+    def _evict(self, now: float) -> None:
+        """Drop buckets that have left the window."""
+        horizon = now - self.window_seconds
+        while self._buckets and self._buckets[0][0] <= horizon:
+            _, calls, failures = self._buckets.popleft()
+            self._calls -= int(calls)
+            self._failures -= int(failures)
+
+    def _add(self, failed: bool) -> None:
+        now = self.clock()
+        self._evict(now)
+        second = float(int(now))
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        bucket = self._buckets[-1]
+        bucket[1] += 1
+        bucket[2] += failed
+        self._calls += 1
+        self._failures += failed
+
+    def failure_rate(self) -> float:
+        """Share of calls in the window that failed."""
+        self._evict(self.clock())
+        return self._failures / self._calls if self._calls else 0.0
+
+    def throttle_remaining(self) -> float:
+        """Seconds new calls should hold off for after a throttle (0 if none)."""
+        return max(0.0, self._throttled_until - self.clock())
+
+    def _open(self, reason: str) -> None:
+        logger.warning(f"Circuit breaker transitioning to OPEN ({reason})")
+        self._state = CircuitState.OPEN
+        self._opened_at = self.clock()
+        self._probe_in_flight = False
+        self.times_opened += 1
+
+    def _close(self) -> None:
+        logger.info("Circuit breaker transitioning to CLOSED")
+        self._state = CircuitState.CLOSED
+        self._buckets.clear()
+        self._calls = self._failures = 0
+        self._probe_in_flight = False
+
+    async def _run_probe(self) -> None:
+        """Run the probe; any answer other than an upstream failure closes the circuit."""
+        try:
+            await self.probe()  # type: ignore[misc]
+            healthy = True
+        except Exception as e:
+            healthy = self.classify(e) is not ErrorClass.FAILURE
+            logger.info(f"Circuit breaker probe failed: {e}")
+        if self._state == CircuitState.HALF_OPEN:
+            if healthy:
+                self._close()
+            else:
+                self._open("half-open probe failed")
 
-    async def record_success(self) -> None:
+    def record_success(self) -> None:
         """Record a successful call."""
-        async with self._lock:
-            if self._state == CircuitState.HALF_OPEN:
-                self._half_open_calls += 1
-                if self._half_open_calls >= self.half_open_max_calls:
-                    logger.info("Circuit breaker transitioning to CLOSED")
-                    self._state = CircuitState.CLOSED
-                    self._failure_count = 0
-            elif self._state == CircuitState.CLOSED:
-                self._failure_count = 0
-
-    async def record_failure(self) -> None:
-        """Record a failed call."""
-        async with self._lock:
-            self._failure_count += 1
-            self._last_failure_time = time.time()
-
-            if self._state == CircuitState.HALF_OPEN:
-                logger.warning("Circuit breaker transitioning to OPEN (half-open failure)")
-                self._state = CircuitState.OPEN
-            elif self._failure_count >= self.failure_threshold:
-                logger.warning(
-                    f"Circuit breaker transitioning to OPEN "
-                    f"(failures: {self._failure_count}/{self.failure_threshold})"
+        if self._state == CircuitState.HALF_OPEN and self._probe_in_flight:
+            self._close()
+        else:
+            self._add(failed=False)
+
+    def record_failure(
+        self, error: BaseException | None = None, retry_after: float | None = None
+    ) -> None:
+        """
+        Record a failed call.
+
+        Args:
+            error: The call's error, classified to decide how it counts
+                (None = a failure).
+            retry_after: Seconds the upstream asked to wait, for throttles.
+        """
+        kind = ErrorClass.FAILURE if error is None else self.classify(error)
+        probing = self._state == CircuitState.HALF_OPEN and self._probe_in_flight
+        if kind is ErrorClass.THROTTLE:
+            self.throttled += 1
+            pause = retry_after if retry_after is not None else self.throttle_seconds
+            self._throttled_until = max(self._throttled_until, self.clock() + pause)
+            self._probe_in_flight = False
+        elif kind is ErrorClass.IGNORE:
+            self.ignored += 1
+            self._probe_in_flight = False
+        elif probing:
+            self._open("half-open probe failed")
+        else:
+            self._add(failed=True)
+            if (
+                self._state == CircuitState.CLOSED
+                and self._calls >= self.minimum_requests
+                and self._failures >= self.failure_rate_threshold * self._calls
+            ):
+                self._open(
+                    f"{self._failures}/{self._calls} calls failed "
+                    f"in the last {self.window_seconds:.0f}s"
                 )
-                self._state = CircuitState.OPEN
 
-    async def can_execute(self) -> bool:
-        """Check if a call can be executed."""
-        await self._check_state()
-        return self._state != CircuitState.OPEN
+    def can_execute(self) -> bool:
+        """Check if a call can be executed (claiming the half-open probe if it is free)."""
+        if self._state == CircuitState.CLOSED:
+            return True
+        if self._state == CircuitState.OPEN:
+            if self.clock() - self._opened_at < self.recovery_timeout:
+                return False
+            logger.info("Circuit breaker transitioning to HALF_OPEN")
+            self._state = CircuitState.HALF_OPEN
+            if self.probe is not None:
+                self._probe_task = asyncio.create_task(self._run_probe())
+                return False
+        if self.probe is None and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert breaker state and window counts to dictionary."""
+        failure_rate = self.failure_rate()  # Evicts expired buckets first
+        return {
+            "state": self._state.value,
+            "window_calls": self._calls,
+            "window_failures": self._failures,
+            "failure_rate": round(failure_rate, 4),
+            "times_opened": self.times_opened,
+            "throttled": self.throttled,
+            "ignored": self.ignored,
+            "throttle_remaining_s": round(self.throttle_remaining(), 1),
+        }
 
 
 class CircuitBreakerOpen(Exception):
@@ -98,19 +226,120 @@ class CircuitBreakerOpen(Exception):
     pass
 
 
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Raised when work is skipped because it cannot finish before the request deadline."""
+
+    pass
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """
+    Point in time by which a request must have finished.
+
+    Set for the current task (and the tasks it starts) by deadline_scope, and
+    read by ConcurrencyLimiter.acquire, with_retry and ClaudeClient, so
+    queueing, retry backoff and HTTP timeouts draw on one budget instead of
+    each adding their own timeout on top.
+    """
+
+    expires_at: float
+    clock: Callable[[], float] = time.monotonic
+
+    @classmethod
+    def after(cls, seconds: float, clock: Callable[[], float] = time.monotonic) -> "Deadline":
+        """Deadline the given number of seconds from now."""
+        return cls(clock() + seconds, clock)
+
+    def remaining(self) -> float:
+        """Seconds left (0 once expired)."""
+        return max(0.0, self.expires_at - self.clock())
+
+    def cap(self, timeout: float | None, reserve: float = 0.0) -> float:
+        """
+        Shorten a timeout to the time left, less a reserve for later work.
+
+        Raises:
+            DeadlineExceeded: If no time is left after the reserve.
+        """
+        budget = self.remaining() - reserve
+        if budget <= 0:
+            raise DeadlineExceeded(
+                f"Request deadline too close ({self.remaining():.2f}s left, {reserve:.2f}s needed)"
+            )
+        return budget if timeout is None else min(timeout, budget)
+
+
+_current_deadline: ContextVar[Deadline | None] = ContextVar("deadline", default=None)
+
+
+def current_deadline() -> Deadline | None:
+    """Deadline of the current request, if one is set."""
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline_scope(seconds: float) -> Iterator[Deadline]:
+    """
+    Set a deadline for the block and any tasks started within it.
+
+    An enclosing deadline that expires sooner stays in force.
+    """
+    deadline = Deadline.after(seconds)
+    outer = _current_deadline.get()
+    if outer is not None and outer.expires_at < deadline.expires_at:
+        deadline = outer
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
+
+
+class LoadShed(asyncio.TimeoutError):
+    """Raised when a request is rejected instead of queued for a concurrency slot."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after  # Seconds until the queue is expected to drain
+
+
 @dataclass
 class ConcurrencyLimiter:
     """
     Manages concurrent request limits using semaphores.
 
     Provides both global request limiting and per-resource limiting.
+
+    With target_delay set, waiting requests are shed CoDel-style: once the
+    queue delay of admitted requests has stayed above target_delay for a whole
+    interval, the queue is overloaded and new arrivals wait at most
+    target_delay instead of their full timeout. Independently, an arrival is
+    rejected at once when the expected time for the queue ahead of it to
+    drain exceeds what it is prepared to wait. Rejections raise LoadShed with
+    a Retry-After estimate.
+
+    Counters are plain attributes updated between awaits on the event loop,
+    which is atomic; a free slot is taken without suspending, so the
+    uncontended path never yields to the scheduler.
     """
 
     max_concurrent: int
+    target_delay: float | None = None  # Acceptable standing queue delay (seconds)
+    interval: float = 1.0  # How long delay must stay above target to count as overload
+    clock: Callable[[], float] = time.monotonic
     _semaphore: asyncio.Semaphore = field(init=False)
     _active_count: int = field(default=0, init=False)
     _total_processed: int = field(default=0, init=False)
-    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+    _waiting: int = field(default=0, init=False)
+    _shed_count: int = field(default=0, init=False)
+    _deadline_count: int = field(default=0, init=False)
+    _above_target_since: float | None = field(default=None, init=False)
+    _overloaded: bool = field(default=False, init=False)
+    _hold_ewma: float | None = field(default=None, init=False)  # Seconds a slot is held
+    queue_delay_ms: "Histogram" = field(
+        default_factory=lambda: Histogram(QUEUE_DELAY_BUCKETS_MS), init=False
+    )
 
     def __post_init__(self) -> None:
         self._semaphore = asyncio.Semaphore(self.max_concurrent)
@@ -130,40 +359,214 @@ class ConcurrencyLimiter:
         """Number of available slots."""
         return self.max_concurrent - self._active_count
 
+    @property
+    def waiting_count(self) -> int:
+        """Number of requests queued for a slot."""
+        return self._waiting
+
+    @property
+    def overloaded(self) -> bool:
+        """Whether queue delay has stayed above target for a full interval."""
+        return self._overloaded
+
+    def expected_wait(self) -> float | None:
+        """Seconds a new arrival is expected to queue (None until a slot has been released)."""
+        if self._hold_ewma is None:
+            return None
+        if self._active_count < self.max_concurrent and not self._waiting:
+            return 0.0
+        return (self._waiting + 1) * self._hold_ewma / self.max_concurrent
+
+    def _shed(self, reason: str, wait_budget: float | None) -> LoadShed:
+        self._shed_count += 1
+        expected = self.expected_wait()
+        retry_after = max(1.0, expected if expected is not None else wait_budget or 1.0)
+        logger.warning(
+            f"Load shed ({reason}): active {self._active_count}/{self.max_concurrent}, "
+            f"waiting {self._waiting}, retry_after={retry_after:.0f}s"
+        )
+        return LoadShed(f"Concurrency limit reached ({reason})", retry_after=retry_after)
+
+    def _record_queue_delay(self, delay: float) -> None:
+        """Track the CoDel overload state from an admitted request's queue delay."""
+        self.queue_delay_ms.observe(delay * 1000)
+        if self.target_delay is None:
+            return
+        now = self.clock()
+        if delay < self.target_delay:
+            self._above_target_since = None
+            self._overloaded = False
+        elif self._above_target_since is None:
+            self._above_target_since = now
+        elif now - self._above_target_since >= self.interval:
+            if not self._overloaded:
+                logger.warning(
+                    f"Queue overloaded: delay {delay * 1000:.0f}ms above "
+                    f"{self.target_delay * 1000:.0f}ms for {self.interval}s"
+                )
+            self._overloaded = True
+
+    def _deadline_exceeded(self, reason: str) -> DeadlineExceeded:
+        self._deadline_count += 1
+        logger.warning(
+            f"Slot wait skipped ({reason}): active {self._active_count}/{self.max_concurrent}, "
+            f"waiting {self._waiting}"
+        )
+        return DeadlineExceeded(f"No concurrency slot before the request deadline ({reason})")
+
     @asynccontextmanager
-    async def acquire(self, timeout: float | None = None):
+    async def acquire(
+        self, timeout: float | None = None, reserve: float = 0.0
+    ) -> AsyncIterator[None]:
         """
-        Acquire a slot with optional timeout.
+        Acquire a concurrency slot.
+
+        Under a request deadline the wait is capped at the time left less
+        reserve, so a slot is never taken too late for the work it is for.
 
         Args:
             timeout: Maximum time to wait for a slot (None = wait forever)
+            reserve: Deadline time to leave for the work done holding the slot
 
         Raises:
-            asyncio.TimeoutError: If timeout is reached
+            LoadShed: If the request is shed or the timeout is reached
+                (a subclass of asyncio.TimeoutError)
+            DeadlineExceeded: If no slot can be had before the deadline
         """
-        if timeout is not None:
+        deadline_bound = False
+        deadline = current_deadline()
+        if deadline is not None:
             try:
-                await asyncio.wait_for(self._semaphore.acquire(), timeout=timeout)
-            except asyncio.TimeoutError:
-                logger.warning(
-                    f"Concurrency limit timeout after {timeout}s "
-                    f"(active: {self._active_count}/{self.max_concurrent})"
-                )
-                raise
+                budget = deadline.cap(None, reserve)
+            except DeadlineExceeded:
+                raise self._deadline_exceeded("no time left") from None
+            if timeout is None or budget < timeout:
+                timeout, deadline_bound = budget, True
+
+        must_queue = self._semaphore.locked()
+        if must_queue and self.target_delay is not None and self._overloaded:
+            if timeout is None or self.target_delay < timeout:
+                timeout, deadline_bound = self.target_delay, False
+        if must_queue and (self.target_delay is not None or deadline_bound):
+            expected = self.expected_wait()
+            if timeout is not None and expected is not None and expected > timeout:
+                if deadline_bound:
+                    raise self._deadline_exceeded("queue cannot drain in time")
+                raise self._shed("queue cannot drain in time", timeout)
+
+        enqueued = self.clock()
+        if not must_queue:
+            await self._semaphore.acquire()  # A free slot: returns without suspending
         else:
-            await self._semaphore.acquire()
-
-        async with self._lock:
-            self._active_count += 1
+            self._waiting += 1
+            try:
+                # asyncio.timeout cancels the wait in place; wait_for would
+                # wrap every queued acquire in a new task
+                async with asyncio.timeout(timeout):
+                    await self._semaphore.acquire()
+            except asyncio.TimeoutError:
+                self._record_queue_delay(self.clock() - enqueued)
+                if deadline_bound:
+                    raise self._deadline_exceeded(f"no slot within {timeout:.2f}s") from None
+                raise self._shed(f"no slot within {timeout:.2f}s", timeout) from None
+            finally:
+                self._waiting -= 1
+        admitted = self.clock()
+        self._record_queue_delay(admitted - enqueued)
+        self._active_count += 1
 
         try:
             yield
         finally:
-            async with self._lock:
-                self._active_count -= 1
-                self._total_processed += 1
+            held = self.clock() - admitted
+            previous = self._hold_ewma
+            self._hold_ewma = held if previous is None else 0.8 * previous + 0.2 * held
+            self._active_count -= 1
+            self._total_processed += 1
             self._semaphore.release()
 
+    def to_dict(self) -> dict[str, Any]:
+        """Convert limiter state and queue delay to dictionary."""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active_requests": self._active_count,
+            "available_slots": self.available_slots,
+            "waiting_requests": self._waiting,
+            "total_processed": self._total_processed,
+            "shed_requests": self._shed_count,
+            "deadline_exceeded": self._deadline_count,
+            "overloaded": self._overloaded,
+            "average_hold_ms": round(self._hold_ewma * 1000, 1) if self._hold_ewma else 0.0,
+            "queue_delay_ms": self.queue_delay_ms.to_dict(),
+        }
+
+
+@dataclass
+class RetryBudget:
+    """
+    Token bucket shared by all retries of a client.
+
+    Each request deposits ratio tokens and each retry spends one, so retries
+    stay within ratio of recent traffic; min_per_second tokens also accrue
+    over time so low-traffic periods can still retry. The balance is capped
+    at max_tokens, which bounds the retry burst after a quiet spell. During
+    an upstream incident the bucket runs dry and failed calls fail fast
+    instead of multiplying load.
+    """
+
+    ratio: float = 0.2  # Retries allowed per request
+    # Retries always allowed, regardless of traffic; keep well below ratio * requests/s
+    min_per_second: float = 0.1
+    max_tokens: float = 10.0
+    clock: Callable[[], float] = time.monotonic
+    _tokens: float = field(init=False)
+    _last_refill: float = field(init=False)
+    requests: int = field(default=0, init=False)
+    retries: int = field(default=0, init=False)
+    exhausted: int = field(default=0, init=False)  # Retries refused for lack of budget
+
+    def __post_init__(self) -> None:
+        self._tokens = self.max_tokens
+        self._last_refill = self.clock()
+
+    def _refill(self, tokens: float = 0.0) -> None:
+        now = self.clock()
+        tokens += (now - self._last_refill) * self.min_per_second
+        self._last_refill = now
+        self._tokens = min(self.max_tokens, self._tokens + tokens)
+
+    @property
+    def balance(self) -> float:
+        """Retries currently available."""
+        self._refill()
+        return self._tokens
+
+    def record_request(self) -> None:
+        """Deposit a first attempt's share of retry budget."""
+        self.requests += 1
+        self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget; False if it is exhausted."""
+        self._refill()
+        if self._tokens < 1.0:
+            self.exhausted += 1
+            return False
+        self._tokens -= 1.0
+        self.retries += 1
+        return True
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert budget state to dictionary."""
+        return {
+            "ratio": self.ratio,
+            "balance": round(self.balance, 2),
+            "requests": self.requests,
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+            "retry_rate": round(self.retries / self.requests, 4) if self.requests else 0.0,
+        }
+
 
 def with_retry(
     max_retries: int = 3,
@@ -172,10 +575,17 @@ def with_retry(
     exponential_base: float = 2.0,
     jitter: bool = True,
     retryable_exceptions: tuple[type[Exception], ...] = (Exception,),
+    min_attempt_seconds: float = 0.0,
+    budget: RetryBudget | None = None,
 ) -> Callable[[Callable[P, Awaitable[T]]], Callable[P, Awaitable[T]]]:
     """
     Decorator for async functions with exponential backoff retry.
 
+    Under a request deadline, a retry is only made if its backoff plus
+    min_attempt_seconds fits in the time left; otherwise the last error is
+    raised at once. DeadlineExceeded is never retried. With a budget, a
+    retry is also only made while the shared budget has tokens left.
+
     Args:
         max_retries: Maximum number of retry attempts
         base_delay: Initial delay between retries in seconds
@@ -183,16 +593,22 @@ def with_retry(
         exponential_base: Base for exponential backoff
         jitter: Add random jitter to prevent thundering herd
         retryable_exceptions: Tuple of exceptions that trigger retry
+        min_attempt_seconds: Least deadline time worth starting an attempt with
+        budget: Retry budget shared with other calls (None = unlimited)
     """
 
     def decorator(func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
         @wraps(func)
         async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
             last_exception: Exception | None = None
+            if budget is not None:
+                budget.record_request()
 
             for attempt in range(max_retries + 1):
                 try:
                     return await func(*args, **kwargs)
+                except DeadlineExceeded:
+                    raise
                 except retryable_exceptions as e:
                     last_exception = e
 
@@ -209,6 +625,22 @@ def with_retry(
                     if jitter:
                         delay *= 0.75 + random.random() * 0.5
 
+                    deadline = current_deadline()
+                    if deadline is not None and deadline.remaining() < delay + min_attempt_seconds:
+                        logger.error(
+                            f"{func.__name__} attempt {attempt + 1}/{max_retries + 1} "
+                            f"failed: {e}. Not retrying: {deadline.remaining():.2f}s left "
+                            f"before the request deadline"
+                        )
+                        raise
+
+                    if budget is not None and not budget.try_spend():
+                        logger.error(
+                            f"{func.__name__} attempt {attempt + 1}/{max_retries + 1} "
+                            f"failed: {e}. Not retrying: retry budget exhausted"
+                        )
+                        raise
+
                     logger.warning(
                         f"{func.__name__} attempt {attempt + 1}/{max_retries + 1} "
                         f"failed: {e}. Retrying in {delay:.2f}s"
@@ -230,7 +662,7 @@ async def run_with_timeout(
     timeout_message: str = "Operation timed out",
 ) -> T:
     """
-    Run a coroutine with a timeout.
+    Run a coroutine with a timeout, which is also its request deadline.
 
     Args:
         coro: The coroutine to run
@@ -244,21 +676,183 @@ async def run_with_timeout(
         asyncio.TimeoutError: If the operation times out
     """
     try:
-        return await asyncio.wait_for(coro, timeout=timeout)
+        with deadline_scope(timeout) as deadline:
+            return await asyncio.wait_for(coro, timeout=deadline.remaining())
     except asyncio.TimeoutError:
         logger.error(f"{timeout_message} (timeout: {timeout}s)")
         raise
 
 
+# Bucket upper bounds for generation histograms
+TTFT_BUCKETS_MS: tuple[float, ...] = (
+    100.0, 250.0, 500.0, 1000.0, 2000.0, 4000.0, 8000.0, 15000.0, 30000.0, 60000.0
+)
+INTER_TOKEN_BUCKETS_MS: tuple[float, ...] = (
+    5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 250.0, 500.0
+)
+QUEUE_DELAY_BUCKETS_MS: tuple[float, ...] = (
+    1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0, 10000.0, 30000.0
+)
+TOKENS_PER_SECOND_BUCKETS: tuple[float, ...] = (
+    5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 150.0, 200.0, 300.0
+)
+REQUEST_LATENCY_BUCKETS_MS: tuple[float, ...] = (
+    250.0, 500.0, 1000.0, 2500.0, 5000.0, 10000.0, 20000.0, 30000.0, 60000.0, 120000.0, 180000.0
+)
+
+
+@dataclass
+class Histogram:
+    """
+    Fixed-bucket histogram with Prometheus-style upper bounds.
+
+    Observations above the last bound land in an implicit +Inf bucket.
+    Percentiles are estimated by linear interpolation within a bucket.
+    """
+
+    buckets: tuple[float, ...]
+    count: int = field(default=0, init=False)
+    sum: float = field(default=0.0, init=False)
+    _counts: list[int] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.buckets = tuple(sorted(self.buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        """Record a single observation."""
+        self._counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    @property
+    def mean(self) -> float:
+        """Mean of all observations."""
+        return self.sum / self.count if self.count else 0.0
+
+    def cumulative_counts(self) -> list[tuple[float, int]]:
+        """Return (upper_bound, cumulative_count) pairs, ending with +Inf."""
+        result = []
+        running = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), self._counts):
+            running += bucket_count
+            result.append((bound, running))
+        return result
+
+    def percentile(self, q: float) -> float:
+        """
+        Estimate the q-th quantile (0 < q < 1).
+
+        Values in the +Inf bucket are reported as the last finite bound.
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        running = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, self._counts):
+            if bucket_count and running + bucket_count >= rank:
+                return lower + (bound - lower) * (rank - running) / bucket_count
+            running += bucket_count
+            lower = bound
+        return self.buckets[-1] if self.buckets else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert histogram to dictionary."""
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 2),
+            "p50": round(self.percentile(0.50), 2),
+            "p90": round(self.percentile(0.90), 2),
+            "p99": round(self.percentile(0.99), 2),
+            "buckets": {
+                ("+Inf" if bound == float("inf") else f"{bound:g}"): cumulative
+                for bound, cumulative in self.cumulative_counts()
+            },
+        }
+
+
+@dataclass
+class GenerationMetrics:
+    """Per-model generation speed histograms."""
+
+    time_to_first_token_ms: Histogram = field(
+        default_factory=lambda: Histogram(TTFT_BUCKETS_MS)
+    )
+    inter_token_latency_ms: Histogram = field(
+        default_factory=lambda: Histogram(INTER_TOKEN_BUCKETS_MS)
+    )
+    output_tokens_per_second: Histogram = field(
+        default_factory=lambda: Histogram(TOKENS_PER_SECOND_BUCKETS)
+    )
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert metrics to dictionary."""
+        return {
+            "time_to_first_token_ms": self.time_to_first_token_ms.to_dict(),
+            "inter_token_latency_ms": self.inter_token_latency_ms.to_dict(),
+            "output_tokens_per_second": self.output_tokens_per_second.to_dict(),
+        }
+
+
+@dataclass
+class PromptProfileMetrics:
+    """Prompt cache effectiveness for one system prompt module combination."""
+
+    requests: int = 0
+    cache_hits: int = 0
+    input_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert metrics to dictionary."""
+        prompt_tokens = self.input_tokens + self.cache_read_tokens + self.cache_write_tokens
+        return {
+            "requests": self.requests,
+            "input_tokens": self.input_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cache_hit_ratio": round(self.cache_hits / self.requests, 4) if self.requests else 0.0,
+            "cached_token_ratio": (
+                round(self.cache_read_tokens / prompt_tokens, 4) if prompt_tokens else 0.0
+            ),
+        }
+
+
 @dataclass
 class RequestMetrics:
-    """Track request metrics for monitoring."""
+    """
+    Track request metrics for monitoring.
+
+    Recorded from the event loop only; no method awaits, so updates are
+    atomic without a lock.
+    """
 
     total_requests: int = 0
     successful_requests: int = 0
     failed_requests: int = 0
     total_latency_ms: float = 0.0
-    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+    continuation_calls: int = 0
+    truncated_responses: int = 0
+    # Billed usage of every API response (retries and continuations included)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    cost_usd: float = 0.0
+    success_latency_ms: Histogram = field(
+        default_factory=lambda: Histogram(REQUEST_LATENCY_BUCKETS_MS)
+    )
+    failure_latency_ms: Histogram = field(
+        default_factory=lambda: Histogram(REQUEST_LATENCY_BUCKETS_MS)
+    )
+    # Percentiles over the last 1, 5 and 15 minutes; the histograms above are
+    # cumulative and exist for Prometheus to aggregate across instances
+    success_quantiles: RollingQuantiles = field(default_factory=RollingQuantiles)
+    failure_quantiles: RollingQuantiles = field(default_factory=RollingQuantiles)
+    generation: dict[str, GenerationMetrics] = field(default_factory=dict)
+    prompt_profiles: dict[str, PromptProfileMetrics] = field(default_factory=dict)
 
     @property
     def average_latency_ms(self) -> float:
@@ -274,15 +868,87 @@ class RequestMetrics:
             return 1.0
         return self.successful_requests / self.total_requests
 
-    async def record_request(self, success: bool, latency_ms: float) -> None:
+    def record_request(self, success: bool, latency_ms: float) -> None:
         """Record a request result."""
-        async with self._lock:
-            self.total_requests += 1
-            if success:
-                self.successful_requests += 1
-                self.total_latency_ms += latency_ms
-            else:
-                self.failed_requests += 1
+        self.total_requests += 1
+        if success:
+            self.successful_requests += 1
+            self.total_latency_ms += latency_ms
+            self.success_latency_ms.observe(latency_ms)
+            self.success_quantiles.add(latency_ms)
+        else:
+            self.failed_requests += 1
+            self.failure_latency_ms.observe(latency_ms)
+            self.failure_quantiles.add(latency_ms)
+
+    def record_usage(
+        self,
+        input_tokens: int,
+        output_tokens: int,
+        cache_read_tokens: int,
+        cache_write_tokens: int,
+        cost_usd: float,
+    ) -> None:
+        """Add one API response's token usage and estimated cost to the totals."""
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cache_read_tokens += cache_read_tokens
+        self.cache_write_tokens += cache_write_tokens
+        self.cost_usd += cost_usd
+
+    def record_generation(
+        self,
+        model: str,
+        output_tokens: int,
+        generation_ms: float,
+        time_to_first_token_ms: float | None = None,
+    ) -> None:
+        """
+        Record generation speed for a single upstream call.
+
+        Args:
+            model: Model that produced the output.
+            output_tokens: Number of output tokens generated.
+            generation_ms: Wall time from sending the request to the last token.
+            time_to_first_token_ms: Time until the first token arrived (streaming only).
+        """
+        stats = self.generation.get(model)
+        if stats is None:
+            stats = self.generation[model] = GenerationMetrics()
+
+        if generation_ms > 0 and output_tokens > 0:
+            stats.output_tokens_per_second.observe(output_tokens / (generation_ms / 1000))
+
+        if time_to_first_token_ms is not None:
+            stats.time_to_first_token_ms.observe(time_to_first_token_ms)
+            decode_ms = generation_ms - time_to_first_token_ms
+            if output_tokens > 1 and decode_ms > 0:
+                stats.inter_token_latency_ms.observe(decode_ms / (output_tokens - 1))
+
+    def record_prompt_usage(
+        self,
+        profile: str,
+        input_tokens: int,
+        cache_read_tokens: int,
+        cache_write_tokens: int,
+    ) -> None:
+        """
+        Record prompt token usage for a system prompt profile.
+
+        Args:
+            profile: Prompt module combination (e.g. "core+B+Q").
+            input_tokens: Uncached input tokens.
+            cache_read_tokens: Tokens served from the prompt cache.
+            cache_write_tokens: Tokens written to the prompt cache.
+        """
+        stats = self.prompt_profiles.get(profile)
+        if stats is None:
+            stats = self.prompt_profiles[profile] = PromptProfileMetrics()
+        stats.requests += 1
+        stats.cache_hits += 1 if cache_read_tokens > 0 else 0
+        stats.input_tokens += input_tokens
+        stats.cache_read_tokens += cache_read_tokens
+        stats.cache_write_tokens += cache_write_tokens
 
     def to_dict(self) -> dict[str, Any]:
         """Convert metrics to dictionary."""
@@ -291,5 +957,24 @@ class RequestMetrics:
             "successful_requests": self.successful_requests,
             "failed_requests": self.failed_requests,
             "average_latency_ms": round(self.average_latency_ms, 2),
+            "latency_percentiles_ms": {
+                "success": self.success_quantiles.to_dict(),
+                "failure": self.failure_quantiles.to_dict(),
+            },
             "success_rate": round(self.success_rate, 4),
+            "continuation_calls": self.continuation_calls,
+            "truncated_responses": self.truncated_responses,
+            "tokens": {
+                "input": self.input_tokens,
+                "output": self.output_tokens,
+                "cache_read": self.cache_read_tokens,
+                "cache_write": self.cache_write_tokens,
+            },
+            "estimated_cost_usd": round(self.cost_usd, 6),
+            "generation": {
+                model: stats.to_dict() for model, stats in self.generation.items()
+            },
+            "prompt_profiles": {
+                profile: stats.to_dict() for profile, stats in self.prompt_profiles.items()
+            },
         }
@@ -0,0 +1,219 @@
+"""Background refresh of cached prompt prefixes during business hours."""
+
+import asyncio
+import logging
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Any
+from zoneinfo import ZoneInfo
+
+from app.models import UsageStats
+
+logger = logging.getLogger(__name__)
+
+# Where prompt cache usage came from
+SOURCES = ("traffic", "warmup", "keepalive")
+
+PrefixKey = tuple[tuple[str, ...], str]
+Prompt = tuple[Any, list[dict[str, Any]] | None]  # (system prompt, tools)
+Refresh = Callable[[Any, list[dict[str, Any]] | None], Awaitable[Any]]
+
+
+def prefix_key(
+    system_blocks: list[dict[str, Any]], tools: list[dict[str, Any]] | None
+) -> PrefixKey:
+    """
+    Identify a cached prefix by its tools and first system block.
+
+    The first block carries the first cache breakpoint, so every request
+    sharing it refreshes that prefix. Hashing the key is cheap: Python caches
+    a string's hash, and the prompt texts are module constants.
+    """
+    return tuple(tool["name"] for tool in tools or ()), system_blocks[0]["text"]
+
+
+@dataclass
+class CacheSpend:
+    """Prompt cache tokens and their cost for one source."""
+
+    requests: int = 0
+    cache_write_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_cost_usd: Decimal = Decimal("0")
+    cache_read_cost_usd: Decimal = Decimal("0")
+    cost_usd: Decimal = Decimal("0")  # Whole requests, including uncached input and output
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_cost_usd": str(round(self.cache_write_cost_usd, 6)),
+            "cache_read_cost_usd": str(round(self.cache_read_cost_usd, 6)),
+            "cost_usd": str(round(self.cost_usd, 6)),
+        }
+
+
+class PromptCacheKeepAlive:
+    """
+    Keep prompt prefixes cached by refreshing them just before they lapse.
+
+    Every request that writes or reads a prefix resets its cache TTL, so the
+    tracker records when each prefix was last used. During business hours a
+    background task refreshes any registered prefix that would otherwise
+    expire within the margin. Spend is split by source, and a real request
+    that reads a prefix last refreshed by the keep-alive counts as a cache
+    write avoided.
+
+    Usage is tracked per process, but the prompt cache is shared by every
+    replica using the same API key. Run the keep-alive on one replica only;
+    its savings then count that replica's traffic alone.
+    """
+
+    def __init__(
+        self,
+        pricing: dict[str, Decimal],
+        ttl_seconds: float = 300.0,
+        margin_seconds: float = 30.0,
+        timezone: str = "Australia/Sydney",
+        start_hour: int = 8,
+        end_hour: int = 18,
+        weekdays_only: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+        now: Callable[[ZoneInfo], datetime] = datetime.now,
+    ):
+        """
+        Args:
+            pricing: Model pricing per million tokens (cache_write, cache_read).
+            ttl_seconds: Prompt cache lifetime after the last write or read.
+            margin_seconds: Refresh this long before the cache would expire.
+            timezone: IANA timezone of the business hours.
+            start_hour: First hour (inclusive) refreshes may run.
+            end_hour: Hour (exclusive) refreshes stop.
+            weekdays_only: Skip Saturdays and Sundays.
+            clock: Monotonic time source for TTL tracking.
+            now: Wall clock, called with the business-hours timezone.
+        """
+        self.pricing = pricing
+        self.ttl_seconds = ttl_seconds
+        self.margin_seconds = margin_seconds
+        self.timezone = ZoneInfo(timezone)
+        self.start_hour = start_hour
+        self.end_hour = end_hour
+        self.weekdays_only = weekdays_only
+        self.clock = clock
+        self.now = now
+
+        self.prompts: dict[PrefixKey, Prompt] = {}
+        self._last_used: dict[PrefixKey, tuple[float, str]] = {}  # key -> (time, source)
+        self.spend = {source: CacheSpend() for source in SOURCES}
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.writes_avoided = 0
+        self.savings_usd = Decimal("0")
+        self._task: asyncio.Task[None] | None = None
+
+    def in_business_hours(self) -> bool:
+        """Whether refreshes may run now."""
+        local = self.now(self.timezone)
+        if self.weekdays_only and local.weekday() >= 5:
+            return False
+        return self.start_hour <= local.hour < self.end_hour
+
+    def _token_cost(self, tokens: int, price: str) -> Decimal:
+        return Decimal(tokens) / Decimal(1_000_000) * self.pricing[price]
+
+    def record(self, key: PrefixKey, usage: UsageStats, source: str = "traffic") -> None:
+        """Record a request's prompt cache usage for a prefix."""
+        write_tokens = usage.cache_creation_input_tokens
+        read_tokens = usage.cache_read_input_tokens
+        spend = self.spend[source]
+        spend.requests += 1
+        spend.cache_write_tokens += write_tokens
+        spend.cache_read_tokens += read_tokens
+        spend.cache_write_cost_usd += self._token_cost(write_tokens, "cache_write")
+        spend.cache_read_cost_usd += self._token_cost(read_tokens, "cache_read")
+        spend.cost_usd += usage.estimated_cost_usd
+
+        if not (write_tokens or read_tokens):
+            return
+        previous = self._last_used.get(key)
+        if source == "traffic" and read_tokens and previous and previous[1] == "keepalive":
+            self.writes_avoided += 1
+            self.savings_usd += self._token_cost(read_tokens, "cache_write") - self._token_cost(
+                read_tokens, "cache_read"
+            )
+        self._last_used[key] = (self.clock(), source)
+
+    def due(self) -> list[PrefixKey]:
+        """Registered prefixes that expire within the margin (or were never cached)."""
+        cutoff = self.clock() - (self.ttl_seconds - self.margin_seconds)
+        return [
+            key
+            for key in self.prompts
+            if key not in self._last_used or self._last_used[key][0] <= cutoff
+        ]
+
+    async def refresh_due(self, refresh: Refresh) -> int:
+        """Refresh every due prefix if within business hours; returns refreshes sent."""
+        if not self.in_business_hours():
+            return 0
+        sent = 0
+        for key in self.due():
+            system_prompt, tools = self.prompts[key]
+            try:
+                await refresh(system_prompt, tools)
+            except Exception as e:
+                self.failed_refreshes += 1
+                logger.warning(f"Prompt cache keep-alive refresh failed: {e}")
+                continue
+            self.refreshes += 1
+            sent += 1
+        return sent
+
+    def start(self, prompts: list[tuple[list[dict[str, Any]], Any]], refresh: Refresh) -> None:
+        """
+        Register prefixes and start the background refresh task.
+
+        Args:
+            prompts: (system blocks, tools) pairs to keep cached.
+            refresh: Sends a minimal request with a prefix and records it with
+                source="keepalive".
+        """
+        self.prompts = {prefix_key(system, tools): (system, tools) for system, tools in prompts}
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(refresh))
+
+    async def stop(self) -> None:
+        """Cancel the background task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, refresh: Refresh) -> None:
+        interval = max(1.0, self.margin_seconds / 2)
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh_due(refresh)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert keep-alive state and spend to dictionary."""
+        keepalive_cost = self.spend["keepalive"].cost_usd
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "in_business_hours": self.in_business_hours(),
+            "prefixes": len(self.prompts),
+            "refreshes": self.refreshes,
+            "failed_refreshes": self.failed_refreshes,
+            "spend": {source: spend.to_dict() for source, spend in self.spend.items()},
+            "writes_avoided": self.writes_avoided,
+            "estimated_savings_usd": str(round(self.savings_usd, 6)),
+            "net_savings_usd": str(round(self.savings_usd - keepalive_cost, 6)),
+        }
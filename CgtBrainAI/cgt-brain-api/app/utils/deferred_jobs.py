@@ -0,0 +1,156 @@
+"""Analyses deferred while the Claude API is unavailable, run once it recovers."""
+
+import asyncio
+import logging
+import uuid
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Literal
+
+from app.config import get_settings
+from app.models import PortfolioAnalyzeRequest, PortfolioAnalyzeResponse
+from app.utils.async_helpers import CircuitBreakerOpen, DeadlineExceeded, LoadShed
+from app.utils.ttl_store import TTLStore
+
+logger = logging.getLogger(__name__)
+
+JobStatus = Literal["pending", "running", "done", "failed"]
+
+
+@dataclass
+class DeferredJob:
+    """A full analysis waiting for (or produced after) the API's recovery."""
+
+    job_id: str
+    key: str  # Analysis cache key; identical requests share one job
+    request: PortfolioAnalyzeRequest
+    status: JobStatus = "pending"
+    result: PortfolioAnalyzeResponse | None = None
+    error: str | None = None
+
+
+RunJob = Callable[[DeferredJob], Awaitable[PortfolioAnalyzeResponse]]
+Ready = Callable[[], bool]
+
+
+class DeferredJobQueue:
+    """
+    FIFO queue of analyses to run once the circuit breaker lets calls through.
+
+    Jobs are drained one at a time by a background task, so a recovering API
+    is not hit with the whole backlog at once. A job interrupted by the
+    circuit opening again goes back to the front of the queue. Finished jobs
+    are kept (with their results) until the TTL expires.
+    """
+
+    def __init__(self, ttl_seconds: float, max_pending: int, poll_seconds: float = 5.0):
+        self._jobs: TTLStore[DeferredJob] = TTLStore(
+            ttl_seconds=ttl_seconds, max_entries=max_pending * 2
+        )
+        self._pending: deque[str] = deque()
+        self._by_key: dict[str, str] = {}  # key -> job_id of a pending or running job
+        self.max_pending = max_pending
+        self.poll_seconds = poll_seconds
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0  # Not queued because the queue was full
+        self._task: asyncio.Task[None] | None = None
+
+    def enqueue(self, key: str, request: PortfolioAnalyzeRequest) -> DeferredJob | None:
+        """Queue an analysis, or return the job already queued for it (None if full)."""
+        job_id = self._by_key.get(key)
+        job = self._jobs.get(job_id, count=False) if job_id else None
+        if job is not None and job.status in ("pending", "running"):
+            return job
+        if len(self._pending) >= self.max_pending:
+            self.rejected += 1
+            return None
+
+        job = DeferredJob(job_id=uuid.uuid4().hex, key=key, request=request)
+        self._jobs.set(job.job_id, job)
+        self._by_key[key] = job.job_id
+        self._pending.append(job.job_id)
+        self.enqueued += 1
+        return job
+
+    def get(self, job_id: str) -> DeferredJob | None:
+        """Return a job, or None if unknown or expired."""
+        return self._jobs.get(job_id)
+
+    async def run_pending(self, run: RunJob, ready: Ready) -> int:
+        """
+        Run queued jobs in order for as long as ready() allows.
+
+        Returns:
+            Number of jobs that completed.
+        """
+        completed = 0
+        while self._pending and ready():
+            job = self._jobs.get(self._pending.popleft(), count=False)
+            if job is None:  # Expired while queued
+                continue
+            job.status = "running"
+            try:
+                job.result = await run(job)
+            except (CircuitBreakerOpen, LoadShed, DeadlineExceeded) as e:
+                job.status = "pending"
+                self._pending.appendleft(job.job_id)
+                logger.info(f"Deferred job {job.job_id} put back: {e}")
+                break
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e) or type(e).__name__
+                self.failed += 1
+                logger.error(f"Deferred job {job.job_id} failed: {job.error}")
+            else:
+                job.status = "done"
+                self.completed += 1
+                completed += 1
+            self._by_key.pop(job.key, None)
+        return completed
+
+    def start(self, run: RunJob, ready: Ready) -> None:
+        """Start the background task draining the queue."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(run, ready))
+
+    async def stop(self) -> None:
+        """Cancel the background task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, run: RunJob, ready: Ready) -> None:
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            if self._pending:
+                await self.run_pending(run, ready)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert queue statistics to dictionary."""
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+@lru_cache
+def get_job_queue() -> DeferredJobQueue:
+    """Get the process-wide deferred job queue."""
+    settings = get_settings()
+    return DeferredJobQueue(
+        ttl_seconds=settings.deferred_job_ttl_seconds,
+        max_pending=settings.deferred_job_max_pending,
+        poll_seconds=settings.deferred_job_poll_seconds,
+    )
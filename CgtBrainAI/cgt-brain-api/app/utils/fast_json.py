@@ -0,0 +1,43 @@
+"""Fast JSON encoding for API responses with orjson."""
+
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(value: Any) -> Any:
+    """Encode types orjson does not handle natively (Decimal as string, like pydantic)."""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Serialise content to compact UTF-8 JSON bytes."""
+    return orjson.dumps(content, default=_default)
+
+
+def model_bytes(model: BaseModel, exclude: set[str] | None = None) -> bytes:
+    """Serialise a pydantic model straight to JSON bytes with its compiled serializer."""
+    return model.__pydantic_serializer__.to_json(model, exclude=exclude)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson instead of json.dumps."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RawJSONResponse(JSONResponse):
+    """Response whose body is already serialised JSON bytes; no encoding is done."""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            return bytes(content)
+        return dumps(content)
@@ -0,0 +1,223 @@
+"""Shared HTTP transport for the Anthropic client, with connection pool metrics."""
+
+import logging
+import socket
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, cast
+
+import anthropic
+import httpx
+
+from app.config import Settings
+from app.utils.async_helpers import Histogram
+
+# Older anthropic releases are built on httpx, newer ones on its httpx2 fork.
+# The transport must come from the same package as the SDK's client.
+if issubclass(anthropic.DefaultAsyncHttpxClient, httpx.AsyncClient):
+    http = httpx
+else:  # pragma: no cover - depends on the installed SDK
+    import httpx2
+
+    http = cast(Any, httpx2)
+
+logger = logging.getLogger(__name__)
+
+# Bucket upper bounds for connection pool histograms
+POOL_WAIT_BUCKETS_MS: tuple[float, ...] = (
+    1.0, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 5000.0
+)
+CONNECT_BUCKETS_MS: tuple[float, ...] = (
+    10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0
+)
+
+# httpcore trace extension: called with (event name, info) for each step
+TraceCallback = Callable[[str, dict[str, Any]], Awaitable[None]]
+
+# Trace events that mark a request as holding a connection
+CONNECTION_ACQUIRED_EVENTS = (
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+    "http11.send_request_headers.started",
+    "http2.send_connection_init.started",
+    "http2.send_request_headers.started",
+)
+CONNECT_STARTED_EVENTS = (
+    "connection.connect_tcp.started",
+    "connection.connect_unix_socket.started",
+)
+
+
+@dataclass
+class PoolMetrics:
+    """Request, wait and connection churn counters for a pooled transport."""
+
+    requests: int = 0
+    in_flight: int = 0  # Requests holding or waiting for a connection
+    peak_in_flight: int = 0
+    waiting: int = 0  # Requests queued for a free connection
+    peak_waiting: int = 0
+    connections_opened: int = 0
+    pool_wait_ms: Histogram = field(default_factory=lambda: Histogram(POOL_WAIT_BUCKETS_MS))
+    connect_ms: Histogram = field(default_factory=lambda: Histogram(CONNECT_BUCKETS_MS))
+
+    def request_started(self) -> None:
+        self.requests += 1
+        self.in_flight += 1
+        self.waiting += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert metrics to dictionary."""
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waiting": self.waiting,
+            "peak_waiting": self.peak_waiting,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_ratio": round(
+                1 - self.connections_opened / self.requests, 4
+            ) if self.requests else 0.0,
+            "pool_wait_ms": self.pool_wait_ms.to_dict(),
+            "connect_ms": self.connect_ms.to_dict(),
+        }
+
+
+class _TrackedStream(http.AsyncByteStream):
+    """Response stream that reports when the response (and its connection) is released."""
+
+    def __init__(self, stream: Any, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+
+class PooledTransport(http.AsyncHTTPTransport):
+    """
+    Async HTTP transport with explicit pool limits and pool metrics.
+
+    Pool wait is the time from sending a request to it holding a connection.
+    A new connection counts as held once its TCP connect starts, and connect
+    time is recorded separately. Wait and connect times come from the
+    transport's trace extension.
+    """
+
+    def __init__(
+        self,
+        max_connections: int,
+        max_keepalive_connections: int,
+        keepalive_expiry: float,
+        http2: bool = True,
+    ):
+        """
+        Args:
+            max_connections: Maximum open connections (in use or idle).
+            max_keepalive_connections: Idle connections kept open for reuse.
+            keepalive_expiry: Seconds an idle connection is kept open.
+            http2: Negotiate HTTP/2 when the h2 package is installed.
+        """
+        limits = http.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        socket_options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, True)]
+        try:
+            super().__init__(limits=limits, http2=http2, socket_options=socket_options)
+        except ImportError:
+            logger.info("h2 is not installed, using HTTP/1.1 for the Anthropic API")
+            http2 = False
+            super().__init__(limits=limits, socket_options=socket_options)
+
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.metrics = PoolMetrics()
+
+    async def handle_async_request(self, request: Any) -> Any:
+        metrics = self.metrics
+        start = time.perf_counter()
+        connect_started: float | None = None
+        acquired = False
+        upstream_trace: TraceCallback | None = request.extensions.get("trace")
+
+        def acquire() -> None:
+            nonlocal acquired
+            if not acquired:
+                acquired = True
+                metrics.waiting -= 1
+
+        async def trace(name: str, info: dict[str, Any]) -> None:
+            nonlocal connect_started
+            now = time.perf_counter()
+            if not acquired and name in CONNECTION_ACQUIRED_EVENTS:
+                acquire()
+                metrics.pool_wait_ms.observe((now - start) * 1000)
+            if name in CONNECT_STARTED_EVENTS:
+                metrics.connections_opened += 1
+                connect_started = now
+            elif connect_started is not None and name in CONNECTION_ACQUIRED_EVENTS:
+                metrics.connect_ms.observe((now - connect_started) * 1000)
+                connect_started = None
+            if upstream_trace is not None:
+                await upstream_trace(name, info)
+
+        def release() -> None:
+            acquire()
+            metrics.in_flight -= 1
+
+        metrics.request_started()
+        request.extensions = {**request.extensions, "trace": trace}
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _TrackedStream(response.stream, release)
+        return response
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert pool state and metrics to dictionary."""
+        connections = self._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        active = len(connections) - idle
+        return {
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "connections": len(connections),
+            "active_connections": active,
+            "idle_connections": idle,
+            "connections_closed": self.metrics.connections_opened - len(connections),
+            "utilisation": round(active / self.max_connections, 4) if self.max_connections else 0.0,
+            **self.metrics.to_dict(),
+        }
+
+
+def build_transport(settings: Settings) -> PooledTransport:
+    """Build the Anthropic client transport from the connection pool settings."""
+    if settings.http_pool_maxsize < settings.max_concurrent_claude_calls:
+        logger.warning(
+            f"http_pool_maxsize={settings.http_pool_maxsize} is below "
+            f"max_concurrent_claude_calls={settings.max_concurrent_claude_calls}; "
+            "Claude calls will queue for connections"
+        )
+    return PooledTransport(
+        max_connections=settings.http_pool_maxsize,
+        max_keepalive_connections=settings.http_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry_seconds,
+        http2=settings.http2_enabled,
+    )
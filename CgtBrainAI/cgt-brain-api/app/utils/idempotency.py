@@ -0,0 +1,144 @@
+"""Stored responses for requests sent with an Idempotency-Key header."""
+
+import asyncio
+import hashlib
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any
+
+from app.config import get_settings
+from app.utils.ttl_store import TTLStore
+
+
+class IdempotencyKeyReusedError(Exception):
+    """Raised when an Idempotency-Key is sent again with a different request."""
+
+    pass
+
+
+@dataclass
+class StoredResponse:
+    """A complete response, replayed verbatim to retries of the same request."""
+
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+
+@dataclass
+class IdempotencyRecord:
+    """
+    A keyed request: in progress until done is set, then its stored response.
+
+    A done record without a response was abandoned: the request failed in a
+    way worth retrying (an error or a 5xx), and the next one with the key runs
+    again.
+    """
+
+    fingerprint: str  # Method, path and body of the request the key was first used for
+    done: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    response: StoredResponse | None = None
+
+
+def request_fingerprint(method: str, path: str, query: bytes, body: bytes) -> str:
+    """Hash identifying a request, to reject a key reused for a different one."""
+    digest = hashlib.sha256()
+    for part in (method.encode(), path.encode(), query, body):
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def is_storable(status: int) -> bool:
+    """Whether a response is final for its key (5xx and 429 are left for a retry to redo)."""
+    return status < 500 and status != 429
+
+
+class IdempotencyStore:
+    """
+    TTL-bounded map from Idempotency-Key to the request it started.
+
+    The first request with a key owns it and runs; concurrent retries wait on
+    its record and get the same response. Stored responses are kept for the
+    TTL after they complete.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._records: TTLStore[IdempotencyRecord] = TTLStore(
+            ttl_seconds=ttl_seconds, max_entries=max_entries, clock=clock
+        )
+        self.started = 0
+        self.replayed = 0  # Answered from a completed record
+        self.joined = 0  # Waited for an in-flight request with the same key
+        self.conflicts = 0  # Key reused for a different request
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def begin(self, key: str, fingerprint: str) -> tuple[IdempotencyRecord, bool]:
+        """
+        Claim key for a request, or find the record already holding it.
+
+        Returns:
+            The key's record and whether the caller owns it (and must run the
+            request, then call complete or abandon).
+
+        Raises:
+            IdempotencyKeyReusedError: If the key is held by a different request.
+        """
+        record = self._records.get(key, touch=False)
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyKeyReusedError(
+                    "Idempotency-Key was already used for a different request"
+                )
+            if record.done.is_set():
+                self.replayed += 1
+            else:
+                self.joined += 1
+            return record, False
+        record = IdempotencyRecord(fingerprint=fingerprint)
+        self._records.set(key, record)
+        self.started += 1
+        return record, True
+
+    def complete(self, key: str, record: IdempotencyRecord, response: StoredResponse) -> None:
+        """Store the owner's response and release requests waiting on it."""
+        record.response = response
+        record.done.set()
+        if self._records.get(key, touch=False, count=False) is record:
+            self._records.set(key, record)  # TTL counts from completion
+
+    def abandon(self, key: str, record: IdempotencyRecord) -> None:
+        """Release the key without a response, so the next request runs again."""
+        record.done.set()
+        if self._records.get(key, touch=False, count=False) is record:
+            self._records.pop(key)
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert store statistics to dictionary."""
+        return {
+            "entries": len(self._records),
+            "started": self.started,
+            "replayed": self.replayed,
+            "joined": self.joined,
+            "conflicts": self.conflicts,
+        }
+
+
+@lru_cache
+def get_idempotency_store() -> IdempotencyStore:
+    """Get the process-wide idempotency store."""
+    settings = get_settings()
+    return IdempotencyStore(
+        ttl_seconds=settings.idempotency_ttl_seconds,
+        max_entries=settings.idempotency_max_entries,
+    )
@@ -0,0 +1,121 @@
+"""Minimal JSON Patch (RFC 6902) support for property timeline edits."""
+
+import copy
+import re
+from typing import Any
+
+# Patches may only touch event histories: /properties/<index>/property_history[/...]
+PROPERTY_HISTORY_PATH = re.compile(r"^/properties/(\d+)/property_history(?:/.*)?$")
+
+SUPPORTED_OPS = ("add", "remove", "replace", "test")
+
+
+class JsonPatchError(ValueError):
+    """Raised when a patch is malformed, out of scope or fails to apply."""
+
+
+def _parse_pointer(path: str) -> list[str]:
+    """Split a JSON pointer into unescaped reference tokens."""
+    if not path.startswith("/"):
+        raise JsonPatchError(f"Invalid JSON pointer: {path!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in path[1:].split("/")]
+
+
+def _list_index(container: list[Any], token: str, allow_end: bool) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise JsonPatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve_parent(document: Any, tokens: list[str]) -> Any:
+    target = document
+    for token in tokens[:-1]:
+        if isinstance(target, list):
+            target = target[_list_index(target, token, allow_end=False)]
+        elif isinstance(target, dict) and token in target:
+            target = target[token]
+        else:
+            raise JsonPatchError(f"Path not found at {token!r}")
+    return target
+
+
+def _apply_operation(document: Any, operation: dict[str, Any]) -> None:
+    op = operation.get("op")
+    path = operation.get("path")
+    if op not in SUPPORTED_OPS:
+        raise JsonPatchError(f"Unsupported patch operation: {op!r}")
+    if not isinstance(path, str):
+        raise JsonPatchError("Patch operation is missing 'path'")
+    if op in ("add", "replace", "test") and "value" not in operation:
+        raise JsonPatchError(f"'{op}' operation is missing 'value'")
+
+    tokens = _parse_pointer(path)
+    parent = _resolve_parent(document, tokens)
+    key = tokens[-1]
+    value = copy.deepcopy(operation.get("value"))
+
+    if isinstance(parent, list):
+        index = _list_index(parent, key, allow_end=op == "add")
+        if op == "add":
+            parent.insert(index, value)
+        elif op == "remove":
+            del parent[index]
+        elif op == "replace":
+            parent[index] = value
+        elif parent[index] != value:
+            raise JsonPatchError(f"Test failed at {path}")
+    elif isinstance(parent, dict):
+        if op != "add" and key not in parent:
+            raise JsonPatchError(f"Path not found: {path}")
+        if op in ("add", "replace"):
+            parent[key] = value
+        elif op == "remove":
+            del parent[key]
+        elif parent[key] != value:
+            raise JsonPatchError(f"Test failed at {path}")
+    else:
+        raise JsonPatchError(f"Path not found: {path}")
+
+
+def apply_history_patch(
+    document: dict[str, Any], patch: list[dict[str, Any]]
+) -> tuple[dict[str, Any], set[int]]:
+    """
+    Apply a JSON patch that edits properties[].property_history.
+
+    The patch is applied atomically to a copy: either every operation
+    succeeds or the original document is left untouched.
+
+    Args:
+        document: JSON-mode portfolio with a "properties" list.
+        patch: RFC 6902 operations (add, remove, replace, test).
+
+    Returns:
+        Tuple of (patched document, indexes of properties the patch touched).
+
+    Raises:
+        JsonPatchError: If an operation is malformed, targets anything other
+            than a property's event history, or fails to apply.
+    """
+    patched = copy.deepcopy(document)
+    touched: set[int] = set()
+    for operation in patch:
+        if not isinstance(operation, dict):
+            raise JsonPatchError("Patch operations must be objects")
+        path = str(operation.get("path", ""))
+        match = PROPERTY_HISTORY_PATH.match(path)
+        if match is None:
+            raise JsonPatchError(
+                f"Patch path must target /properties/<index>/property_history: {path!r}"
+            )
+        if operation.get("op") == "remove" and path.endswith("/property_history"):
+            raise JsonPatchError("Cannot remove a property's whole event history")
+        _apply_operation(patched, operation)
+        touched.add(int(match.group(1)))
+    return patched, touched
@@ -0,0 +1,212 @@
+"""Deterministic CGT estimate, served while the AI analysis is unavailable."""
+
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+
+from app.models import (
+    ClarificationQuestion,
+    PortfolioAnalyzeRequest,
+    PropertyCGTResult,
+    PropertyHistoryEvent,
+    StructuredAnalysis,
+    TimelineProperty,
+)
+
+# Model name reported on locally estimated responses
+LOCAL_ESTIMATE_MODEL = "local-estimate"
+
+# Assets acquired before this date are pre-CGT (s104-10(5))
+PRE_CGT_DATE = date(1985, 9, 20)
+
+ACQUISITION_EVENTS = ("purchase", "inheritance", "gift")
+
+# Element 2: incidental costs of acquisition (borrowing costs are not part of the cost base)
+ACQUISITION_COST_FIELDS = (
+    "stamp_duty",
+    "purchase_legal_fees",
+    "valuation_fees",
+    "purchase_agent_fees",
+    "building_inspection",
+    "pest_inspection",
+    "title_legal_fees",
+    "conveyancing_fees",
+    "survey_fees",
+    "search_fees",
+)
+
+# Element 2: incidental costs of disposal
+SELLING_COST_FIELDS = (
+    "legal_fees",
+    "agent_fees",
+    "advertising_costs",
+    "staging_costs",
+    "auction_costs",
+    "mortgage_discharge_fees",
+)
+
+ESTIMATE_NOTE = (
+    "Local estimate: main residence days come from move-in and move-out events only; "
+    "the absence rule, home-first-used-to-produce-income rule and elections are not applied."
+)
+
+CENTS = Decimal("0.01")
+
+
+def _cents(value: Decimal) -> Decimal:
+    return value.quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def _amount(event: PropertyHistoryEvent, field: str) -> Decimal:
+    return getattr(event, field) or Decimal("0")
+
+
+def _improvement_cost(event: PropertyHistoryEvent) -> Decimal:
+    """Element 4: capital improvements, from improvement_cost or a renovation's price."""
+    if event.improvement_cost is not None:
+        return event.improvement_cost
+    if event.event == "renovation":
+        return event.price or Decimal("0")
+    return Decimal("0")
+
+
+def main_residence_days(
+    events: list[PropertyHistoryEvent], acquired: date, disposed: date
+) -> int:
+    """
+    Days of ownership the property was the owner's main residence.
+
+    Residence starts at a move_in event (or an acquisition flagged is_ppr) and
+    ends at the next move_out or rent_start, or at disposal.
+    """
+    days = 0
+    living_since: date | None = None
+    for event in events:
+        when = min(max(date.fromisoformat(event.date), acquired), disposed)
+        if event.event == "move_in" or (event.event in ACQUISITION_EVENTS and event.is_ppr):
+            if living_since is None:
+                living_since = when
+        elif event.event in ("move_out", "rent_start") and living_since is not None:
+            days += (when - living_since).days
+            living_since = None
+    if living_since is not None:
+        days += (disposed - living_since).days
+    return days
+
+
+def estimate_property(prop: TimelineProperty, resident: bool) -> PropertyCGTResult | None:
+    """
+    Estimate CGT event A1 for a property's last sale.
+
+    Returns:
+        The estimated result, or None if the property has not been sold.
+
+    Raises:
+        ValueError: If the acquisition cost or an event date is missing or invalid.
+    """
+    events = sorted(prop.property_history, key=lambda event: event.date)
+    sales = [event for event in events if event.event == "sale"]
+    if not sales:
+        return None
+    sale = sales[-1]
+    acquisition = next((event for event in events if event.event in ACQUISITION_EVENTS), None)
+    if acquisition is None:
+        raise ValueError("no purchase, inheritance or gift event")
+    acquisition_cost = acquisition.price
+    if acquisition.event != "purchase" and acquisition.market_value is not None:
+        acquisition_cost = acquisition.market_value  # Inherited and gifted at market value
+    if acquisition_cost is None or sale.price is None:
+        raise ValueError("missing acquisition cost or sale price")
+
+    acquired = date.fromisoformat(acquisition.date)
+    disposed = date.fromisoformat(sale.contract_date or sale.date)
+
+    improvements = sum((_improvement_cost(event) for event in events), Decimal("0"))
+    cost_base = (
+        acquisition_cost
+        + sum((_amount(acquisition, field) for field in ACQUISITION_COST_FIELDS), Decimal("0"))
+        + improvements
+        + sum((_amount(sale, field) for field in SELLING_COST_FIELDS), Decimal("0"))
+    )
+    gross_gain = sale.price - cost_base
+    sections = ["s104-10", "s110-25"]
+
+    owned_days = max((disposed - acquired).days, 1)
+    if acquired < PRE_CGT_DATE:
+        exempt_fraction = Decimal("1")
+        sections.append("s104-10(5)")
+    else:
+        residence_days = main_residence_days(events, acquired, disposed)
+        exempt_fraction = min(Decimal(residence_days) / Decimal(owned_days), Decimal("1"))
+        exempt_fraction = exempt_fraction.quantize(Decimal("0.0001"), rounding=ROUND_HALF_UP)
+        if exempt_fraction == 1:
+            sections.append("s118-110")
+        elif exempt_fraction > 0:
+            sections.append("s118-185")
+
+    discount = Decimal("0")
+    if gross_gain > 0 and exempt_fraction < 1 and resident and owned_days > 365:
+        discount = Decimal("50")
+        sections.append("s115-25")
+
+    net_gain = gross_gain * (1 - exempt_fraction)
+    if net_gain > 0:
+        net_gain *= 1 - discount / 100
+
+    return PropertyCGTResult(
+        address=prop.address,
+        cgt_event_date=disposed.isoformat(),
+        capital_proceeds=_cents(sale.price),
+        cost_base=_cents(cost_base),
+        gross_capital_gain=_cents(gross_gain),
+        exempt_fraction=exempt_fraction,
+        discount_percentage=discount,
+        net_capital_gain=_cents(net_gain),
+        itaa97_sections=sections,
+        notes=[ESTIMATE_NOTE],
+    )
+
+
+def _properties(count: int) -> str:
+    return f"{count} propert{'y' if count == 1 else 'ies'}"
+
+
+def local_cgt_estimate(body: PortfolioAnalyzeRequest) -> StructuredAnalysis:
+    """
+    Estimate a portfolio's CGT from its timelines alone, without calling Claude.
+
+    Covers the common cases only: cost base elements 1, 2 and 4, main residence
+    days, pre-CGT assets and the 50% discount. Properties that cannot be
+    estimated get a critical clarification question instead of a result.
+    """
+    resident = body.additional_info.australian_resident if body.additional_info else True
+    results: list[PropertyCGTResult] = []
+    questions: list[ClarificationQuestion] = []
+    for index, prop in enumerate(body.properties):
+        try:
+            result = estimate_property(prop, resident)
+        except ValueError as e:
+            questions.append(
+                ClarificationQuestion(
+                    question_id=f"q_estimate_{index}",
+                    property_address=prop.address,
+                    period=None,
+                    question=f"Could not estimate CGT for {prop.address} ({e}). "
+                    "Please check its purchase and sale events.",
+                    severity="critical",
+                )
+            )
+            continue
+        if result is not None:
+            results.append(result)
+
+    total = sum((result.net_capital_gain for result in results), Decimal("0"))
+    summary = (
+        f"Simplified estimate calculated without the AI analysis, which is temporarily "
+        f"unavailable. Estimated net capital gain across {_properties(len(results))} "
+        f"sold: ${total:,.2f}."
+    )
+    if questions:
+        summary += f" {_properties(len(questions))} could not be estimated."
+    return StructuredAnalysis(
+        summary=summary, properties=results, clarification_questions=questions
+    )
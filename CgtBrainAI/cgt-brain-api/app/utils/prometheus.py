@@ -0,0 +1,123 @@
+"""Prometheus text exposition without a client library."""
+
+import math
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from app.utils.async_helpers import Histogram
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket upper bounds (seconds) for end-to-end HTTP request latency
+HTTP_LATENCY_BUCKETS_S: tuple[float, ...] = (
+    0.005, 0.025, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 180.0
+)
+
+Labels = dict[str, str]
+Samples = float | Iterable[tuple[Labels, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(round(value, 9))  # Scaled bounds like 0.1 * 3 print as 0.3
+
+
+class MetricsWriter:
+    """
+    Builds a scrape in the Prometheus text format (version 0.0.4).
+
+    Each counter, gauge or histogram call writes one metric family with its
+    HELP and TYPE lines. Names are prefixed with prefix.
+    """
+
+    def __init__(self, prefix: str = "cgt_"):
+        self.prefix = prefix
+        self._lines: list[str] = []
+
+    def _family(self, name: str, kind: str, help_text: str) -> str:
+        name = self.prefix + name
+        self._lines.append(f"# HELP {name} {_escape(help_text)}")
+        self._lines.append(f"# TYPE {name} {kind}")
+        return name
+
+    def _samples(self, name: str, samples: Samples) -> None:
+        if isinstance(samples, (int, float)):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            self._lines.append(f"{name}{_labels(labels)} {_value(value)}")
+
+    def counter(self, name: str, help_text: str, samples: Samples) -> None:
+        """Write a counter family (name should end in _total)."""
+        self._samples(self._family(name, "counter", help_text), samples)
+
+    def gauge(self, name: str, help_text: str, samples: Samples) -> None:
+        """Write a gauge family."""
+        self._samples(self._family(name, "gauge", help_text), samples)
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        series: Iterable[tuple[Labels, Histogram]],
+        scale: float = 1.0,
+    ) -> None:
+        """
+        Write a histogram family from Histogram instances.
+
+        Args:
+            name: Metric name, ideally with its base unit (e.g. _seconds).
+            help_text: HELP line.
+            series: (labels, histogram) pairs.
+            scale: Multiplier from the histograms' unit to the metric's
+                (0.001 for milliseconds to seconds).
+        """
+        name = self._family(name, "histogram", help_text)
+        for labels, histogram in series:
+            for bound, count in histogram.cumulative_counts():
+                le = _value(bound * scale)
+                self._lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {count}")
+            self._lines.append(f"{name}_sum{_labels(labels)} {_value(histogram.sum * scale)}")
+            self._lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        """The exposition text, ending with a newline."""
+        return "\n".join(self._lines) + "\n"
+
+
+@dataclass
+class RouteMetrics:
+    """HTTP request counts and latency histograms per route template."""
+
+    buckets: tuple[float, ...] = HTTP_LATENCY_BUCKETS_S
+    latency_s: dict[tuple[str, str], Histogram] = field(default_factory=dict)
+    responses: dict[tuple[str, str, int], int] = field(default_factory=dict)
+
+    def observe(self, method: str, route: str, status: int, seconds: float) -> None:
+        """Record one request (route is the path template, not the raw path)."""
+        key = (method, route)
+        histogram = self.latency_s.get(key)
+        if histogram is None:
+            histogram = self.latency_s[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        response_key = (method, route, status)
+        self.responses[response_key] = self.responses.get(response_key, 0) + 1
+
+
+@lru_cache
+def get_route_metrics() -> RouteMetrics:
+    """Get the process-wide HTTP route metrics."""
+    return RouteMetrics()
@@ -0,0 +1,108 @@
+"""Serialisation of timeline data into prompt text."""
+
+import json
+from enum import Enum
+from typing import Any
+
+from pydantic import BaseModel
+
+
+class PromptFormat(str, Enum):
+    """How timeline data is rendered inside the user message."""
+
+    PRETTY = "pretty"  # Indented JSON (original format)
+    COMPACT = "compact"  # Minified JSON with nulls omitted
+    TABLE = "table"  # One markdown event table per property
+
+    @property
+    def code_fence(self) -> str | None:
+        """Language tag for the fenced block, or None if rendered unfenced."""
+        return None if self is PromptFormat.TABLE else "json"
+
+
+def drop_nulls(value: Any) -> Any:
+    """
+    Recursively remove None values and empty containers.
+
+    Integral floats are emitted as ints (485000.0 -> 485000) to save tokens.
+    """
+    if isinstance(value, dict):
+        cleaned = {key: drop_nulls(item) for key, item in value.items()}
+        return {key: item for key, item in cleaned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [drop_nulls(item) for item in value if item is not None]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def dump_json(data: Any, prompt_format: PromptFormat) -> str:
+    """Serialise data as pretty or minified JSON."""
+    if prompt_format is PromptFormat.PRETTY:
+        return json.dumps(data, indent=2)
+    return json.dumps(drop_nulls(data), separators=(",", ":"), ensure_ascii=False)
+
+
+def _cell(value: Any) -> str:
+    """Render a table cell, escaping pipes and newlines."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def format_event_table(events: list[dict[str, Any]]) -> str:
+    """
+    Render events as a markdown table.
+
+    Columns are date and event first, then the union of remaining keys in
+    first-seen order, with description last. Missing values are left blank.
+    """
+    events = [drop_nulls(event) for event in events]
+    columns = ["date", "event"]
+    for event in events:
+        for key in event:
+            if key not in columns and key != "description":
+                columns.append(key)
+    if any("description" in event for event in events):
+        columns.append("description")
+
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "|" + "---|" * len(columns),
+    ]
+    for event in events:
+        lines.append("| " + " | ".join(_cell(event.get(col, "")) for col in columns) + " |")
+    return "\n".join(lines)
+
+
+def format_scalars(data: dict[str, Any]) -> str:
+    """Render flat key/value pairs on one line (nulls omitted)."""
+    return "; ".join(f"{key}={_cell(value)}" for key, value in drop_nulls(data).items())
+
+
+def format_property_timeline(timeline: BaseModel, prompt_format: PromptFormat) -> str:
+    """Serialise a legacy PropertyTimeline model in the requested format."""
+    if prompt_format is PromptFormat.PRETTY:
+        return timeline.model_dump_json(indent=2)
+    if prompt_format is PromptFormat.COMPACT:
+        return dump_json(timeline.model_dump(mode="json"), prompt_format)
+
+    data = timeline.model_dump(mode="json")
+    events = data.pop("events", [])
+    table = format_event_table(
+        [
+            {"date": event.pop("event_date"), "event": event.pop("event_type"), **event}
+            for event in events
+        ]
+    )
+    return f"{format_scalars(data)}\n\n{table}"
+
+
+def as_prompt_block(text: str, prompt_format: PromptFormat) -> str:
+    """Wrap serialised data in a code fence where the format calls for one."""
+    fence = prompt_format.code_fence
+    if fence is None:
+        return text
+    return f"```{fence}\n{text}\n```"
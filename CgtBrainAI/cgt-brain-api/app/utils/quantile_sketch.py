@@ -0,0 +1,173 @@
+"""Mergeable, bounded-memory quantile sketches for latency percentiles."""
+
+import math
+import time
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+# Quantiles reported by to_dict
+REPORTED_QUANTILES: tuple[tuple[str, float], ...] = (
+    ("p50", 0.50),
+    ("p90", 0.90),
+    ("p99", 0.99),
+    ("p999", 0.999),
+)
+
+
+@dataclass
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch (DDSketch) with bounded relative error.
+
+    A value v lands in bucket ceil(log_gamma(v)), gamma = (1 + a) / (1 - a),
+    and every bucket's values are within a relative error a of its midpoint,
+    so any quantile is reported within a of the true value. Adding a value
+    is one log and a dict increment. Sketches with the same accuracy merge
+    by adding bucket counts, so a window is the merge of its slices.
+
+    Memory is bounded by the value range (about 1,000 buckets for 1 µs to
+    1,000 s at 1% accuracy) and capped at max_buckets by folding the lowest
+    buckets together, which only coarsens the smallest values.
+    """
+
+    relative_accuracy: float = 0.01
+    min_value: float = 1e-3  # Values at or below this count as zero
+    max_buckets: int = 2048
+    count: int = field(default=0, init=False)
+    sum: float = field(default=0.0, init=False)
+    min: float = field(default=math.inf, init=False)
+    max: float = field(default=-math.inf, init=False)
+    _zero_count: int = field(default=0, init=False)
+    _buckets: dict[int, int] = field(default_factory=dict, init=False)
+    _gamma: float = field(init=False)
+    _log_gamma: float = field(init=False)
+
+    def __post_init__(self) -> None:
+        if not 0 < self.relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self._gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    def add(self, value: float) -> None:
+        """Record a single value."""
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= self.min_value:
+            self._zero_count += 1
+            return
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self._buckets[key] = self._buckets.get(key, 0) + 1
+        if len(self._buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self) -> None:
+        """Fold the lowest buckets into one to stay within max_buckets."""
+        keys = sorted(self._buckets)
+        excess = len(keys) - self.max_buckets + 1
+        folded = sum(self._buckets.pop(key) for key in keys[:excess])
+        self._buckets[keys[excess]] += folded
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add another sketch's values to this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        if not other.count:
+            return
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._zero_count += other._zero_count
+        for key, bucket_count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + bucket_count
+        if len(self._buckets) > self.max_buckets:
+            self._collapse()
+
+    @property
+    def mean(self) -> float:
+        """Exact mean of all values."""
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-th quantile (0 <= q <= 1); 0.0 when empty."""
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        running = self._zero_count
+        if running > rank:
+            return max(self.min, 0.0) if self.min <= self.min_value else 0.0
+        for key in sorted(self._buckets):
+            running += self._buckets[key]
+            if running > rank:
+                estimate = 2 * self._gamma**key / (self._gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert count, mean and reported quantiles to dictionary."""
+        return {
+            "count": self.count,
+            "mean": round(self.mean, 2),
+            **{name: round(self.quantile(q), 2) for name, q in REPORTED_QUANTILES},
+        }
+
+
+@dataclass
+class RollingQuantiles:
+    """
+    Quantile sketches over rolling time windows.
+
+    Values go into one sketch per slice_seconds; a window of n slices is the
+    merge of the current slice and the n - 1 before it, so it covers the last
+    (n - 1) to n slices of time. Slices are kept short relative to the windows
+    so that a window never falls far below its stated length (the 1m window
+    covers 50-60 s, not 0-60 s). Slices older than the longest window are
+    dropped, which bounds memory to that many sketches.
+    """
+
+    slice_seconds: float = 10.0
+    windows: tuple[int, ...] = (6, 30, 90)  # Window lengths, in slices (1m, 5m, 15m)
+    relative_accuracy: float = 0.01
+    clock: Callable[[], float] = time.monotonic
+    _slices: deque[tuple[int, QuantileSketch]] = field(default_factory=deque, init=False)
+
+    def _current(self) -> QuantileSketch:
+        index = int(self.clock() // self.slice_seconds)
+        if not self._slices or self._slices[-1][0] != index:
+            self._slices.append((index, QuantileSketch(self.relative_accuracy)))
+            self._evict(index)
+        return self._slices[-1][1]
+
+    def _evict(self, index: int) -> None:
+        oldest = index - max(self.windows) + 1
+        while self._slices and self._slices[0][0] < oldest:
+            self._slices.popleft()
+
+    def add(self, value: float) -> None:
+        """Record a single value in the current slice."""
+        self._current().add(value)
+
+    def window(self, slices: int) -> QuantileSketch:
+        """Merged sketch of the last slices slices (including the current one)."""
+        index = int(self.clock() // self.slice_seconds)
+        self._evict(index)
+        merged = QuantileSketch(self.relative_accuracy)
+        for slice_index, sketch in self._slices:
+            if slice_index > index - slices:
+                merged.merge(sketch)
+        return merged
+
+    def to_dict(self) -> dict[str, Any]:
+        """Quantiles for each window, keyed by its length (e.g. "5m")."""
+        result = {}
+        for slices in self.windows:
+            seconds = slices * self.slice_seconds
+            label = f"{seconds / 60:g}m" if seconds >= 60 else f"{seconds:g}s"
+            result[label] = self.window(slices).to_dict()
+        return result
@@ -0,0 +1,166 @@
+"""Cache of serialised analysis responses for repeated identical requests."""
+
+import hashlib
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+from pydantic import BaseModel
+
+from app.config import Settings, get_settings
+from app.utils.analysis_store import StoredAnalysis
+from app.utils.fast_json import dumps, model_bytes
+from app.utils.session_store import ConversationSession
+from app.utils.ttl_store import TTLStore
+
+# Per-caller fields left out of the cached body and appended on every hit
+SESSION_FIELDS = {"session_id", "clarification_id"}
+DEGRADED_FIELDS = {"degraded", "job_id"}
+# A hit makes no API call and gets its own patchable copy of the analysis
+HIT_FIELDS = {"analysis_id", "input_tokens", "output_tokens", "estimated_cost_usd", "cached"}
+PER_CALLER_FIELDS = SESSION_FIELDS | DEGRADED_FIELDS | HIT_FIELDS
+
+# Fields dropped from slim responses (the caller already has its own input)
+SLIM_EXCLUDE = {"properties"}
+
+
+@dataclass
+class CachedAnalysis:
+    """Pre-serialised response bodies plus the conversation and analysis to fork per caller."""
+
+    body: bytes  # JSON object without PER_CALLER_FIELDS
+    slim_body: bytes  # body without SLIM_EXCLUDE
+    session_template: ConversationSession | None
+    analysis_template: StoredAnalysis | None = None
+    stored_at: float = 0.0
+
+
+def request_hash(request: BaseModel) -> str:
+    """SHA-256 of a request's JSON, returned so clients can match slim responses to inputs."""
+    return hashlib.sha256(dumps(request.model_dump(mode="json"))).hexdigest()
+
+
+def analysis_cache_key(request: BaseModel, settings: Settings) -> str:
+    """Hash of the request and every setting that changes the analysis."""
+    material = [
+        request.model_dump(mode="json"),
+        settings.claude_model,
+        settings.prompt_format,
+        settings.modular_system_prompt,
+        settings.decompose_min_properties,
+        settings.claude_max_tokens,
+        settings.claude_max_tokens_ceiling,
+        settings.max_tokens_base,
+        settings.max_tokens_per_property,
+        settings.max_tokens_per_event,
+        settings.max_continuations,
+        settings.synthesis_max_tokens,
+    ]
+    return hashlib.sha256(dumps(material)).hexdigest()
+
+
+class ResponseCache:
+    """
+    TTL-bounded cache of analysis responses stored as JSON bytes.
+
+    Hits are returned without constructing, validating or serialising a
+    response model: the stored bytes only get the caller's own fields
+    appended (session, analysis_id, zero usage and cached=true).
+
+    Entries are fresh for ttl_seconds after they are stored, then kept for
+    another stale_seconds. Stale entries are only served as a fallback while
+    the Claude API is unavailable.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float,
+        max_entries: int,
+        stale_seconds: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._store: TTLStore[CachedAnalysis] = TTLStore(
+            ttl_seconds=ttl_seconds + stale_seconds, max_entries=max_entries, clock=clock
+        )
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.stale_hits = 0
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def get(self, key: str) -> CachedAnalysis | None:
+        """Return a fresh cached response, or None if missing or stale."""
+        entry = self._store.get(key, count=False)
+        if entry is None or self.clock() - entry.stored_at > self.ttl_seconds:
+            self._store.misses += 1
+            return None
+        self._store.hits += 1
+        return entry
+
+    def get_stale(self, key: str) -> CachedAnalysis | None:
+        """Return a cached response however old, or None if missing or expired."""
+        entry = self._store.get(key, count=False)
+        if entry is not None:
+            self.stale_hits += 1
+        return entry
+
+    def put(
+        self,
+        key: str,
+        response: BaseModel,
+        session: ConversationSession | None = None,
+        analysis: StoredAnalysis | None = None,
+    ) -> None:
+        """Serialise and store a response, snapshotting its session for later forks."""
+        self._store.set(
+            key,
+            CachedAnalysis(
+                body=model_bytes(response, exclude=PER_CALLER_FIELDS),
+                slim_body=model_bytes(response, exclude=PER_CALLER_FIELDS | SLIM_EXCLUDE),
+                session_template=session.copy(session.session_id) if session else None,
+                analysis_template=analysis,
+                stored_at=self.clock(),
+            ),
+        )
+
+    @staticmethod
+    def render(
+        entry: CachedAnalysis,
+        session: ConversationSession | None,
+        analysis_id: str | None = None,
+        slim: bool = False,
+        degraded: bool = False,
+        job_id: str | None = None,
+    ) -> bytes:
+        """Complete a cached body with the caller's own per-hit fields."""
+        fields: dict[str, Any] = {
+            "session_id": session.session_id if session else None,
+            "clarification_id": session.clarification_id if session else None,
+            "analysis_id": analysis_id,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "estimated_cost_usd": "0",
+            "cached": True,
+            "degraded": degraded,
+            "job_id": job_id,
+        }
+        body = entry.slim_body if slim else entry.body
+        return body[:-1] + b"," + dumps(fields)[1:]
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert cache statistics to dictionary."""
+        return {**self._store.to_dict(), "stale_hits": self.stale_hits}
+
+
+@lru_cache
+def get_response_cache() -> ResponseCache:
+    """Get the process-wide response cache."""
+    settings = get_settings()
+    return ResponseCache(
+        ttl_seconds=settings.response_cache_ttl_seconds,
+        max_entries=settings.response_cache_max_entries,
+        stale_seconds=settings.response_cache_stale_seconds,
+    )
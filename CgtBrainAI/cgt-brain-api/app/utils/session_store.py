@@ -0,0 +1,157 @@
+"""Conversation sessions for follow-up questions on a completed analysis."""
+
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any
+
+from app.config import get_settings
+from app.utils.ttl_store import TTLStore
+
+
+@dataclass
+class ConversationSession:
+    """
+    Multi-turn conversation rooted in a portfolio analysis.
+
+    messages starts with the portfolio user message and the analysis answer,
+    then alternates follow-up questions and answers. The system prompt (and
+    tools, for structured analyses) are stored exactly as first sent so every
+    follow-up shares the same cached prefix.
+    """
+
+    session_id: str
+    system_prompt: list[dict[str, Any]]
+    prompt_profile: str
+    messages: list[dict[str, Any]]
+    tools: list[dict[str, Any]] | None = None
+    turns: int = 0  # Follow-up and clarification turns answered
+    total_cost_usd: Decimal = Decimal("0")
+    portfolio: Any = None  # Original request, echoed back by resumed analyses
+    clarification_id: str | None = None  # Open clarification round, if any
+    pending_questions: list[Any] = field(default_factory=list)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def copy(self, session_id: str) -> "ConversationSession":
+        """Fresh session with the same prompt and history (turn counters reset)."""
+        return ConversationSession(
+            session_id=session_id,
+            system_prompt=self.system_prompt,
+            prompt_profile=self.prompt_profile,
+            messages=list(self.messages),
+            tools=self.tools,
+            portfolio=self.portfolio,
+            pending_questions=list(self.pending_questions),
+        )
+
+    def add_turn(self, question: str, answer: str, cost_usd: Decimal) -> None:
+        """Append an answered follow-up or clarification turn to the history."""
+        self.messages.append({"role": "user", "content": question})
+        self.messages.append({"role": "assistant", "content": answer})
+        self.turns += 1
+        self.total_cost_usd += cost_usd
+
+
+class SessionStore:
+    """TTL-bounded store of conversation sessions (refreshed on every access)."""
+
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self._store: TTLStore[ConversationSession] = TTLStore(
+            ttl_seconds=ttl_seconds, max_entries=max_sessions
+        )
+        # clarification_id -> session_id
+        self._clarifications: TTLStore[str] = TTLStore(
+            ttl_seconds=ttl_seconds, max_entries=max_sessions
+        )
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def create(
+        self,
+        system_prompt: list[dict[str, Any]],
+        prompt_profile: str,
+        user_message: str,
+        answer: str,
+        tools: list[dict[str, Any]] | None = None,
+        portfolio: Any = None,
+    ) -> ConversationSession:
+        """Open a session from a completed analysis exchange."""
+        session = ConversationSession(
+            session_id=uuid.uuid4().hex,
+            system_prompt=system_prompt,
+            prompt_profile=prompt_profile,
+            messages=[
+                {"role": "user", "content": user_message},
+                {"role": "assistant", "content": answer},
+            ],
+            tools=tools,
+            portfolio=portfolio,
+        )
+        self._store.set(session.session_id, session)
+        return session
+
+    def fork(self, template: ConversationSession) -> ConversationSession:
+        """Open a new session from a template, reopening its pending clarification."""
+        session = template.copy(uuid.uuid4().hex)
+        self._store.set(session.session_id, session)
+        if session.pending_questions:
+            self.open_clarification(session, session.pending_questions)
+        return session
+
+    def get(self, session_id: str) -> ConversationSession | None:
+        """Return a live session (extending its TTL), or None if unknown or expired."""
+        return self._store.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        """Close a session; returns whether it existed."""
+        session = self._store.pop(session_id)
+        if session is not None:
+            self.close_clarification(session)
+        return session is not None
+
+    def open_clarification(self, session: ConversationSession, questions: list[Any]) -> str:
+        """
+        Record that the session's latest answer is waiting on clarification.
+
+        Replaces any earlier round, so answers to superseded questions are rejected.
+
+        Returns:
+            The clarification id answers must be submitted against.
+        """
+        self.close_clarification(session)
+        session.clarification_id = uuid.uuid4().hex
+        session.pending_questions = list(questions)
+        self._clarifications.set(session.clarification_id, session.session_id)
+        return session.clarification_id
+
+    def get_clarification(self, clarification_id: str) -> ConversationSession | None:
+        """Return the session waiting on this clarification, or None if it is no longer open."""
+        session_id = self._clarifications.get(clarification_id)
+        session = self.get(session_id) if session_id is not None else None
+        if session is None or session.clarification_id != clarification_id:
+            return None
+        return session
+
+    def close_clarification(self, session: ConversationSession) -> None:
+        """Mark the session's open clarification round (if any) as answered."""
+        if session.clarification_id is not None:
+            self._clarifications.pop(session.clarification_id)
+        session.clarification_id = None
+        session.pending_questions = []
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert store statistics to dictionary."""
+        return self._store.to_dict()
+
+
+@lru_cache
+def get_session_store() -> SessionStore:
+    """Get the process-wide session store."""
+    settings = get_settings()
+    return SessionStore(
+        ttl_seconds=settings.session_ttl_seconds,
+        max_sessions=settings.session_max_sessions,
+    )
@@ -0,0 +1,161 @@
+"""Offline token estimation calibrated against reported API usage."""
+
+import json
+import math
+from dataclasses import dataclass, field
+from typing import Any
+
+# Initial characters-per-token ratio before any calibration samples arrive
+DEFAULT_CHARS_PER_TOKEN = 3.5
+
+# Fixed per-request overhead (role markers, block separators)
+REQUEST_OVERHEAD_TOKENS = 8
+
+# System prompt the API adds when tools are sent and tool_choice forces a tool
+TOOL_USE_OVERHEAD_TOKENS = 313
+
+
+def text_length(content: Any) -> int:
+    """
+    Total characters of text in a prompt value.
+
+    Accepts a string, a list of content/system blocks, a list of messages, or
+    a list of tool definitions (counted as their compact JSON).
+    """
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, dict):
+        if "text" in content:
+            return len(content["text"])
+        if "content" in content:
+            return text_length(content["content"])
+        if "input" in content:
+            return len(str(content["input"]))
+        if "input_schema" in content:
+            return len(json.dumps(content, separators=(",", ":")))
+        return 0
+    if isinstance(content, list):
+        return sum(text_length(item) for item in content)
+    return 0
+
+
+@dataclass
+class RequestEstimate:
+    """Pre-flight size and cost estimate for a single request."""
+
+    system_tokens: int
+    message_tokens: int
+    max_tokens: int
+    max_cost_usd: float
+    tool_tokens: int = 0
+
+    @property
+    def input_tokens(self) -> int:
+        """Total estimated prompt tokens."""
+        return (
+            self.system_tokens + self.message_tokens + self.tool_tokens + REQUEST_OVERHEAD_TOKENS
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert estimate to dictionary."""
+        return {
+            "input_tokens": self.input_tokens,
+            "system_tokens": self.system_tokens,
+            "message_tokens": self.message_tokens,
+            "tool_tokens": self.tool_tokens,
+            "max_tokens": self.max_tokens,
+            "max_cost_usd": round(self.max_cost_usd, 6),
+        }
+
+
+@dataclass
+class TokenEstimator:
+    """
+    Character-ratio token estimator with online calibration.
+
+    Each completed request reports its prompt length and the prompt tokens
+    the API actually billed; the chars-per-token ratio follows those samples
+    as an exponentially weighted moving average.
+    """
+
+    chars_per_token: float = DEFAULT_CHARS_PER_TOKEN
+    smoothing: float = 0.1
+    min_ratio: float = 1.5
+    max_ratio: float = 8.0
+
+    samples: int = field(default=0, init=False)
+    _abs_error_sum: float = field(default=0.0, init=False)
+
+    def estimate_tokens(self, content: Any) -> int:
+        """Estimate tokens for a string, block list or message list."""
+        length = text_length(content)
+        return math.ceil(length / self.chars_per_token) if length else 0
+
+    def calibrate(self, prompt_chars: int, actual_tokens: int) -> None:
+        """
+        Fold an observed (characters, billed prompt tokens) pair into the ratio.
+
+        Args:
+            prompt_chars: Characters of text sent (system plus messages).
+            actual_tokens: input + cache read + cache write tokens reported by the API.
+        """
+        actual_tokens -= REQUEST_OVERHEAD_TOKENS
+        if prompt_chars <= 0 or actual_tokens <= 0:
+            return
+
+        predicted = prompt_chars / self.chars_per_token
+        self._abs_error_sum += abs(predicted - actual_tokens) / actual_tokens
+        self.samples += 1
+
+        observed = min(max(prompt_chars / actual_tokens, self.min_ratio), self.max_ratio)
+        self.chars_per_token += self.smoothing * (observed - self.chars_per_token)
+
+    @property
+    def mean_abs_error(self) -> float:
+        """Mean absolute relative error of predictions made before calibration."""
+        return self._abs_error_sum / self.samples if self.samples else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert estimator state to dictionary."""
+        return {
+            "chars_per_token": round(self.chars_per_token, 4),
+            "samples": self.samples,
+            "mean_abs_error": round(self.mean_abs_error, 4),
+        }
+
+
+def choose_max_tokens(
+    property_count: int,
+    event_count: int,
+    base: int,
+    per_property: int,
+    per_event: int,
+    ceiling: int,
+    floor: int = 1,
+) -> int:
+    """
+    Size the output budget to the portfolio.
+
+    Args:
+        property_count: Number of properties analysed.
+        event_count: Total timeline events across all properties.
+        base: Tokens for the summary, notes and formatting overhead.
+        per_property: Tokens for each property's calculation section.
+        per_event: Tokens for each timeline row and its day counts.
+        ceiling: Upper bound (model output limit or configured cap).
+        floor: Lower bound, so small portfolios get no less than a flat budget.
+
+    Returns:
+        max_tokens to request.
+    """
+    budget = base + per_property * property_count + per_event * event_count
+    return max(1, min(max(budget, floor), ceiling))
+
+
+# Shared estimator so calibration from every request benefits all callers
+token_estimator = TokenEstimator()
+
+
+def estimate_tokens(content: Any) -> int:
+    """Estimate tokens with the shared, calibrated estimator."""
+    return token_estimator.estimate_tokens(content)
@@ -0,0 +1,109 @@
+"""In-memory key/value store with TTL expiry and LRU eviction."""
+
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from typing import Any, Generic, TypeVar
+
+V = TypeVar("V")
+
+
+@dataclass
+class _Entry(Generic[V]):
+    value: V
+    expires_at: float
+
+
+@dataclass
+class TTLStore(Generic[V]):
+    """
+    Bounded mapping whose entries expire a fixed time after their last write or touch.
+
+    Every entry shares the same TTL, so insertion/touch order is also expiry
+    order: expired entries are swept from the front on every write without a
+    background task, and when full the least recently used entry is evicted.
+    """
+
+    ttl_seconds: float
+    max_entries: int = 1000
+    clock: Callable[[], float] = time.monotonic
+
+    hits: int = field(default=0, init=False)
+    misses: int = field(default=0, init=False)
+    evictions: int = field(default=0, init=False)
+    _entries: "OrderedDict[str, _Entry[V]]" = field(default_factory=OrderedDict, init=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, touch=False, count=False) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def get(self, key: str, touch: bool = True, count: bool = True) -> V | None:
+        """
+        Return the value for key, or None if missing or expired.
+
+        Args:
+            key: Entry key.
+            touch: Extend the entry's lifetime by a full TTL.
+            count: Record the lookup in hit/miss statistics.
+        """
+        entry = self._entries.get(key)
+        now = self.clock()
+        if entry is None or entry.expires_at <= now:
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            if count:
+                self.misses += 1
+            return None
+
+        if touch:
+            entry.expires_at = now + self.ttl_seconds
+            self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry.value
+
+    def set(self, key: str, value: V) -> None:
+        """Insert or replace an entry, evicting the least recently used when full."""
+        now = self.clock()
+        self._entries.pop(key, None)
+        self._entries[key] = _Entry(value, now + self.ttl_seconds)
+        self.sweep(now)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: str) -> V | None:
+        """Remove and return an entry (None if missing)."""
+        entry = self._entries.pop(key, None)
+        return entry.value if entry is not None else None
+
+    def sweep(self, now: float | None = None) -> int:
+        """Drop expired entries from the front; returns how many were removed."""
+        now = self.clock() if now is None else now
+        removed = 0
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now:
+                break
+            del self._entries[key]
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert store statistics to dictionary."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,105 @@
+"""Startup warm-up of API connections and the prompt cache."""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any
+
+from app.claude_client import ClaudeClient, SystemPrompt
+from app.config import Settings
+from app.prompts import CGT_ANALYSIS_TOOL, build_system_blocks, select_system_prompt
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WarmupStatus:
+    """Progress of the startup warm-up, reported by /health/ready."""
+
+    state: str = "pending"  # pending | warming | ready | failed | disabled
+    connections: int = 0
+    prompts_primed: int = 0
+    cache_write_tokens: int = 0
+    cache_read_tokens: int = 0
+    duration_ms: float = 0.0
+    error: str | None = None
+
+    @property
+    def ready(self) -> bool:
+        """
+        Whether the instance should receive traffic.
+
+        A failed warm-up still counts as ready: it only costs the first
+        requests their handshake and cache write, whereas holding readiness
+        would keep the instance out of rotation while the API is unreachable.
+        """
+        return self.state in ("ready", "failed", "disabled")
+
+    def to_dict(self) -> dict[str, Any]:
+        """Convert status to dictionary."""
+        return {
+            "state": self.state,
+            "connections": self.connections,
+            "prompts_primed": self.prompts_primed,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "duration_ms": round(self.duration_ms, 1),
+            "error": self.error,
+        }
+
+
+def warmup_prompts(settings: Settings) -> list[tuple[SystemPrompt, list[dict[str, Any]] | None]]:
+    """
+    Prompt prefixes shared by most requests, as (system prompt, tools) pairs.
+
+    Tools come before the system prompt in the cached prefix, so markdown and
+    structured requests each need their own entry.
+    """
+    if settings.modular_system_prompt:
+        return [
+            (build_system_blocks([]), None),
+            (build_system_blocks([], structured=True), [CGT_ANALYSIS_TOOL]),
+        ]
+    return [
+        (select_system_prompt({}, modular=False)[0], None),
+        (select_system_prompt({}, modular=False, structured=True)[0], [CGT_ANALYSIS_TOOL]),
+    ]
+
+
+async def warm_up(client: ClaudeClient, settings: Settings, status: WarmupStatus) -> None:
+    """
+    Open pooled connections and prime the prompt cache, updating status.
+
+    Never raises: a failure or timeout is logged and recorded on the status.
+    """
+    status.state = "warming"
+    start = time.perf_counter()
+
+    async def run() -> None:
+        status.connections = await client.open_connections(settings.warmup_connections)
+        if not settings.warmup_prompt_cache:
+            return
+        prompts = warmup_prompts(settings)
+        usages = await asyncio.gather(
+            *(client.prime_prompt_cache(system, tools) for system, tools in prompts)
+        )
+        status.prompts_primed = len(usages)
+        status.cache_write_tokens = sum(usage.cache_creation_input_tokens for usage in usages)
+        status.cache_read_tokens = sum(usage.cache_read_input_tokens for usage in usages)
+
+    try:
+        await asyncio.wait_for(run(), timeout=settings.warmup_timeout_seconds)
+        status.state = "ready"
+    except Exception as e:
+        status.state = "failed"
+        status.error = str(e) or type(e).__name__
+        logger.warning(f"Warm-up failed, serving cold: {status.error}")
+    finally:
+        status.duration_ms = (time.perf_counter() - start) * 1000
+
+    logger.info(
+        f"Warm-up {status.state} in {status.duration_ms:.0f}ms: "
+        f"connections={status.connections}, prompts_primed={status.prompts_primed}, "
+        f"cache_write_tokens={status.cache_write_tokens}"
+    )
@@ -0,0 +1 @@
+"""Benchmarks for CGT Brain API."""
@@ -0,0 +1,116 @@
+"""
+Measure ConcurrencyLimiter acquire/release cost under contention.
+
+Workers outnumber the limiter's slots and yield once while holding a slot,
+so most acquisitions queue behind a held slot and the rest find one free.
+Three variants run the same loop:
+
+    locked (old)          the previous limiter: wait_for on every acquire and
+                          an asyncio.Lock taken twice per request for counters
+    lock-free (new)       ConcurrencyLimiter without a timeout
+    lock-free, shedding   ConcurrencyLimiter as the app configures it: timeout
+                          plus CoDel queue-delay tracking
+
+Usage:
+    python -m benchmarks.limiter_benchmark
+    python -m benchmarks.limiter_benchmark --acquires 100000 --workers 500 --slots 20
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from app.utils.async_helpers import ConcurrencyLimiter
+
+
+class LockedLimiter:
+    """The previous ConcurrencyLimiter hot path, kept for comparison."""
+
+    def __init__(self, max_concurrent: int):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._lock = asyncio.Lock()
+        self._active_count = 0
+        self._total_processed = 0
+
+    @asynccontextmanager
+    async def acquire(self, timeout: float | None = None):
+        if timeout is not None:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=timeout)
+        else:
+            await self._semaphore.acquire()
+
+        async with self._lock:
+            self._active_count += 1
+
+        try:
+            yield
+        finally:
+            async with self._lock:
+                self._active_count -= 1
+                self._total_processed += 1
+            self._semaphore.release()
+
+
+async def drive(limiter, acquires: int, workers: int, timeout: float | None) -> float:
+    """Acquire and release acquires times across workers; returns elapsed seconds."""
+    remaining = acquires
+
+    async def worker() -> None:
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            async with limiter.acquire(timeout=timeout):
+                await asyncio.sleep(0)  # Hold the slot across a scheduling point
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> None:
+    # Shedding is not expected at these delays; keep any warnings out of the timing
+    logging.disable(logging.WARNING)
+
+    variants = {
+        "locked (old)": (lambda: LockedLimiter(args.slots), args.timeout),
+        "lock-free (new)": (lambda: ConcurrencyLimiter(args.slots), None),
+        "lock-free, shedding": (
+            lambda: ConcurrencyLimiter(args.slots, target_delay=0.5, interval=5.0),
+            args.timeout,
+        ),
+    }
+
+    print(
+        f"{args.acquires} acquire/release, {args.workers} workers on {args.slots} slots, "
+        f"best of {args.repeat}"
+    )
+    header = f"{'variant':<24}{'acquires/s':>12}{'ns/acquire':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, (make, timeout) in variants.items():
+        await drive(make(), min(args.acquires // 10, 10000), args.workers, timeout)  # warm-up
+        best = min(
+            [
+                await drive(make(), args.acquires, args.workers, timeout)
+                for _ in range(args.repeat)
+            ]
+        )
+        print(f"{name:<24}{args.acquires / best:>12.0f}{best / args.acquires * 1e9:>12.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--acquires", type=int, default=1_000_000, help="Acquires per run")
+    parser.add_argument("--workers", type=int, default=200, help="Concurrent workers")
+    parser.add_argument("--slots", type=int, default=50, help="Limiter max_concurrent")
+    parser.add_argument(
+        "--timeout", type=float, default=10.0, help="Acquire timeout for timed variants"
+    )
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per variant (best is reported)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Measure per-request overhead of the request middleware on /health.
+
+Three in-process apps serve the same /health route: no middleware, the
+previous @app.middleware("http") function middleware (BaseHTTPMiddleware)
+and the pure ASGI RequestContextMiddleware and ConcurrencyLimitMiddleware.
+Requests are driven concurrently through httpx.ASGITransport, so no sockets
+are involved and the difference between apps is the middleware cost alone.
+
+Usage:
+    python -m benchmarks.middleware_benchmark
+    python -m benchmarks.middleware_benchmark --requests 50000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import logging
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI, Request
+
+from app.middleware import ConcurrencyLimitMiddleware, RequestContextMiddleware
+from app.utils.async_helpers import ConcurrencyLimiter
+
+
+async def health() -> dict:
+    return {"status": "healthy", "version": "1.0.0", "service": "cgt-brain-api"}
+
+
+def build_plain_app() -> FastAPI:
+    app = FastAPI()
+    app.get("/health")(health)
+    return app
+
+
+def build_function_middleware_app(limiter: ConcurrencyLimiter) -> FastAPI:
+    """App using the previous request_middleware implementation."""
+    app = build_plain_app()
+
+    @app.middleware("http")
+    async def request_middleware(request: Request, call_next):
+        request_id = str(uuid.uuid4())[:8]
+        request.state.request_id = request_id
+        start_time = time.perf_counter()
+        if request.url.path.startswith("/api/"):
+            async with limiter.acquire(timeout=10.0):
+                response = await call_next(request)
+        else:
+            response = await call_next(request)
+        duration_ms = (time.perf_counter() - start_time) * 1000
+        response.headers["X-Request-ID"] = request_id
+        response.headers["X-Response-Time-Ms"] = f"{duration_ms:.0f}"
+        return response
+
+    return app
+
+
+def build_asgi_middleware_app(limiter: ConcurrencyLimiter) -> FastAPI:
+    app = build_plain_app()
+    app.add_middleware(ConcurrencyLimitMiddleware, get_limiter=lambda: limiter)
+    app.add_middleware(RequestContextMiddleware)
+    return app
+
+
+async def drive(app: FastAPI, requests: int, concurrency: int, path: str) -> float:
+    """Send requests with a fixed number of concurrent workers; returns elapsed seconds."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = requests
+
+        async def worker() -> None:
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                response = await client.get(path)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> None:
+    # Request logging is identical in both middlewares; keep it out of the measurement
+    logging.disable(logging.INFO)
+
+    apps = {
+        "no middleware": build_plain_app(),
+        "@app.middleware (old)": build_function_middleware_app(ConcurrencyLimiter(1000)),
+        "pure ASGI (new)": build_asgi_middleware_app(ConcurrencyLimiter(1000)),
+    }
+
+    for app in apps.values():
+        await drive(app, min(args.requests // 10, 1000), args.concurrency, args.path)  # warm-up
+
+    results = {}
+    for name, app in apps.items():
+        runs = [
+            await drive(app, args.requests, args.concurrency, args.path)
+            for _ in range(args.repeat)
+        ]
+        results[name] = min(runs)
+
+    baseline = results["no middleware"]
+    print(
+        f"{args.requests} requests to {args.path}, "
+        f"concurrency {args.concurrency}, best of {args.repeat}"
+    )
+    header = f"{'variant':<24}{'req/s':>10}{'us/req':>10}{'overhead us/req':>18}"
+    print(header)
+    print("-" * len(header))
+    for name, elapsed in results.items():
+        per_request_us = elapsed / args.requests * 1e6
+        overhead_us = (elapsed - baseline) / args.requests * 1e6
+        throughput = args.requests / elapsed
+        print(f"{name:<24}{throughput:>10.0f}{per_request_us:>10.1f}{overhead_us:>18.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per run")
+    parser.add_argument("--concurrency", type=int, default=100, help="Concurrent clients")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per variant (best is reported)")
+    parser.add_argument("--path", default="/health", help="Path to request")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark prompt serialisation formats over the frontend scenario fixtures.
+
+Offline mode (default) reports characters and an approximate token count per
+format. With --live, token counts come from the Anthropic count_tokens
+endpoint, and --parity additionally runs a full analysis per format and
+compares the final net capital gain figures against the pretty format.
+
+Usage:
+    python -m benchmarks.prompt_format_benchmark
+    python -m benchmarks.prompt_format_benchmark --live --parity --limit 5
+"""
+
+import argparse
+import asyncio
+import json
+import re
+from pathlib import Path
+
+from app.config import Settings, get_settings
+from app.models import PortfolioAnalyzeRequest
+from app.prompts import SYSTEM_PROMPT
+from app.routers.portfolio import build_portfolio_message
+from app.utils.prompt_format import PromptFormat
+
+SCENARIO_DIR = Path(__file__).resolve().parents[3] / "public" / "scenariotestjsons"
+
+# Rough characters-per-token ratio for offline estimates
+APPROX_CHARS_PER_TOKEN = 3.5
+
+NET_GAIN_PATTERN = re.compile(r"net capital gain[^$\n]*\$\s?([\d,]+(?:\.\d+)?)", re.IGNORECASE)
+
+
+def load_scenarios(directory: Path, limit: int | None) -> dict[str, PortfolioAnalyzeRequest]:
+    """Load scenario JSON files that validate as portfolio requests."""
+    scenarios = {}
+    for path in sorted(directory.glob("*.json")):
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if "properties" not in data:
+            continue
+        scenarios[path.stem] = PortfolioAnalyzeRequest.model_validate(data)
+        if limit is not None and len(scenarios) >= limit:
+            break
+    return scenarios
+
+
+def build_message(
+    body: PortfolioAnalyzeRequest, prompt_format: PromptFormat, settings: Settings
+) -> str:
+    """Build the user message exactly as the portfolio route does."""
+    return build_portfolio_message(
+        body, settings.model_copy(update={"prompt_format": prompt_format.value})
+    )
+
+
+def extract_net_gain(analysis: str) -> str | None:
+    """Pull the last reported net capital gain figure out of a markdown analysis."""
+    matches = NET_GAIN_PATTERN.findall(analysis)
+    return matches[-1].replace(",", "") if matches else None
+
+
+async def count_tokens_live(client, model: str, message: str) -> int:
+    """Count message tokens with the Anthropic API (system prompt excluded)."""
+    result = await client.messages.count_tokens(
+        model=model, messages=[{"role": "user", "content": message}]
+    )
+    return result.input_tokens
+
+
+async def run(args: argparse.Namespace) -> None:
+    scenarios = load_scenarios(Path(args.scenarios), args.limit)
+    formats = list(PromptFormat)
+    client = None
+    settings = get_settings()
+
+    if args.live:
+        import anthropic
+
+        client = anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
+
+    totals = {fmt: 0 for fmt in formats}
+    header = f"{'scenario':<55}" + "".join(f"{fmt.value:>12}" for fmt in formats)
+    print(f"Token counts ({'count_tokens API' if args.live else 'approximate'})")
+    print(header)
+    print("-" * len(header))
+
+    for name, body in scenarios.items():
+        row = f"{name[:54]:<55}"
+        for fmt in formats:
+            message = build_message(body, fmt, settings)
+            if client is not None:
+                tokens = await count_tokens_live(client, settings.claude_model, message)
+            else:
+                tokens = round(len(message) / APPROX_CHARS_PER_TOKEN)
+            totals[fmt] += tokens
+            row += f"{tokens:>12}"
+        print(row)
+
+    print("-" * len(header))
+    print(f"{'TOTAL':<55}" + "".join(f"{totals[fmt]:>12}" for fmt in formats))
+    baseline = totals[PromptFormat.PRETTY] or 1
+    print(
+        f"{'vs pretty':<55}"
+        + "".join(f"{(totals[fmt] - baseline) / baseline:>12.1%}" for fmt in formats)
+    )
+
+    if args.parity and client is not None:
+        print("\nAnswer parity (net capital gain vs pretty format)")
+        for name, body in scenarios.items():
+            gains = {}
+            for fmt in formats:
+                response = await client.messages.create(
+                    model=settings.claude_model,
+                    max_tokens=settings.claude_max_tokens,
+                    system=SYSTEM_PROMPT,
+                    messages=[{"role": "user", "content": build_message(body, fmt, settings)}],
+                )
+                text = "".join(block.text for block in response.content if block.type == "text")
+                gains[fmt] = extract_net_gain(text)
+            reference = gains[PromptFormat.PRETTY]
+            verdict = "OK" if all(gain == reference for gain in gains.values()) else "DIFF"
+            print(f"{name[:54]:<55} {verdict:>6}  " + "  ".join(
+                f"{fmt.value}={gains[fmt]}" for fmt in formats
+            ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=str(SCENARIO_DIR), help="Scenario JSON directory")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum scenarios to include")
+    parser.add_argument("--live", action="store_true", help="Use the count_tokens API")
+    parser.add_argument("--parity", action="store_true", help="Run live analyses (needs --live)")
+    args = parser.parse_args()
+    if args.parity and not args.live:
+        parser.error("--parity needs --live")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
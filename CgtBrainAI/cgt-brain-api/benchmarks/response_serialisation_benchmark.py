@@ -0,0 +1,215 @@
+"""
+Measure analysis response serialisation over the frontend scenario fixtures.
+
+Each scenario is turned into a representative PortfolioAnalyzeResponse (a
+markdown analysis plus one structured result per property) and encoded four
+ways:
+
+- response_model: what FastAPI does for a returned model (dump, re-validate
+  against response_model, serialise, json.dumps)
+- response_model + orjson: the same with FastJSONResponse rendering
+- model_bytes: the compiled pydantic serializer straight to bytes
+- cached: a ResponseCache hit (stored bytes plus the caller's session fields)
+
+An end-to-end pass then drives a response_model route and a cached-bytes
+route through httpx.ASGITransport.
+
+Usage:
+    python -m benchmarks.response_serialisation_benchmark
+    python -m benchmarks.response_serialisation_benchmark --iterations 5000 --requests 5000
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from pydantic import TypeAdapter
+
+from app.models import (
+    PortfolioAnalyzeRequest,
+    PortfolioAnalyzeResponse,
+    PropertyCGTResult,
+    StructuredAnalysis,
+)
+from app.utils.fast_json import FastJSONResponse, RawJSONResponse, dumps, model_bytes
+from app.utils.response_cache import HIT_FIELDS, SESSION_FIELDS, ResponseCache
+from benchmarks.prompt_format_benchmark import SCENARIO_DIR, load_scenarios
+
+RESPONSE_ADAPTER = TypeAdapter(PortfolioAnalyzeResponse)
+
+
+def build_response(body: PortfolioAnalyzeRequest) -> PortfolioAnalyzeResponse:
+    """A response shaped like a real structured analysis of the scenario."""
+    results = [
+        PropertyCGTResult(
+            address=prop.address,
+            cgt_event_date="2023-06-30",
+            capital_proceeds=Decimal("950000"),
+            cost_base=Decimal("612345.67"),
+            gross_capital_gain=Decimal("337654.33"),
+            exempt_fraction=Decimal("0.4123"),
+            discount_percentage=Decimal("50"),
+            net_capital_gain=Decimal("99221.45"),
+            notes=["Main residence exemption apportioned by days", "6-year absence rule applied"],
+        )
+        for prop in body.properties
+    ]
+    analysis = StructuredAnalysis(
+        summary="Net capital gain after exemptions and discount.", properties=results
+    )
+    working = "Step-by-step working for each period of ownership.\n" * 60
+    return PortfolioAnalyzeResponse(
+        analysis="## CGT Analysis\n\n" + working,
+        properties=body.properties,
+        input_tokens=5400,
+        output_tokens=2100,
+        cached=True,
+        model="claude-sonnet-4-20250514",
+        estimated_cost_usd=Decimal("0.0412"),
+        stop_reason="end_turn",
+        structured=analysis,
+        session_id=uuid.uuid4().hex,
+        analysis_id=uuid.uuid4().hex,
+    )
+
+
+def encode_response_model(response: PortfolioAnalyzeResponse) -> bytes:
+    """FastAPI's response_model path with the default JSONResponse."""
+    validated = RESPONSE_ADAPTER.validate_python(response.model_dump())
+    content = RESPONSE_ADAPTER.dump_python(validated, mode="json")
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def encode_response_model_fast(response: PortfolioAnalyzeResponse) -> bytes:
+    """FastAPI's response_model path rendered by FastJSONResponse."""
+    validated = RESPONSE_ADAPTER.validate_python(response.model_dump())
+    return dumps(RESPONSE_ADAPTER.dump_python(validated, mode="json"))
+
+
+def time_encoder(encode, responses: list, iterations: int) -> float:
+    """Microseconds per encoded response."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for response in responses:
+            encode(response)
+    return (time.perf_counter() - start) / (iterations * len(responses)) * 1e6
+
+
+def build_app(response: PortfolioAnalyzeResponse, cache: ResponseCache) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/model", response_model=PortfolioAnalyzeResponse)
+    async def model_route() -> PortfolioAnalyzeResponse:
+        return response
+
+    @app.get("/fast", response_model=PortfolioAnalyzeResponse, response_class=FastJSONResponse)
+    async def fast_route() -> PortfolioAnalyzeResponse:
+        return response
+
+    @app.get("/cached")
+    async def cached_route() -> RawJSONResponse:
+        return RawJSONResponse(ResponseCache.render(cache.get("key"), None))
+
+    return app
+
+
+async def drive(app: FastAPI, path: str, requests: int, concurrency: int) -> float:
+    """Send requests with a fixed number of concurrent workers; returns elapsed seconds."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        remaining = requests
+
+        async def worker() -> None:
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                (await client.get(path)).raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+
+async def run(args: argparse.Namespace) -> None:
+    logging.disable(logging.INFO)
+    scenarios = load_scenarios(Path(args.scenarios), args.limit)
+    responses = [build_response(body) for body in scenarios.values()]
+    cache = ResponseCache(ttl_seconds=3600, max_entries=len(responses) + 1)
+    entries = []
+    for index, response in enumerate(responses):
+        cache.put(str(index), response)
+        entries.append(cache.get(str(index)))
+
+    # The fast paths must produce the same document as FastAPI
+    for response, entry in zip(responses, entries):
+        expected = json.loads(encode_response_model(response))
+        assert json.loads(encode_response_model_fast(response)) == expected
+        assert json.loads(model_bytes(response)) == expected
+        cached = json.loads(ResponseCache.render(entry, None))
+        per_hit = SESSION_FIELDS | HIT_FIELDS
+        assert {k: v for k, v in cached.items() if k not in per_hit} == {
+            k: v for k, v in expected.items() if k not in per_hit
+        }
+
+    average_kb = sum(len(model_bytes(r)) for r in responses) / len(responses) / 1024
+    print(
+        f"{len(responses)} scenarios, average body {average_kb:.1f} KiB, "
+        f"{args.iterations} iterations"
+    )
+    encoders = {
+        "response_model + json": encode_response_model,
+        "response_model + orjson": encode_response_model_fast,
+        "model_bytes": model_bytes,
+    }
+    results = {
+        name: time_encoder(encode, responses, args.iterations) for name, encode in encoders.items()
+    }
+    results["cached bytes"] = time_encoder(
+        lambda entry: ResponseCache.render(entry, None), entries, args.iterations
+    )
+    baseline = results["response_model + json"]
+    header = f"{'encoder':<26}{'us/response':>14}{'speed-up':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, micros in results.items():
+        print(f"{name:<26}{micros:>14.1f}{baseline / micros:>9.1f}x")
+
+    largest = max(responses, key=lambda r: len(r.properties))
+    cache.put("key", largest)
+    app = build_app(largest, cache)
+    print(
+        f"\nEnd to end ({len(largest.properties)} properties), {args.requests} requests, "
+        f"concurrency {args.concurrency}"
+    )
+    header = f"{'route':<26}{'req/s':>14}"
+    print(header)
+    print("-" * len(header))
+    for path in ("/model", "/fast", "/cached"):
+        await drive(app, path, min(args.requests // 10, 500), args.concurrency)  # warm-up
+        elapsed = await drive(app, path, args.requests, args.concurrency)
+        print(f"{path:<26}{args.requests / elapsed:>14.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--scenarios", default=str(SCENARIO_DIR), help="Directory of scenario JSON files"
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Only load the first N scenarios")
+    parser.add_argument("--iterations", type=int, default=1000, help="Encodes per scenario")
+    parser.add_argument("--requests", type=int, default=3000, help="End-to-end requests per route")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
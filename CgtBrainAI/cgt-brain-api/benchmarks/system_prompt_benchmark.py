@@ -0,0 +1,121 @@
+"""
+Measure modular system prompt savings and cache reuse per scenario category.
+
+For every scenario in public/scenariotestjsons the selected prompt modules are
+compared with the full monolithic prompt. Scenarios are grouped by their
+additional_info.subcategory. The cache columns replay the scenarios in order
+and report how often each cached system block would already be warm (core
+block and module block), assuming requests arrive within the cache TTL.
+
+Usage:
+    python -m benchmarks.system_prompt_benchmark
+    python -m benchmarks.system_prompt_benchmark --live
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+from pathlib import Path
+
+from app.config import get_settings
+from app.prompts import SYSTEM_PROMPT, build_system_blocks, prompt_profile, select_sections
+from benchmarks.prompt_format_benchmark import (
+    APPROX_CHARS_PER_TOKEN,
+    SCENARIO_DIR,
+    load_scenarios,
+)
+
+
+async def count_system_tokens(client, model: str, blocks: list[dict]) -> int:
+    """Count system prompt tokens with the Anthropic API."""
+    result = await client.messages.count_tokens(
+        model=model,
+        system=blocks,
+        messages=[{"role": "user", "content": "."}],
+    )
+    return result.input_tokens
+
+
+async def run(args: argparse.Namespace) -> None:
+    scenarios = load_scenarios(Path(args.scenarios), args.limit)
+    settings = get_settings()
+    client = None
+    if args.live:
+        import anthropic
+
+        client = anthropic.AsyncAnthropic(api_key=settings.anthropic_api_key)
+
+    token_cache: dict[str, int] = {}
+
+    async def tokens_for(profile: str, blocks: list[dict]) -> int:
+        if profile not in token_cache:
+            if client is not None:
+                token_cache[profile] = await count_system_tokens(
+                    client, settings.claude_model, blocks
+                )
+            else:
+                text_length = sum(len(block["text"]) for block in blocks)
+                token_cache[profile] = round(text_length / APPROX_CHARS_PER_TOKEN)
+        return token_cache[profile]
+
+    full_blocks = [{"type": "text", "text": SYSTEM_PROMPT}]
+    full_tokens = await tokens_for("full", full_blocks)
+
+    stats: dict[str, dict] = defaultdict(
+        lambda: {"requests": 0, "tokens": 0, "core_hits": 0, "module_hits": 0, "module_reqs": 0}
+    )
+    seen_profiles: set[str] = set()
+    core_warm = False
+
+    for body in scenarios.values():
+        data = body.model_dump(mode="json")
+        category = (data.get("additional_info") or {}).get("subcategory") or "Uncategorised"
+        sections = select_sections(data)
+        profile = prompt_profile(sections)
+        tokens = await tokens_for(profile, build_system_blocks(sections))
+
+        row = stats[category]
+        row["requests"] += 1
+        row["tokens"] += tokens
+        row["core_hits"] += 1 if core_warm else 0
+        if sections:
+            row["module_reqs"] += 1
+            row["module_hits"] += 1 if profile in seen_profiles else 0
+        core_warm = True
+        seen_profiles.add(profile)
+
+    header = (
+        f"{'category':<32}{'reqs':>6}{'avg tokens':>12}{'saving':>9}"
+        f"{'core hit':>10}{'module hit':>12}"
+    )
+    print(f"System prompt tokens ({'count_tokens API' if client else 'approximate'}); "
+          f"full prompt = {full_tokens}")
+    print(header)
+    print("-" * len(header))
+    total_requests = total_tokens = 0
+    for category, row in sorted(stats.items()):
+        average = row["tokens"] / row["requests"]
+        module_hit = row["module_hits"] / row["module_reqs"] if row["module_reqs"] else 1.0
+        print(
+            f"{category[:31]:<32}{row['requests']:>6}{average:>12.0f}"
+            f"{1 - average / full_tokens:>9.1%}"
+            f"{row['core_hits'] / row['requests']:>10.1%}{module_hit:>12.1%}"
+        )
+        total_requests += row["requests"]
+        total_tokens += row["tokens"]
+    print("-" * len(header))
+    overall = total_tokens / max(total_requests, 1)
+    print(f"{'ALL':<32}{total_requests:>6}{overall:>12.0f}{1 - overall / full_tokens:>9.1%}")
+    print(f"\nDistinct module combinations: {len(seen_profiles)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenarios", default=str(SCENARIO_DIR), help="Scenario JSON directory")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum scenarios to include")
+    parser.add_argument("--live", action="store_true", help="Use the count_tokens API")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Local stand-in for the Anthropic Messages API, for offline testing.
+
+Answers POST /v1/messages with a short text reply and emulates prompt
+caching: the first request with a given tools + system prefix reports it as
+written to the cache, later ones as read from it. Token counts are
+approximated from text length.
+
+Usage:
+    python -m tests.stub_upstream --port 8081
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8081 uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+CHARS_PER_TOKEN = 4
+
+
+def create_stub_app(reply: str = "OK") -> FastAPI:
+    """Create the stand-in API app; its state is kept on app.state."""
+    app = FastAPI()
+    app.state.cached_prefixes = set()
+    app.state.requests = []
+
+    @app.head("/")
+    async def root() -> None:
+        return None
+
+    @app.post("/v1/messages")
+    async def create_message(request: Request) -> dict[str, Any]:
+        body = await request.json()
+        app.state.requests.append(body)
+
+        prefix = json.dumps([body.get("tools"), body.get("system")], sort_keys=True)
+        prefix_tokens = len(prefix) // CHARS_PER_TOKEN
+        key = hashlib.sha256(prefix.encode()).hexdigest()
+        cached = key in app.state.cached_prefixes
+        app.state.cached_prefixes.add(key)
+
+        output_tokens = min(body["max_tokens"], max(1, len(reply) // CHARS_PER_TOKEN))
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body["model"],
+            "content": [{"type": "text", "text": reply}],
+            "stop_reason": "max_tokens" if body["max_tokens"] <= output_tokens else "end_turn",
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": len(json.dumps(body["messages"])) // CHARS_PER_TOKEN,
+                "output_tokens": output_tokens,
+                "cache_creation_input_tokens": 0 if cached else prefix_tokens,
+                "cache_read_input_tokens": prefix_tokens if cached else 0,
+            },
+        }
+
+    return app
+
+
+@asynccontextmanager
+async def serve(app: FastAPI, host: str = "127.0.0.1") -> AsyncIterator[str]:
+    """Serve an app on a free local port for the duration of the block; yields its base URL."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    try:
+        while not server.started:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.01)
+        yield f"http://{host}:{sock.getsockname()[1]}"
+    finally:
+        server.should_exit = True
+        await task
+        sock.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--reply", default="OK", help="Text every message is answered with")
+    args = parser.parse_args()
+    uvicorn.run(create_stub_app(args.reply), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
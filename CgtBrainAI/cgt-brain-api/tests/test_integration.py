@@ -1,16 +1,82 @@
 """Integration tests for CGT Brain API."""
 
 import asyncio
+import functools
 import os
+import random
+from datetime import datetime
 from decimal import Decimal
+from zoneinfo import ZoneInfo
 from unittest.mock import AsyncMock, MagicMock, patch
 
+import anthropic
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
-from app.main import app
-from app.models import UsageStats
-from app.utils import CostCalculator, ConcurrencyLimiter, CircuitBreaker, RequestMetrics
+from app.claude_client import ClaudeClient
+from app.config import Settings
+from app.main import app, get_claude_client
+from app.middleware import (
+    ConcurrencyLimitMiddleware,
+    CompressionMiddleware,
+    IdempotencyMiddleware,
+    RequestContextMiddleware,
+    accepts_encoding,
+)
+from app.models import PortfolioAnalyzeRequest, UsageStats
+from app.prompts import (
+    CGT_ANALYSIS_TOOL,
+    CGT_ANALYSIS_TOOL_CHOICE,
+    PROMPT_SECTIONS,
+    SYSTEM_PROMPT,
+    build_system_blocks,
+    select_sections,
+    select_system_prompt,
+)
+from app.routers.portfolio import (
+    build_portfolio_message,
+    format_portfolio_for_claude,
+    get_app_settings,
+    should_decompose,
+)
+from app.utils import (
+    CostCalculator,
+    ConcurrencyLimiter,
+    CircuitBreaker,
+    DeadlineExceeded,
+    Histogram,
+    LoadShed,
+    PromptFormat,
+    RequestMetrics,
+    TokenEstimator,
+    JsonPatchError,
+    TTLStore,
+)
+from app.utils.async_helpers import (
+    CircuitBreakerOpen,
+    RetryBudget,
+    deadline_scope,
+    with_retry,
+)
+from app.utils.cache_keepalive import PromptCacheKeepAlive
+from app.utils.deferred_jobs import DeferredJobQueue, get_job_queue
+from app.utils.fast_json import dumps
+from app.utils.http_pool import PooledTransport, http
+from app.utils.idempotency import IdempotencyStore, get_idempotency_store
+from app.utils.json_patch import apply_history_patch
+from app.utils.prometheus import MetricsWriter
+from app.utils.quantile_sketch import QuantileSketch, RollingQuantiles
+from app.utils.local_estimate import LOCAL_ESTIMATE_MODEL, local_cgt_estimate
+from app.utils.analysis_store import get_analysis_store
+from app.utils.response_cache import ResponseCache, analysis_cache_key, get_response_cache
+from app.utils.token_estimator import (
+    REQUEST_OVERHEAD_TOKENS,
+    TOOL_USE_OVERHEAD_TOKENS,
+    choose_max_tokens,
+)
+from app.warmup import WarmupStatus, warm_up, warmup_prompts
+from tests.stub_upstream import create_stub_app, serve
 from tests.test_data import (
     SIMPLE_MAIN_RESIDENCE,
     PARTIAL_MAIN_RESIDENCE,
@@ -19,6 +85,18 @@ from tests.test_data import (
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Give every test an empty response cache so repeated portfolios reach the mocks."""
+    get_response_cache.cache_clear()
+    get_job_queue.cache_clear()
+    get_idempotency_store.cache_clear()
+    yield
+    get_response_cache.cache_clear()
+    get_job_queue.cache_clear()
+    get_idempotency_store.cache_clear()
+
+
 @pytest.fixture
 def client():
     """Create test client."""
@@ -40,9 +118,32 @@ def mock_claude_response():
         cached=False,
         model="claude-sonnet-4-20250514",
         latency_ms=1500.0,
+        stop_reason="end_turn",
     )
 
 
+def make_api_message(text, stop_reason="end_turn", output_tokens=500, cache_read=0):
+    """Create a stand-in for an anthropic Message returned by messages.create."""
+    return MagicMock(
+        content=[MagicMock(type="text", text=text)],
+        stop_reason=stop_reason,
+        usage=MagicMock(
+            input_tokens=1000,
+            output_tokens=output_tokens,
+            cache_creation_input_tokens=0,
+            cache_read_input_tokens=cache_read,
+        ),
+    )
+
+
+@pytest.fixture
+def claude_client():
+    """Create a ClaudeClient with a mocked messages API."""
+    instance = ClaudeClient(Settings(anthropic_api_key="test-key", max_continuations=2))
+    instance.client.messages.create = AsyncMock()
+    return instance
+
+
 class TestHealthEndpoint:
     """Tests for the health check endpoint."""
 
@@ -68,6 +169,211 @@ class TestHealthEndpoint:
         assert "x-request-id" in response.headers
 
 
+class TestRequestContextMiddleware:
+    """Tests for the pure ASGI request middleware."""
+
+    @staticmethod
+    def make_app(limiter):
+        """Minimal Starlette app wrapped in the middleware."""
+        from starlette.applications import Starlette
+        from starlette.responses import PlainTextResponse, StreamingResponse
+        from starlette.routing import Route
+
+        async def echo_id(request):
+            return PlainTextResponse(request.state.request_id)
+
+        async def stream(request):
+            async def chunks():
+                yield b"a"
+                assert limiter.active_count == 1  # slot held while streaming
+                yield b"b"
+
+            return StreamingResponse(chunks())
+
+        inner = Starlette(routes=[Route("/api/id", echo_id), Route("/api/stream", stream)])
+        limited = ConcurrencyLimitMiddleware(
+            inner, get_limiter=lambda: limiter, acquire_timeout=0.01
+        )
+        return RequestContextMiddleware(limited)
+
+    def test_request_id_matches_header(self):
+        """Test that request.state.request_id is the ID returned in the header."""
+        client = TestClient(self.make_app(ConcurrencyLimiter(max_concurrent=1)))
+
+        response = client.get("/api/id")
+
+        assert response.text == response.headers["x-request-id"]
+        assert "x-response-time-ms" in response.headers
+
+    def test_streaming_holds_slot_until_body_sent(self):
+        """Test that the concurrency slot is released only after streaming completes."""
+        limiter = ConcurrencyLimiter(max_concurrent=1)
+        client = TestClient(self.make_app(limiter))
+
+        response = client.get("/api/stream")
+
+        assert response.content == b"ab"
+        assert limiter.active_count == 0
+        assert limiter.total_processed == 1
+
+    @pytest.mark.asyncio
+    async def test_rejects_when_at_capacity(self):
+        """Test that requests beyond the global limit get 503 with a request ID."""
+        import httpx
+
+        limiter = ConcurrencyLimiter(max_concurrent=1)
+        transport = httpx.ASGITransport(app=self.make_app(limiter))
+
+        async with limiter.acquire():
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                response = await http.get("/api/id")
+
+        assert response.status_code == 503
+        assert response.json()["request_id"] == response.headers["x-request-id"]
+        assert response.headers["retry-after"] == str(response.json()["retry_after"])
+
+
+class TestIdempotencyKey:
+    """Tests for replaying stored responses to retries with the same Idempotency-Key."""
+
+    @staticmethod
+    def make_app(store, handler):
+        """Minimal Starlette app with one POST route, wrapped in the middleware."""
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+
+        inner = Starlette(routes=[Route("/api/run", handler, methods=["POST"])])
+        return IdempotencyMiddleware(inner, get_store=lambda: store, wait_timeout=5.0)
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_retry_replays_stored_response(self, mock_get_instance, client, mock_claude_response):
+        """Test that a retried analysis returns the first response without calling Claude."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+        portfolio = {
+            "properties": [
+                {
+                    "address": "3 Retry Road",
+                    "property_history": [
+                        {"date": "2015-06-01", "event": "purchase", "price": 600000},
+                        {"date": "2023-06-01", "event": "sale", "price": 900000},
+                    ],
+                }
+            ],
+        }
+        headers = {"Idempotency-Key": "calc-3-retry-road"}
+
+        first = client.post("/api/v1/analyze-portfolio", json=portfolio, headers=headers)
+        second = client.post("/api/v1/analyze-portfolio", json=portfolio, headers=headers)
+
+        assert mock_client.send_message.call_count == 1
+        assert second.headers["Idempotent-Replayed"] == "true"
+        assert second.json() == first.json()  # Same session, not a response cache fork
+
+        portfolio["properties"][0]["address"] = "4 Retry Road"
+        reused = client.post("/api/v1/analyze-portfolio", json=portfolio, headers=headers)
+        assert reused.status_code == 422
+
+    @pytest.mark.asyncio
+    async def test_concurrent_retry_joins_in_flight_request(self):
+        """Test that a retry sent while the first request runs waits for its response."""
+        import httpx
+        from starlette.responses import JSONResponse
+
+        calls = 0
+        release = asyncio.Event()
+
+        async def handler(request):
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return JSONResponse({"call": calls, "body": (await request.json())["n"]})
+
+        store = IdempotencyStore(ttl_seconds=60, max_entries=10)
+        transport = httpx.ASGITransport(app=self.make_app(store, handler))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            request = functools.partial(
+                http.post, "/api/run", json={"n": 1}, headers={"Idempotency-Key": "k"}
+            )
+            first = asyncio.create_task(request())
+            second = asyncio.create_task(request())
+            await asyncio.sleep(0.05)
+            release.set()
+            first, second = await first, await second
+
+        assert calls == 1
+        assert first.json() == second.json() == {"call": 1, "body": 1}
+        assert store.to_dict()["joined"] == 1
+
+    @pytest.mark.asyncio
+    async def test_waiting_retry_holds_no_concurrency_slot(self):
+        """Test that a retry waiting on an in-flight key leaves the limiter slot free."""
+        import httpx
+        from starlette.applications import Starlette
+        from starlette.responses import JSONResponse
+        from starlette.routing import Route
+
+        limiter = ConcurrencyLimiter(max_concurrent=2)
+        release = asyncio.Event()
+
+        async def run(request):
+            await release.wait()
+            return JSONResponse({"ok": True})
+
+        async def other(request):
+            return JSONResponse({"active": limiter.active_count})
+
+        inner = Starlette(
+            routes=[Route("/api/run", run, methods=["POST"]), Route("/api/other", other)]
+        )
+        store = IdempotencyStore(ttl_seconds=60, max_entries=10)
+        app = IdempotencyMiddleware(
+            ConcurrencyLimitMiddleware(inner, get_limiter=lambda: limiter, acquire_timeout=0.01),
+            get_store=lambda: store,
+            wait_timeout=5.0,
+        )
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            headers = {"Idempotency-Key": "k"}
+            first = asyncio.create_task(http.post("/api/run", headers=headers))
+            retries = [
+                asyncio.create_task(http.post("/api/run", headers=headers)) for _ in range(3)
+            ]
+            await asyncio.sleep(0.05)
+            assert limiter.active_count == 1
+            other = await http.get("/api/other")  # Second slot is still free
+            release.set()
+            await asyncio.gather(first, *retries)
+
+        assert other.json() == {"active": 2}
+        assert store.to_dict()["joined"] == 3
+
+    @pytest.mark.asyncio
+    async def test_server_error_not_stored(self):
+        """Test that a retry after a 5xx runs the request again."""
+        import httpx
+        from starlette.responses import JSONResponse
+
+        statuses = [503, 200]
+
+        async def handler(request):
+            return JSONResponse({}, status_code=statuses.pop(0))
+
+        store = IdempotencyStore(ttl_seconds=60, max_entries=10)
+        transport = httpx.ASGITransport(app=self.make_app(store, handler))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            headers = {"Idempotency-Key": "k"}
+            failed = await http.post("/api/run", headers=headers)
+            retried = await http.post("/api/run", headers=headers)
+            replayed = await http.post("/api/run", headers=headers)
+
+        assert (failed.status_code, retried.status_code, replayed.status_code) == (503, 200, 200)
+        assert "idempotent-replayed" not in retried.headers
+        assert replayed.headers["idempotent-replayed"] == "true"
+        assert not statuses
+
+
 class TestAnalyzeEndpoint:
     """Tests for the analyze endpoint."""
 
@@ -86,6 +392,9 @@ class TestAnalyzeEndpoint:
         )
 
         assert response.status_code == 200
+        call = mock_client.send_message.call_args.kwargs
+        assert call["prompt_profile"] == "core"
+        assert isinstance(call["system_prompt"], list)
 
     def test_analyze_endpoint_rejects_invalid_request(self, client):
         """Test analyze endpoint rejects invalid data."""
@@ -106,6 +415,1116 @@ class TestAnalyzeEndpoint:
         assert response.status_code == 422
 
 
+class TestAutoContinuation:
+    """Tests for continuing responses that stop at max_tokens."""
+
+    @pytest.mark.asyncio
+    async def test_continues_and_stitches_truncated_output(self, claude_client):
+        """Test that a max_tokens stop triggers a continuation that is stitched on."""
+        claude_client.client.messages.create.side_effect = [
+            make_api_message("Step 1: cost base \n", stop_reason="max_tokens"),
+            make_api_message(" = $600,000. Done.", cache_read=900),
+        ]
+
+        response = await claude_client.send_message("Analyze", "System", max_tokens=100)
+
+        assert response.content == "Step 1: cost base = $600,000. Done."
+        assert response.continuations == 1
+        assert response.stop_reason == "end_turn"
+        assert response.usage.output_tokens == 1000
+        assert response.cached is True
+
+        messages = claude_client.client.messages.create.call_args.kwargs["messages"]
+        assert messages[-1] == {"role": "assistant", "content": "Step 1: cost base"}
+        assert messages[0]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+
+    @pytest.mark.asyncio
+    async def test_continuations_are_capped(self, claude_client):
+        """Test that continuation calls stop at max_continuations."""
+        claude_client.client.messages.create.side_effect = [
+            make_api_message(f"part {i}", stop_reason="max_tokens") for i in range(5)
+        ]
+
+        response = await claude_client.send_message("Analyze", "System", max_tokens=100)
+
+        assert claude_client.client.messages.create.call_count == 3
+        assert response.continuations == 2
+        assert response.stop_reason == "max_tokens"
+        assert claude_client.metrics.truncated_responses == 1
+
+
+class TestStructuredOutput:
+    """Tests for structured (tool-use) analysis output."""
+
+    TOOL_INPUT = {
+        "summary": "One property sold; partial exemption applies.",
+        "properties": [
+            {
+                "address": "1 Test St",
+                "capital_proceeds": 950000,
+                "cost_base": 625000,
+                "gross_capital_gain": 325000,
+                "exempt_fraction": 0.6,
+                "discount_percentage": 50,
+                "net_capital_gain": 65000,
+                "itaa97_sections": ["s118-185", "s115-25"],
+            }
+        ],
+        "clarification_questions": [],
+    }
+
+    PORTFOLIO = {
+        "output_format": "structured",
+        "properties": [
+            {
+                "address": "1 Test St",
+                "property_history": [
+                    {"date": "2015-01-01", "event": "purchase", "price": 600000},
+                    {"date": "2024-01-01", "event": "sale", "price": 950000},
+                ],
+            }
+        ],
+    }
+
+    def test_tool_schema_uses_numbers_for_money(self):
+        """Test that the tool schema asks for plain numbers, not strings."""
+        result_schema = CGT_ANALYSIS_TOOL["input_schema"]["$defs"]["PropertyCGTResult"]
+
+        assert result_schema["properties"]["net_capital_gain"] == {
+            "description": "Gain after exemption and discount in AUD (negative for a loss)",
+            "type": "number",
+        }
+        assert "total_net_capital_gain" not in CGT_ANALYSIS_TOOL["input_schema"]["properties"]
+
+    @pytest.mark.asyncio
+    async def test_client_sends_tools_and_parses_tool_input(self, claude_client):
+        """Test that tool definitions are sent and tool_use input is returned."""
+        message = make_api_message("", stop_reason="tool_use")
+        message.content = [MagicMock(type="tool_use", input=self.TOOL_INPUT)]
+        claude_client.client.messages.create.return_value = message
+
+        response = await claude_client.send_message(
+            "Analyze", "System", tools=[CGT_ANALYSIS_TOOL], tool_choice=CGT_ANALYSIS_TOOL_CHOICE
+        )
+
+        call = claude_client.client.messages.create.call_args.kwargs
+        assert call["tools"] == [CGT_ANALYSIS_TOOL]
+        assert call["tool_choice"]["name"] == "record_cgt_analysis"
+        assert response.tool_input == self.TOOL_INPUT
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_structured_endpoint_validates_results(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that structured mode returns typed results with server-side totals."""
+        mock_claude_response.tool_input = self.TOOL_INPUT
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        response = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["analysis"] == self.TOOL_INPUT["summary"]
+        assert data["structured"]["properties"][0]["exempt_fraction"] == "0.6"
+        assert data["structured"]["total_net_capital_gain"] == "65000"
+        assert data["structured"]["needs_clarification"] is False
+        assert mock_client.send_message.call_args.kwargs["prompt_profile"] == "structured"
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_structured_endpoint_rejects_invalid_tool_input(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that tool input failing validation is reported as a bad gateway."""
+        mock_claude_response.tool_input = {"summary": "x", "properties": [{"address": "1"}]}
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        response = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+
+        assert response.status_code == 502
+
+
+class TestFollowUpSessions:
+    """Tests for stateful follow-up conversations."""
+
+    PORTFOLIO = {
+        "properties": [
+            {
+                "address": "1 Test St",
+                "property_history": [
+                    {"date": "2015-01-01", "event": "purchase", "price": 600000},
+                    {"date": "2024-01-01", "event": "sale", "price": 950000},
+                ],
+            }
+        ],
+    }
+
+    def test_ttl_store_expires_and_evicts(self):
+        """Test that entries expire after the TTL and the LRU entry is evicted when full."""
+        now = [0.0]
+        store = TTLStore(ttl_seconds=10, max_entries=2, clock=lambda: now[0])
+        store.set("a", 1)
+        store.set("b", 2)
+        now[0] = 5
+        assert store.get("a") == 1  # touch: a now expires at 15, b at 10
+        store.set("c", 3)
+
+        assert "b" not in store
+        now[0] = 14
+        assert store.get("a") == 1
+        now[0] = 30
+        assert store.get("a") is None
+        assert store.to_dict()["evictions"] == 2
+
+    @pytest.mark.asyncio
+    async def test_send_conversation_caches_last_turn(self, claude_client):
+        """Test that only the final user turn carries a message cache breakpoint."""
+        claude_client.client.messages.create.return_value = make_api_message("Answer")
+        history = [
+            {"role": "user", "content": "Portfolio"},
+            {"role": "assistant", "content": "Analysis"},
+            {"role": "user", "content": "Why?"},
+        ]
+
+        await claude_client.send_conversation(history, "System")
+
+        sent = claude_client.client.messages.create.call_args.kwargs["messages"]
+        assert sent[:2] == history[:2]
+        assert sent[2]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert history[2]["content"] == "Why?"
+
+    @pytest.mark.asyncio
+    async def test_session_opening_call_caches_its_message(self, claude_client):
+        """Test that the analysis call caches its message, so the first follow-up reads it."""
+        claude_client.client.messages.create.return_value = make_api_message("Answer")
+
+        await claude_client.send_message("Portfolio", "System")
+        plain = claude_client.client.messages.create.call_args.kwargs["messages"]
+        await claude_client.send_message("Portfolio", "System", cache_message=True)
+        cached = claude_client.client.messages.create.call_args.kwargs["messages"]
+
+        assert plain == [{"role": "user", "content": "Portfolio"}]
+        assert cached[0]["content"] == [
+            {"type": "text", "text": "Portfolio", "cache_control": {"type": "ephemeral"}}
+        ]
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_follow_up_reuses_prefix(self, mock_get_instance, client, mock_claude_response):
+        """Test that follow-ups resend the same system prompt and growing history."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_client.send_conversation = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        analysis = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO).json()
+        session_id = analysis["session_id"]
+        first = client.post(f"/api/v1/sessions/{session_id}/messages", json={"message": "Why?"})
+        second = client.post(f"/api/v1/sessions/{session_id}/messages", json={"message": "And?"})
+
+        assert first.status_code == 200
+        assert second.json()["turn"] == 2
+        assert second.json()["session_cost_usd"] == "0.02"
+        initial = mock_client.send_message.call_args.kwargs
+        follow_up = mock_client.send_conversation.call_args.kwargs
+        assert initial["cache_message"] is True
+        assert follow_up["system_prompt"] == initial["system_prompt"]
+        assert [m["content"] for m in follow_up["messages"]] == [
+            initial["user_message"],
+            "Mock CGT analysis response",
+            "Why?",
+            "Mock CGT analysis response",
+            "And?",
+        ]
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_unknown_session_returns_404(self, mock_get_instance, client):
+        """Test that an expired or unknown session is reported as not found."""
+        mock_get_instance.return_value = AsyncMock()
+
+        response = client.post("/api/v1/sessions/missing/messages", json={"message": "Why?"})
+
+        assert response.status_code == 404
+
+
+class TestClarificationResume:
+    """Tests for resuming structured analyses with clarification answers."""
+
+    QUESTION = {
+        "question_id": "q_test_2016_2018",
+        "property_address": "1 Test St",
+        "period": {"start_date": "2016-01-01", "end_date": "2018-01-01", "days": 731},
+        "question": "Where did you live during this period?",
+        "options": ["Main residence", "Renting elsewhere"],
+        "severity": "critical",
+    }
+
+    ANSWER = {
+        "question_id": "q_test_2016_2018",
+        "property_address": "1 Test St",
+        "issue_period": {"start_date": "2016-01-01", "end_date": "2018-01-01"},
+        "resolution_question": "Where did you live during this period?",
+        "user_response": "Renting elsewhere",
+    }
+
+    def make_response(self, mock_claude_response, questions):
+        """Structured response whose tool input carries the given questions."""
+        response = MagicMock(**{
+            attr: getattr(mock_claude_response, attr)
+            for attr in ("content", "usage", "cached", "model", "latency_ms", "stop_reason")
+        })
+        response.tool_input = {
+            **TestStructuredOutput.TOOL_INPUT,
+            "clarification_questions": questions,
+        }
+        return response
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_answers_continue_cached_conversation(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that answers resume the first-pass conversation instead of re-analysing."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            return_value=self.make_response(mock_claude_response, [self.QUESTION])
+        )
+        mock_client.send_conversation = AsyncMock(
+            return_value=self.make_response(mock_claude_response, [])
+        )
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=TestStructuredOutput.PORTFOLIO).json()
+        clarification_id = first["clarification_id"]
+        resumed = client.post(
+            f"/api/v1/clarifications/{clarification_id}/answers",
+            json={"answers": [self.ANSWER]},
+        )
+        repeated = client.post(
+            f"/api/v1/clarifications/{clarification_id}/answers",
+            json={"answers": [self.ANSWER]},
+        )
+
+        assert first["structured"]["needs_clarification"] is True
+        assert resumed.status_code == 200
+        assert resumed.json()["clarification_id"] is None
+        assert resumed.json()["properties"][0]["address"] == "1 Test St"
+        assert repeated.status_code == 404
+        assert mock_client.send_message.call_count == 1
+
+        call = mock_client.send_conversation.call_args.kwargs
+        assert call["tool_choice"] == CGT_ANALYSIS_TOOL_CHOICE
+        assert call["system_prompt"] == mock_client.send_message.call_args.kwargs["system_prompt"]
+        assert len(call["messages"]) == 3
+        answers = call["messages"][2]["content"]
+        assert "[q_test_2016_2018] 1 Test St (2016-01-01 to 2018-01-01)" in answers
+        assert "Answer: Renting elsewhere" in answers
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_frontend_retry_resumes_with_clarification_id(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that resending the portfolio with a clarification id resumes the session."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            return_value=self.make_response(mock_claude_response, [self.QUESTION])
+        )
+        mock_client.send_conversation = AsyncMock(
+            return_value=self.make_response(mock_claude_response, [])
+        )
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=TestStructuredOutput.PORTFOLIO).json()
+        retry = client.post(
+            "/api/v1/analyze-portfolio",
+            json={
+                **TestStructuredOutput.PORTFOLIO,
+                "clarification_id": first["clarification_id"],
+                "verification_responses": [self.ANSWER],
+            },
+        )
+
+        assert retry.status_code == 200
+        assert retry.json()["session_id"] == first["session_id"]
+        assert mock_client.send_message.call_count == 1
+        assert mock_client.send_conversation.call_count == 1
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_unknown_question_id_rejected(self, mock_get_instance, client, mock_claude_response):
+        """Test that answers to questions that were never asked are rejected."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            return_value=self.make_response(mock_claude_response, [self.QUESTION])
+        )
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=TestStructuredOutput.PORTFOLIO).json()
+        response = client.post(
+            f"/api/v1/clarifications/{first['clarification_id']}/answers",
+            json={"answers": [{**self.ANSWER, "question_id": "q_other"}]},
+        )
+
+        assert response.status_code == 422
+
+    def test_expired_clarification_falls_back_to_answers_in_prompt(self):
+        """Test that a full re-analysis still includes the user's answers."""
+        body = PortfolioAnalyzeRequest(
+            **TestStructuredOutput.PORTFOLIO,
+            clarification_id="expired",
+            verification_responses=[self.ANSWER],
+        )
+
+        message = build_portfolio_message(body, Settings())
+
+        assert "Answers to earlier clarification questions:" in message
+        assert "Answer: Renting elsewhere" in message
+
+
+class TestIncrementalAnalysis:
+    """Tests for diff-aware re-analysis of edited timelines."""
+
+    PORTFOLIO = {
+        "output_format": "structured",
+        "properties": [
+            {
+                "address": "1 Test St",
+                "property_history": [
+                    {"date": "2015-01-01", "event": "purchase", "price": 600000},
+                    {"date": "2024-01-01", "event": "sale", "price": 950000},
+                ],
+            },
+            {
+                "address": "2 Other Rd",
+                "property_history": [
+                    {"date": "2012-01-01", "event": "purchase", "price": 400000},
+                    {"date": "2023-06-01", "event": "sale", "price": 700000},
+                ],
+            },
+        ],
+    }
+
+    @staticmethod
+    def result(address, net_gain):
+        """Per-property tool input result."""
+        return {
+            "address": address,
+            "capital_proceeds": 1,
+            "cost_base": 1,
+            "gross_capital_gain": 1,
+            "exempt_fraction": 0,
+            "discount_percentage": 50,
+            "net_capital_gain": net_gain,
+        }
+
+    def make_response(self, mock_claude_response, results):
+        """Structured response carrying the given per-property results."""
+        response = MagicMock(**{
+            attr: getattr(mock_claude_response, attr)
+            for attr in ("content", "usage", "cached", "model", "latency_ms", "stop_reason")
+        })
+        response.tool_input = {"summary": "Updated.", "properties": results}
+        return response
+
+    def test_patch_applies_within_property_history(self):
+        """Test that patches edit event histories and report touched properties."""
+        document = {
+            "properties": [{"property_history": [{"date": "2015-01-01"}]}, {"property_history": []}]
+        }
+
+        patched, touched = apply_history_patch(
+            document,
+            [
+                {
+                    "op": "replace",
+                    "path": "/properties/0/property_history/0/date",
+                    "value": "2016-01-01",
+                },
+                {
+                    "op": "add",
+                    "path": "/properties/1/property_history/-",
+                    "value": {"date": "2020-01-01"},
+                },
+            ],
+        )
+
+        assert patched["properties"][0]["property_history"][0]["date"] == "2016-01-01"
+        assert patched["properties"][1]["property_history"] == [{"date": "2020-01-01"}]
+        assert document["properties"][0]["property_history"][0]["date"] == "2015-01-01"
+        assert touched == {0, 1}
+
+    def test_patch_rejects_paths_outside_history(self):
+        """Test that patches may not edit addresses or other request fields."""
+        document = {"properties": [{"address": "1 Test St", "property_history": []}]}
+
+        with pytest.raises(JsonPatchError):
+            apply_history_patch(
+                document, [{"op": "replace", "path": "/properties/0/address", "value": "x"}]
+            )
+        with pytest.raises(JsonPatchError):
+            apply_history_patch(
+                document,
+                [{"op": "test", "path": "/properties/0/property_history/0", "value": {}}],
+            )
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_only_edited_property_is_reanalysed(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that unchanged properties reuse stored results and only edits are re-prompted."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            side_effect=[
+                self.make_response(
+                    mock_claude_response,
+                    [self.result("1 Test St", 100), self.result("2 Other Rd", 200)],
+                ),
+                self.make_response(mock_claude_response, [self.result("1 Test St", 150)]),
+            ]
+        )
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO).json()
+        patched = client.post(
+            f"/api/v1/analyses/{first['analysis_id']}/patch",
+            json={"patch": [
+                {"op": "replace", "path": "/properties/0/property_history/1/price", "value": 990000}
+            ]},
+        )
+
+        assert patched.status_code == 200
+        data = patched.json()
+        assert data["reanalysed_properties"] == ["1 Test St"]
+        assert data["properties"][0]["property_history"][1]["price"] == "990000"
+        assert [p["net_capital_gain"] for p in data["structured"]["properties"]] == ["150", "200"]
+        assert data["analysis_id"] != first["analysis_id"]
+
+        message = mock_client.send_message.call_args.kwargs["user_message"]
+        changed_block, context_block = message.split("context only")
+        assert "990000" in changed_block and "2 Other Rd" not in changed_block
+        assert '"net_capital_gain":"200"' in context_block
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_patch_requests_whole_portfolio_summary(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that the patch call sends the previous summary and asks for a portfolio summary."""
+        first_response = self.make_response(
+            mock_claude_response,
+            [self.result("1 Test St", 100), self.result("2 Other Rd", 200)],
+        )
+        first_response.tool_input["summary"] = "Both properties sold; 2 Other Rd gain is largest."
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            side_effect=[
+                first_response,
+                self.make_response(mock_claude_response, [self.result("1 Test St", 150)]),
+            ]
+        )
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO).json()
+        patched = client.post(
+            f"/api/v1/analyses/{first['analysis_id']}/patch",
+            json={"patch": [
+                {"op": "replace", "path": "/properties/0/property_history/1/price", "value": 980000}
+            ]},
+        ).json()
+
+        message = mock_client.send_message.call_args.kwargs["user_message"]
+        assert "Both properties sold; 2 Other Rd gain is largest." in message
+        assert "summary for the whole portfolio" in message
+        assert patched["structured"]["summary"] == "Updated."
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_noop_patch_skips_claude(self, mock_get_instance, client, mock_claude_response):
+        """Test that a patch leaving inputs unchanged returns the stored analysis."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            return_value=self.make_response(mock_claude_response, [self.result("1 Test St", 100)])
+        )
+        mock_client.model = "claude-sonnet-4-20250514"
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO).json()
+        response = client.post(
+            f"/api/v1/analyses/{first['analysis_id']}/patch",
+            json={"patch": [{
+                "op": "test", "path": "/properties/1/property_history/0/event", "value": "purchase"
+            }]},
+        )
+
+        assert response.status_code == 200
+        assert response.json()["analysis_id"] == first["analysis_id"]
+        assert response.json()["output_tokens"] == 0
+        assert mock_client.send_message.call_count == 1
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_unknown_analysis_returns_404(self, mock_get_instance, client):
+        """Test that patching an expired analysis is reported as not found."""
+        mock_get_instance.return_value = AsyncMock()
+
+        response = client.post(
+            "/api/v1/analyses/missing/patch",
+            json={"patch": [{"op": "remove", "path": "/properties/0/property_history/0"}]},
+        )
+
+        assert response.status_code == 404
+
+
+class TestDecomposedAnalysis:
+    """Tests for per-property (map-reduce) portfolio analysis."""
+
+    @staticmethod
+    def portfolio(lived_in=(), street="Decomposed St"):
+        """Structured three-property portfolio; indexes in lived_in get move_in events."""
+        properties = []
+        for index in range(3):
+            history = [{"date": f"201{index}-01-01", "event": "purchase", "price": 500000 + index}]
+            if index in lived_in:
+                history.append({"date": f"201{index}-02-01", "event": "move_in"})
+            history.append({"date": "2024-01-01", "event": "sale", "price": 900000})
+            properties.append({"address": f"{index} {street}", "property_history": history})
+        return {"output_format": "structured", "properties": properties}
+
+    @staticmethod
+    def fake_send(mock_claude_response, tracker):
+        """send_message stand-in answering per property and recording concurrency."""
+
+        async def send(user_message, **kwargs):
+            tracker["active"] += 1
+            tracker["peak"] = max(tracker["peak"], tracker["active"])
+            await asyncio.sleep(0.01)
+            tracker["active"] -= 1
+            synthesis = "calculated separately" in user_message
+            addresses = [
+                f"{i} {street}" for i in range(3) for street in ("Decomposed St", "Residence Rd")
+                if f"{i} {street}" in user_message
+            ]
+            response = MagicMock(**{
+                attr: getattr(mock_claude_response, attr)
+                for attr in ("content", "usage", "cached", "model", "latency_ms", "stop_reason")
+            })
+            response.tool_input = {
+                "summary": "Synthesised." if synthesis else f"{addresses[0]} analysed.",
+                "properties": [
+                    TestIncrementalAnalysis.result(address, 50 if synthesis else 100)
+                    for address in addresses
+                ],
+            }
+            return response
+
+        return send
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_properties_analysed_concurrently_and_cached(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that independent properties run in parallel and reuse cached results."""
+        tracker = {"active": 0, "peak": 0}
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            side_effect=self.fake_send(mock_claude_response, tracker)
+        )
+        mock_client.model = "claude-sonnet-4-20250514"
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=self.portfolio()).json()
+        get_response_cache.cache_clear()  # exercise the per-property cache, not whole responses
+        repeat = client.post("/api/v1/analyze-portfolio", json=self.portfolio()).json()
+
+        assert first["analysis_mode"] == "decomposed"
+        assert tracker["peak"] == 3
+        assert mock_client.send_message.call_count == 3  # no synthesis, repeat fully cached
+        assert first["structured"]["total_net_capital_gain"] == "300"
+        assert first["input_tokens"] == 3000
+        assert repeat["input_tokens"] == 0 and repeat["cached"] is True
+        assert repeat["structured"]["properties"] == first["structured"]["properties"]
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_synthesis_resolves_competing_residences(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that a synthesis call reconciles properties that were both lived in."""
+        tracker = {"active": 0, "peak": 0}
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            side_effect=self.fake_send(mock_claude_response, tracker)
+        )
+        mock_client.model = "claude-sonnet-4-20250514"
+        mock_get_instance.return_value = mock_client
+
+        response = client.post(
+            "/api/v1/analyze-portfolio", json=self.portfolio(lived_in=(0, 2), street="Residence Rd")
+        ).json()
+
+        assert mock_client.send_message.call_count == 4
+        synthesis_message = mock_client.send_message.call_args.kwargs["user_message"]
+        assert "0 Residence Rd: purchase 2010-01-01, move_in 2010-02-01" in synthesis_message
+        assert response["structured"]["summary"] == "Synthesised."
+        assert response["structured"]["total_net_capital_gain"] == "150"
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_failed_property_cancels_the_others(self, mock_get_instance, client):
+        """Test that one failing property call cancels the calls still in flight."""
+        cancelled = 0
+
+        async def send(user_message, **kwargs):
+            nonlocal cancelled
+            if "0 Cancelled St" in user_message:
+                raise RuntimeError("upstream failed")
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled += 1
+                raise
+
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(side_effect=send)
+        mock_get_instance.return_value = mock_client
+
+        response = client.post(
+            "/api/v1/analyze-portfolio", json=self.portfolio(street="Cancelled St")
+        )
+
+        assert response.status_code == 500
+        assert cancelled == 2
+
+    def test_decompose_requires_structured_output(self, client):
+        """Test that decompose=true with markdown output is rejected rather than ignored."""
+        response = client.post(
+            "/api/v1/analyze-portfolio",
+            json={**self.portfolio(), "output_format": "markdown", "decompose": True},
+        )
+
+        assert response.status_code == 422
+
+    def test_small_or_markdown_portfolios_not_decomposed(self):
+        """Test that decomposition is limited to multi-property structured requests by default."""
+        settings = Settings()
+
+        assert should_decompose(PortfolioAnalyzeRequest(**self.portfolio()), settings)
+        assert not should_decompose(
+            PortfolioAnalyzeRequest(**{**self.portfolio(), "output_format": "markdown"}), settings
+        )
+        assert not should_decompose(
+            PortfolioAnalyzeRequest(**{**self.portfolio(), "decompose": False}), settings
+        )
+
+
+class TestResponseCache:
+    """Tests for pre-serialised responses to repeated identical requests."""
+
+    PORTFOLIO = {
+        "properties": [
+            {
+                "address": "37 Cache Lane",
+                "property_history": [
+                    {"date": "2012-03-01", "event": "purchase", "price": 480000},
+                    {"date": "2023-11-01", "event": "sale", "price": 910000},
+                ],
+            }
+        ],
+    }
+
+    def test_dumps_encodes_decimal_as_string(self):
+        """Test that Decimals are encoded as strings, matching pydantic's JSON mode."""
+        assert dumps({"cost": Decimal("0.0125"), "n": 1}) == b'{"cost":"0.0125","n":1}'
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_repeat_request_served_from_cache(
+        self, mock_get_instance, client, mock_claude_response
+    ):
+        """Test that an identical request is answered from cache with its own session."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_client.send_conversation = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+        second = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+
+        assert mock_client.send_message.call_count == 1
+        assert second.headers["X-Cache"] == "HIT"
+        assert second.headers["content-type"] == "application/json"
+        first_body, second_body = first.json(), second.json()
+        assert second_body["session_id"] != first_body["session_id"]
+        per_hit = {"session_id", "input_tokens", "output_tokens", "estimated_cost_usd", "cached"}
+        assert {k: v for k, v in second_body.items() if k not in per_hit} == {
+            k: v for k, v in first_body.items() if k not in per_hit
+        }
+        # No API call was made for the hit, so it reports no spend
+        assert first_body["input_tokens"] > 0
+        assert (second_body["input_tokens"], second_body["output_tokens"]) == (0, 0)
+        assert second_body["estimated_cost_usd"] == "0"
+        assert second_body["cached"] is True
+
+        # The forked session carries the cached conversation and is independent
+        follow_up = client.post(
+            f"/api/v1/sessions/{second_body['session_id']}/messages", json={"message": "Why?"}
+        )
+        assert follow_up.status_code == 200
+        assert follow_up.json()["turn"] == 1
+        messages = mock_client.send_conversation.call_args.kwargs["messages"]
+        assert messages[0]["content"] == mock_client.send_message.call_args.kwargs["user_message"]
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_hit_gets_its_own_analysis_id(self, mock_get_instance, client, mock_claude_response):
+        """Test that each cache hit gets a fresh, patchable analysis_id."""
+        portfolio = {**TestIncrementalAnalysis.PORTFOLIO, "user_query": "Cache hit analysis_id"}
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(
+            return_value=TestIncrementalAnalysis().make_response(
+                mock_claude_response,
+                [
+                    TestIncrementalAnalysis.result("1 Test St", 100),
+                    TestIncrementalAnalysis.result("2 Other Rd", 200),
+                ],
+            )
+        )
+        mock_get_instance.return_value = mock_client
+
+        first = client.post("/api/v1/analyze-portfolio", json=portfolio).json()
+        second = client.post("/api/v1/analyze-portfolio", json=portfolio).json()
+
+        assert mock_client.send_message.call_count == 1
+        assert first["analysis_id"] and second["analysis_id"]
+        assert second["analysis_id"] != first["analysis_id"]
+        stored = get_analysis_store().get(second["analysis_id"])
+        assert stored.analysis.model_dump() == get_analysis_store().get(
+            first["analysis_id"]
+        ).analysis.model_dump()
+
+    def test_cache_key_covers_output_budget(self):
+        """Test that changing the output budget settings changes the cache key."""
+        request = PortfolioAnalyzeRequest(**self.PORTFOLIO)
+
+        assert analysis_cache_key(request, Settings()) != analysis_cache_key(
+            request, Settings(max_tokens_per_property=3000)
+        )
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_truncated_response_not_cached(self, mock_get_instance, client, mock_claude_response):
+        """Test that answers cut off at max_tokens are always regenerated."""
+        mock_claude_response.stop_reason = "max_tokens"
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+        second = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+
+        assert mock_client.send_message.call_count == 2
+        assert "X-Cache" not in second.headers
+
+
+class TestResponseShape:
+    """Tests for slim responses and response compression."""
+
+    PORTFOLIO = {
+        "properties": [
+            {
+                "address": "12 Slim Street",
+                "property_history": [
+                    {"date": "2010-05-01", "event": "purchase", "price": 400000},
+                    {"date": "2022-09-01", "event": "sale", "price": 820000},
+                ],
+            }
+        ],
+    }
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_slim_response_omits_properties(self, mock_get_instance, client, mock_claude_response):
+        """Test that shape=slim drops the echo but keeps the analysis, usage and request hash."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        full = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO).json()
+        slim = client.post("/api/v1/analyze-portfolio?shape=slim", json=self.PORTFOLIO)
+
+        assert slim.headers["X-Cache"] == "HIT"
+        slim_body = slim.json()
+        assert "properties" not in slim_body
+        assert slim_body["request_hash"] == full["request_hash"]
+        assert len(full["request_hash"]) == 64
+        assert slim_body["analysis"] == full["analysis"]
+        assert slim_body["input_tokens"] == 0 and slim_body["cached"] is True
+        assert slim_body["session_id"]
+
+        get_response_cache.cache_clear()
+        uncached = client.post("/api/v1/analyze-portfolio?shape=slim", json=self.PORTFOLIO).json()
+        assert "properties" not in uncached
+        assert uncached["request_hash"] == full["request_hash"]
+
+    def test_unknown_shape_rejected(self, client):
+        """Test that shape only accepts full or slim."""
+        response = client.post("/api/v1/analyze-portfolio?shape=tiny", json=self.PORTFOLIO)
+
+        assert response.status_code == 422
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_large_body_compressed(self, mock_get_instance, client, mock_claude_response):
+        """Test that large analyses are gzip-encoded for clients that accept it."""
+        mock_claude_response.content = "Detailed working for each ownership period. " * 200
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        response = client.post(
+            "/api/v1/analyze-portfolio",
+            json=self.PORTFOLIO,
+            headers={"Accept-Encoding": "gzip"},
+        )
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert int(response.headers["content-length"]) < len(mock_claude_response.content) // 4
+        assert response.json()["analysis"] == mock_claude_response.content
+        assert "X-Request-ID" in response.headers
+
+    def test_small_body_not_compressed(self, client):
+        """Test that bodies under the size threshold are sent as-is."""
+        response = client.get("/health", headers={"Accept-Encoding": "gzip, br"})
+
+        assert "content-encoding" not in response.headers
+
+    def test_brotli_preferred_when_available(self):
+        """Test that Brotli is used when installed and accepted, gzip otherwise."""
+        pytest.importorskip("brotli")
+        big = FastAPI()
+        big.add_middleware(CompressionMiddleware, minimum_size=100)
+        big.get("/big")(lambda: {"text": "x" * 5000})
+        big_client = TestClient(big)
+
+        def get(accept_encoding):
+            return big_client.get("/big", headers={"Accept-Encoding": accept_encoding})
+
+        assert get("gzip, br").headers["content-encoding"] == "br"
+        assert get("gzip, br;q=0").headers["content-encoding"] == "gzip"
+        assert get("identity").json() == {"text": "x" * 5000}
+
+    def test_accepts_encoding(self):
+        """Test Accept-Encoding parsing, including q=0 refusals."""
+        assert accepts_encoding("gzip, deflate, br", "br")
+        assert accepts_encoding("BR;q=0.5", "br")
+        assert not accepts_encoding("br;q=0", "br")
+        assert not accepts_encoding("gzip", "br")
+
+
+class TestPooledTransport:
+    """Tests for the instrumented Anthropic API transport."""
+
+    @staticmethod
+    async def start_server(delay: float):
+        """Start a local keep-alive HTTP/1.1 server that answers every request after a delay."""
+
+        async def handle(reader, writer):
+            while await reader.readuntil(b"\r\n\r\n"):
+                await asyncio.sleep(delay)
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+                await writer.drain()
+
+        async def handle_safely(reader, writer):
+            try:
+                await handle(reader, writer)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+        return await asyncio.start_server(handle_safely, "127.0.0.1", 0)
+
+    @pytest.mark.asyncio
+    async def test_pool_limits_and_metrics(self):
+        """Test that requests beyond the pool size wait and reuse the same connections."""
+        server = await self.start_server(delay=0.05)
+        port = server.sockets[0].getsockname()[1]
+        transport = PooledTransport(
+            max_connections=2, max_keepalive_connections=2, keepalive_expiry=30, http2=False
+        )
+        try:
+            async with http.AsyncClient(transport=transport) as session:
+                responses = await asyncio.gather(
+                    *(session.get(f"http://127.0.0.1:{port}/") for _ in range(6))
+                )
+                stats = transport.to_dict()
+        finally:
+            server.close()
+
+        assert [r.text for r in responses] == ["ok"] * 6
+        assert stats["connections_opened"] == 2
+        assert stats["connections"] == 2 and stats["idle_connections"] == 2
+        assert stats["requests"] == 6 and stats["peak_in_flight"] == 6
+        assert stats["in_flight"] == 0 and stats["waiting"] == 0
+        assert stats["peak_waiting"] >= 4
+        assert stats["pool_wait_ms"]["count"] == 6
+        assert stats["pool_wait_ms"]["p99"] >= 25
+        assert stats["connect_ms"]["count"] == 2
+        assert stats["connection_reuse_ratio"] == round(1 - 2 / 6, 4)
+
+    def test_client_uses_pool_settings(self):
+        """Test that ClaudeClient builds its transport from the connection pool settings."""
+        instance = ClaudeClient(
+            Settings(
+                anthropic_api_key="test-key",
+                http_pool_maxsize=40,
+                http_keepalive_connections=10,
+                http2_enabled=False,
+            )
+        )
+
+        pool = instance.get_metrics()["http_pool"]
+        assert pool["max_connections"] == 40
+        assert pool["http2"] is False
+        assert instance.transport._pool._max_keepalive_connections == 10
+        assert instance.client._client._transport is instance.transport
+
+
+class TestWarmup:
+    """Tests for startup warm-up against the local stand-in upstream."""
+
+    @pytest.mark.asyncio
+    async def test_warm_up_opens_connections_and_primes_cache(self):
+        """Test that warm-up opens pooled connections and writes both prompt prefixes."""
+        upstream = create_stub_app()
+        async with serve(upstream) as base_url:
+            settings = Settings(
+                anthropic_api_key="test-key",
+                anthropic_base_url=base_url,
+                http2_enabled=False,
+                warmup_connections=3,
+            )
+            instance = ClaudeClient(settings)
+            status = WarmupStatus()
+            try:
+                await warm_up(instance, settings, status)
+                repeat = await instance.prime_prompt_cache(*warmup_prompts(settings)[0])
+                pool = instance.get_metrics()["http_pool"]
+            finally:
+                await instance.close()
+
+        assert status.state == "ready" and status.ready
+        assert status.connections == 3
+        assert status.prompts_primed == 2
+        assert status.cache_write_tokens > 0 and status.cache_read_tokens == 0
+        assert repeat.cache_read_input_tokens > 0
+        assert pool["connections_opened"] == 3  # priming reused the warm connections
+        structured = [r for r in upstream.state.requests if r.get("tools")]
+        assert len(structured) == 1
+        assert structured[0]["tools"][0]["name"] == CGT_ANALYSIS_TOOL["name"]
+        assert structured[0]["max_tokens"] == 1
+
+    @pytest.mark.asyncio
+    async def test_http2_warms_a_single_connection(self):
+        """Test that HTTP/2 warm-up sends one HEAD, since requests share one connection."""
+        async with serve(create_stub_app()) as base_url:
+            instance = ClaudeClient(
+                Settings(anthropic_api_key="test-key", anthropic_base_url=base_url)
+            )
+            instance.transport.http2 = True  # As negotiated when h2 is installed
+            try:
+                connections = await instance.open_connections(4)
+                pool = instance.get_metrics()["http_pool"]
+            finally:
+                await instance.close()
+
+        assert connections == 1
+        assert pool["requests"] == 1
+
+    @pytest.mark.asyncio
+    async def test_unreachable_upstream_fails_open(self):
+        """Test that a failed warm-up is recorded but still reports ready."""
+        settings = Settings(
+            anthropic_api_key="test-key",
+            anthropic_base_url="http://127.0.0.1:9",
+            warmup_timeout_seconds=5,
+        )
+        instance = ClaudeClient(settings)
+        status = WarmupStatus()
+        try:
+            await warm_up(instance, settings, status)
+        finally:
+            await instance.close()
+
+        assert status.state == "failed" and status.ready
+        assert status.error
+
+    def test_readiness_endpoint(self, client):
+        """Test that /health/ready answers 503 while warming and 200 once warm."""
+        with patch("app.main.warmup_status", WarmupStatus(state="warming")):
+            warming = client.get("/health/ready")
+        with patch("app.main.warmup_status", WarmupStatus(state="ready", connections=4)):
+            ready = client.get("/health/ready")
+
+        assert warming.status_code == 503
+        assert warming.json()["status"] == "warming"
+        assert ready.status_code == 200
+        assert ready.json()["warmup"]["connections"] == 4
+
+
+class TestCacheKeepAlive:
+    """Tests for the prompt cache keep-alive scheduler."""
+
+    MONDAY_10AM = datetime(2026, 10, 19, 10, 0, tzinfo=ZoneInfo("Australia/Sydney"))
+    SATURDAY_10AM = datetime(2026, 10, 24, 10, 0, tzinfo=ZoneInfo("Australia/Sydney"))
+
+    def test_business_hours(self):
+        """Test that refreshes only run on weekdays within the configured hours."""
+        tracker = PromptCacheKeepAlive(pricing={}, now=lambda tz: self.MONDAY_10AM)
+        assert tracker.in_business_hours()
+        tracker.now = lambda tz: self.MONDAY_10AM.replace(hour=18)
+        assert not tracker.in_business_hours()
+        tracker.now = lambda tz: self.SATURDAY_10AM
+        assert not tracker.in_business_hours()
+        tracker.weekdays_only = False
+        assert tracker.in_business_hours()
+
+    @pytest.mark.asyncio
+    async def test_refreshes_before_lapse_and_reports_savings(self):
+        """Test that a prefix is refreshed in the margin and later hits count as writes avoided."""
+        upstream = create_stub_app()
+        async with serve(upstream) as base_url:
+            settings = Settings(
+                anthropic_api_key="test-key", anthropic_base_url=base_url, http2_enabled=False
+            )
+            instance = ClaudeClient(settings)
+            now = [0.0]
+            keepalive = instance.cache_keepalive
+            keepalive.clock = lambda: now[0]
+            keepalive.now = lambda tz: self.MONDAY_10AM
+            refresh = functools.partial(instance.prime_prompt_cache, source="keepalive")
+            system, tools = warmup_prompts(settings)[0]
+            try:
+                instance.start_cache_keepalive([(system, tools)])
+                await instance.prime_prompt_cache(system, tools)  # startup warm-up writes
+
+                now[0] = 200.0
+                assert await keepalive.refresh_due(refresh) == 0  # 100s left, outside the margin
+                now[0] = 280.0
+                assert await keepalive.refresh_due(refresh) == 1
+
+                keepalive.now = lambda tz: self.SATURDAY_10AM
+                now[0] = 900.0
+                assert await keepalive.refresh_due(refresh) == 0
+
+                now[0] = 300.0
+                await instance.send_message("Quick question", system)
+                stats = instance.get_metrics()["cache_keepalive"]
+            finally:
+                await instance.close()
+
+        assert stats["running"] and not keepalive.to_dict()["running"]
+        assert stats["refreshes"] == 1
+        assert stats["spend"]["warmup"]["cache_write_tokens"] > 0
+        assert stats["spend"]["keepalive"]["cache_read_tokens"] > 0
+        assert stats["spend"]["keepalive"]["cache_write_tokens"] == 0
+        assert stats["spend"]["traffic"]["cache_read_tokens"] > 0
+        assert stats["writes_avoided"] == 1
+        assert Decimal(stats["estimated_savings_usd"]) > 0
+        assert Decimal(stats["net_savings_usd"]) > 0
+        assert Decimal(stats["spend"]["keepalive"]["cache_read_cost_usd"]) < Decimal(
+            stats["spend"]["warmup"]["cache_write_cost_usd"]
+        )
+
+
 class TestPropertyTimelineValidation:
     """Tests for PropertyTimeline model validation."""
 
@@ -271,17 +1690,250 @@ class TestConcurrencyLimiter:
                         async with limiter.acquire(timeout=0.01):
                             pass
 
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_queue(self, limiter):
+        """Test that a cancelled queued acquire no longer counts as waiting."""
+        async def wait_for_slot():
+            async with limiter.acquire(timeout=10.0):
+                pass
+
+        async with limiter.acquire(), limiter.acquire(), limiter.acquire():
+            waiter = asyncio.create_task(wait_for_slot())
+            await asyncio.sleep(0.01)
+            assert limiter.waiting_count == 1
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+
+        assert limiter.waiting_count == 0
+
+    @pytest.mark.asyncio
+    async def test_rejects_early_when_queue_cannot_drain(self):
+        """Test that an arrival is shed at once when the queue ahead would outlast its timeout."""
+        now = [0.0]
+        limiter = ConcurrencyLimiter(max_concurrent=1, target_delay=0.5, clock=lambda: now[0])
+        async with limiter.acquire():
+            now[0] += 4.0  # Slots are held for 4s
+        async with limiter.acquire():
+            with pytest.raises(LoadShed) as exc_info:
+                async with limiter.acquire(timeout=2.0):
+                    pass
+
+        assert exc_info.value.retry_after == pytest.approx(4.0)
+        assert limiter.to_dict()["shed_requests"] == 1
+        assert limiter.waiting_count == 0
+
+    @pytest.mark.asyncio
+    async def test_sustained_queue_delay_shrinks_waits(self):
+        """Test that delay above target for a whole interval caps waits at the target."""
+        now = [0.0]
+        limiter = ConcurrencyLimiter(
+            max_concurrent=1, target_delay=0.5, interval=1.0, clock=lambda: now[0]
+        )
+        async with limiter.acquire():
+            for delay in (0.6, 0.7, 0.8):
+                now[0] += 1.0
+                limiter._record_queue_delay(delay)
+            assert limiter.overloaded
+
+            start = asyncio.get_running_loop().time()
+            with pytest.raises(LoadShed):
+                async with limiter.acquire(timeout=30.0):
+                    pass
+            assert asyncio.get_running_loop().time() - start < 5.0
+
+        limiter._record_queue_delay(0.1)
+        assert not limiter.overloaded
+
+    @pytest.mark.asyncio
+    async def test_to_dict_reports_queue_delay(self, limiter):
+        """Test that queue delay percentiles and queue state are reported."""
+        async with limiter.acquire():
+            pass
+
+        stats = limiter.to_dict()
+
+        assert stats["total_processed"] == 1
+        assert stats["waiting_requests"] == 0
+        assert stats["queue_delay_ms"]["count"] == 1
+        assert "p99" in stats["queue_delay_ms"]
+
+
+class TestDeadlinePropagation:
+    """Tests for the request deadline shared by queueing, retries and HTTP timeouts."""
+
+    def test_scope_keeps_earlier_outer_deadline(self):
+        """Test that a nested scope cannot extend an enclosing deadline."""
+        with deadline_scope(1.0) as outer:
+            with deadline_scope(60.0) as inner:
+                assert inner is outer
+            with deadline_scope(0.5) as inner:
+                assert inner.expires_at < outer.expires_at
+
+    @pytest.mark.asyncio
+    async def test_slot_wait_capped_by_deadline(self):
+        """Test that a slot wait ends at the deadline rather than the limiter timeout."""
+        limiter = ConcurrencyLimiter(max_concurrent=1)
+        async with limiter.acquire():
+            with deadline_scope(0.05):
+                with pytest.raises(DeadlineExceeded):
+                    async with limiter.acquire(timeout=30.0):
+                        pass
+
+        stats = limiter.to_dict()
+        assert stats["deadline_exceeded"] == 1
+        assert stats["shed_requests"] == 0
+
+    @pytest.mark.asyncio
+    async def test_retry_skipped_when_backoff_outlasts_deadline(self):
+        """Test that a retry that cannot finish before the deadline is not started."""
+        calls = []
+
+        @with_retry(max_retries=3, base_delay=1.0, jitter=False)
+        async def flaky():
+            calls.append(1)
+            raise ValueError("upstream error")
+
+        with deadline_scope(0.5):
+            with pytest.raises(ValueError):
+                await flaky()
+
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_http_timeout_capped_by_deadline(self, claude_client):
+        """Test that each attempt's HTTP timeout is capped at the time left."""
+        claude_client.client.messages.create.return_value = make_api_message("Done.")
+
+        with deadline_scope(20.0):
+            await claude_client.send_message("Analyze", "System")
+        timeout = claude_client.client.messages.create.call_args.kwargs["timeout"]
+        assert timeout.read <= 20.0
+        assert timeout.connect == claude_client.timeout.connect
+
+        await claude_client.send_message("Analyze", "System")
+        timeout = claude_client.client.messages.create.call_args.kwargs["timeout"]
+        assert timeout is claude_client.timeout
+
+    @pytest.mark.asyncio
+    async def test_unset_http_timeout_capped_by_deadline(self, claude_client):
+        """Test that an HTTP timeout of None (no limit) is capped at the time left."""
+        claude_client.client.messages.create.return_value = make_api_message("Done.")
+        claude_client.timeout = anthropic.Timeout(connect=10.0, read=None, write=30.0, pool=10.0)
+
+        with deadline_scope(20.0):
+            await claude_client.send_message("Analyze", "System")
+        timeout = claude_client.client.messages.create.call_args.kwargs["timeout"]
+        assert timeout.read is not None and timeout.read <= 20.0
+
+    @pytest.mark.asyncio
+    async def test_call_skipped_too_close_to_deadline(self, claude_client):
+        """Test that no call is sent when too little time is left, without tripping the breaker."""
+        with deadline_scope(1.0):
+            with pytest.raises(DeadlineExceeded):
+                await claude_client.send_message("Analyze", "System")
+
+        claude_client.client.messages.create.assert_not_called()
+        assert claude_client.circuit_breaker.to_dict()["window_failures"] == 0
+
+
+class TestRetryBudget:
+    """Tests for the retry budget shared across calls."""
+
+    def test_retries_limited_to_share_of_requests(self):
+        """Test that retries are refused once the deposited budget is spent."""
+        budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_tokens=2.0, clock=lambda: 0.0)
+
+        assert budget.try_spend()
+        assert budget.try_spend()
+        assert not budget.try_spend()
+
+        budget.record_request()
+        budget.record_request()
+        assert budget.try_spend()
+        assert budget.to_dict()["exhausted"] == 1
+        assert budget.to_dict()["retries"] == 3
+
+    def test_budget_refills_over_time(self):
+        """Test that min_per_second tokens accrue up to max_tokens."""
+        now = [0.0]
+        budget = RetryBudget(ratio=0.0, min_per_second=1.0, max_tokens=3.0, clock=lambda: now[0])
+        for _ in range(3):
+            budget.try_spend()
+        assert budget.balance == 0.0
+
+        now[0] += 100.0
+        assert budget.balance == 3.0
+
+    def test_failing_stream_retries_stay_near_ratio(self):
+        """Test that an all-failing stream at 2 req/s retries at about ratio per request."""
+        now = [0.0]
+        settings = Settings()
+        budget = RetryBudget(
+            ratio=settings.retry_budget_ratio,
+            min_per_second=settings.retry_budget_min_per_second,
+            max_tokens=settings.retry_budget_max_tokens,
+            clock=lambda: now[0],
+        )
+        for _ in range(1200):  # 10 minutes at 2 req/s, every attempt failing
+            now[0] += 0.5
+            budget.record_request()
+            for _ in range(settings.max_retries):
+                if not budget.try_spend():
+                    break
+
+        retry_rate = budget.retries / budget.requests
+        assert retry_rate == pytest.approx(
+            settings.retry_budget_ratio + settings.retry_budget_min_per_second / 2, abs=0.01
+        )
+        assert retry_rate < 1.5 * settings.retry_budget_ratio
+
+    @pytest.mark.asyncio
+    async def test_client_retries_follow_settings(self):
+        """Test that max_retries and retry delays come from the settings."""
+        instance = ClaudeClient(
+            Settings(anthropic_api_key="test-key", max_retries=1, retry_base_delay=0.0)
+        )
+        instance.client.messages.create = AsyncMock(side_effect=asyncio.TimeoutError())
+
+        with pytest.raises(asyncio.TimeoutError):
+            await instance.send_message("Analyze", "System")
+
+        assert instance.client.messages.create.call_count == 2
+        assert instance.get_metrics()["retry_budget"]["retries"] == 1
+
+    @pytest.mark.asyncio
+    async def test_exhausted_budget_fails_fast(self):
+        """Test that no retry is made once the budget is exhausted, and that it is reported."""
+        instance = ClaudeClient(
+            Settings(
+                anthropic_api_key="test-key",
+                retry_base_delay=0.0,
+                retry_budget_ratio=0.0,
+                retry_budget_min_per_second=0.0,
+                retry_budget_max_tokens=0.0,
+            )
+        )
+        instance.client.messages.create = AsyncMock(side_effect=asyncio.TimeoutError())
+
+        with pytest.raises(asyncio.TimeoutError):
+            await instance.send_message("Analyze", "System")
+
+        assert instance.client.messages.create.call_count == 1
+        assert instance.get_metrics()["retry_budget"]["exhausted"] == 1
+
 
 class TestCircuitBreaker:
     """Tests for the circuit breaker."""
 
     @pytest.fixture
     def breaker(self):
-        """Create a circuit breaker with low threshold for testing."""
+        """Create a circuit breaker with a small minimum volume for testing."""
         return CircuitBreaker(
-            failure_threshold=2,
+            window_seconds=10.0,
+            failure_rate_threshold=0.5,
+            minimum_requests=4,
             recovery_timeout=0.1,
-            half_open_max_calls=1,
         )
 
     @pytest.mark.asyncio
@@ -291,40 +1943,342 @@ class TestCircuitBreaker:
         assert breaker.state == CircuitState.CLOSED
 
     @pytest.mark.asyncio
-    async def test_circuit_opens_after_failures(self, breaker):
-        """Test that circuit opens after threshold failures."""
+    async def test_circuit_opens_on_failure_rate(self, breaker):
+        """Test that circuit opens once the failure rate crosses the threshold at volume."""
         from app.utils.async_helpers import CircuitState
 
-        await breaker.record_failure()
-        assert breaker.state == CircuitState.CLOSED
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_failure()
+        assert breaker.state == CircuitState.CLOSED  # Below the minimum volume
 
-        await breaker.record_failure()
+        breaker.record_failure()
         assert breaker.state == CircuitState.OPEN
+        assert breaker.to_dict()["failure_rate"] == 0.75
+
+    @pytest.mark.asyncio
+    async def test_low_failure_rate_stays_closed(self, breaker):
+        """Test that occasional failures at volume do not open the circuit."""
+        from app.utils.async_helpers import CircuitState
+
+        for _ in range(10):
+            breaker.record_success()
+            breaker.record_success()
+            breaker.record_failure()
+
+        assert breaker.state == CircuitState.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_old_failures_leave_the_window(self):
+        """Test that failures older than the window no longer count."""
+        now = [0.0]
+        breaker = CircuitBreaker(window_seconds=10.0, minimum_requests=4, clock=lambda: now[0])
+        for _ in range(3):
+            breaker.record_failure()
+
+        now[0] += 11.0
+        breaker.record_failure()
+
+        assert breaker.to_dict()["window_calls"] == 1
+        assert breaker.can_execute()
 
     @pytest.mark.asyncio
     async def test_circuit_rejects_when_open(self, breaker):
         """Test that circuit rejects requests when open."""
-        # Open the circuit
-        await breaker.record_failure()
-        await breaker.record_failure()
+        for _ in range(4):
+            breaker.record_failure()
 
-        assert not await breaker.can_execute()
+        assert not breaker.can_execute()
 
     @pytest.mark.asyncio
-    async def test_circuit_half_opens_after_timeout(self, breaker):
-        """Test that circuit enters half-open state after recovery timeout."""
+    async def test_half_open_admits_single_probe(self, breaker):
+        """Test that after the recovery timeout exactly one call is let through."""
         from app.utils.async_helpers import CircuitState
 
-        # Open the circuit
-        await breaker.record_failure()
-        await breaker.record_failure()
-
-        # Wait for recovery timeout
+        for _ in range(4):
+            breaker.record_failure()
         await asyncio.sleep(0.15)
 
-        # Should be able to execute (half-open)
-        assert await breaker.can_execute()
+        assert breaker.can_execute()
         assert breaker.state == CircuitState.HALF_OPEN
+        assert not breaker.can_execute()
+
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_failed_probe_reopens(self, breaker):
+        """Test that a failing half-open probe opens the circuit again."""
+        from app.utils.async_helpers import CircuitState
+
+        for _ in range(4):
+            breaker.record_failure()
+        await asyncio.sleep(0.15)
+        assert breaker.can_execute()
+
+        breaker.record_failure()
+
+        assert breaker.state == CircuitState.OPEN
+        assert breaker.times_opened == 2
+
+    @pytest.mark.asyncio
+    async def test_probe_callable_replaces_real_calls(self):
+        """Test that with a probe callable, user calls are rejected while it decides."""
+        from app.utils.async_helpers import CircuitState
+
+        probe = AsyncMock()
+        breaker = CircuitBreaker(minimum_requests=1, recovery_timeout=0.0, probe=probe)
+        breaker.record_failure()
+
+        assert not breaker.can_execute()
+        await breaker._probe_task
+
+        probe.assert_awaited_once()
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.can_execute()
+
+    @pytest.mark.asyncio
+    async def test_errors_are_classified(self, claude_client):
+        """Test that 4xx errors are ignored, 429 throttles and 5xx trips the circuit."""
+        import anthropic
+
+        def status_error(cls, code, headers=None):
+            request = http.Request("POST", "https://api.anthropic.com/v1/messages")
+            response = http.Response(code, headers=headers, request=request)
+            return cls("error", response=response, body=None)
+
+        breaker = CircuitBreaker(
+            minimum_requests=2, classify=claude_client.circuit_breaker.classify
+        )
+        breaker.record_failure(status_error(anthropic.BadRequestError, 400))
+        breaker.record_failure(status_error(anthropic.BadRequestError, 400))
+        assert breaker.to_dict()["ignored"] == 2
+        assert breaker.can_execute()
+
+        breaker.record_failure(
+            status_error(anthropic.RateLimitError, 429, {"retry-after": "7"}), retry_after=7.0
+        )
+        assert breaker.to_dict()["throttled"] == 1
+        assert 6.0 < breaker.throttle_remaining() <= 7.0
+        assert breaker.can_execute()
+
+        breaker.record_failure(status_error(anthropic.InternalServerError, 500))
+        breaker.record_failure(status_error(anthropic.InternalServerError, 500))
+        assert not breaker.can_execute()
+
+
+class TestDegradedMode:
+    """Tests for answering while the circuit breaker is open."""
+
+    PORTFOLIO = {
+        "properties": [
+            {
+                "address": "8 Outage Street",
+                "property_history": [
+                    {
+                        "date": "2018-11-01",
+                        "event": "purchase",
+                        "price": 420000,
+                        "stamp_duty": 15000,
+                    },
+                    {"date": "2024-05-15", "event": "sale", "price": 510000, "agent_fees": 10000},
+                ],
+            }
+        ],
+    }
+
+    def test_local_estimate_investment_property(self):
+        """Test that a property held over a year gets the discount on its cost base gain."""
+        estimate = local_cgt_estimate(PortfolioAnalyzeRequest.model_validate(self.PORTFOLIO))
+
+        result = estimate.properties[0]
+        assert result.cost_base == Decimal("445000.00")
+        assert result.gross_capital_gain == Decimal("65000.00")
+        assert result.discount_percentage == Decimal("50")
+        assert result.net_capital_gain == Decimal("32500.00")
+        assert estimate.total_net_capital_gain == Decimal("32500.00")
+        assert not estimate.needs_clarification
+
+    def test_local_estimate_partial_main_residence(self):
+        """Test that only days lived in are exempt and unestimable properties are asked about."""
+        body = PortfolioAnalyzeRequest.model_validate({
+            "properties": [
+                {
+                    "address": "45 Beach Road",
+                    "property_history": [
+                        {"date": "2016-03-15", "event": "purchase", "price": 750000},
+                        {"date": "2016-04-01", "event": "move_in"},
+                        {"date": "2020-01-31", "event": "move_out"},
+                        {"date": "2024-09-30", "event": "sale", "price": 1100000},
+                    ],
+                },
+                {
+                    "address": "9 Missing Purchase Lane",
+                    "property_history": [{"date": "2020-01-01", "event": "sale", "price": 1}],
+                },
+            ],
+        })
+        estimate = local_cgt_estimate(body)
+
+        result = estimate.properties[0]
+        assert Decimal("0") < result.exempt_fraction < Decimal("1")
+        assert "s118-185" in result.itaa97_sections
+        expected = Decimal("350000") * (1 - result.exempt_fraction) / 2
+        assert result.net_capital_gain == expected.quantize(Decimal("0.01"))
+        assert estimate.needs_clarification
+        assert estimate.clarification_questions[0].property_address == "9 Missing Purchase Lane"
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_open_circuit_serves_local_estimate(self, mock_get_instance, client):
+        """Test that an open circuit yields a local estimate and a pollable job, not 503."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(side_effect=CircuitBreakerOpen("open"))
+        mock_get_instance.return_value = mock_client
+
+        response = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+
+        assert response.status_code == 200
+        assert response.headers["X-Degraded"] == "local-estimate"
+        data = response.json()
+        assert data["degraded"] is True
+        assert data["model"] == LOCAL_ESTIMATE_MODEL
+        assert data["structured"]["total_net_capital_gain"] == "32500.00"
+
+        job = client.get(f"/api/v1/jobs/{data['job_id']}")
+        assert job.status_code == 200
+        assert job.json()["status"] == "pending"
+        assert client.get("/api/v1/jobs/unknown").status_code == 404
+
+        # A repeat while still open shares the queued job
+        again = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+        assert again.json()["job_id"] == data["job_id"]
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_open_circuit_serves_stale_cache(self, mock_get_instance, client, mock_claude_response):
+        """Test that an expired cached analysis is replayed, marked degraded, while open."""
+        now = [0.0]
+        cache = ResponseCache(
+            ttl_seconds=60, max_entries=10, stale_seconds=3600, clock=lambda: now[0]
+        )
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(return_value=mock_claude_response)
+        mock_get_instance.return_value = mock_client
+
+        with patch("app.routers.portfolio.get_response_cache", return_value=cache):
+            first = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+            now[0] = 120.0
+            mock_client.send_message.side_effect = CircuitBreakerOpen("open")
+            second = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+
+        assert second.status_code == 200
+        assert second.headers["X-Degraded"] == "stale-cache"
+        data = second.json()
+        assert data["degraded"] is True and data["job_id"]
+        assert data["analysis"] == first.json()["analysis"]
+        assert cache.to_dict()["stale_hits"] == 1
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_degraded_mode_disabled_returns_503(self, mock_get_instance, client):
+        """Test that the open circuit still fails fast when degraded mode is off."""
+        mock_client = AsyncMock()
+        mock_client.send_message = AsyncMock(side_effect=CircuitBreakerOpen("open"))
+        mock_get_instance.return_value = mock_client
+        app.dependency_overrides[get_app_settings] = lambda: Settings(degraded_mode_enabled=False)
+        try:
+            response = client.post("/api/v1/analyze-portfolio", json=self.PORTFOLIO)
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 503
+
+    async def test_run_pending_requeues_while_open(self):
+        """Test that jobs run in order once ready and return to the front if the circuit reopens."""
+        queue = DeferredJobQueue(ttl_seconds=60, max_pending=2)
+        body = PortfolioAnalyzeRequest.model_validate(self.PORTFOLIO)
+        first, second = queue.enqueue("a", body), queue.enqueue("b", body)
+        assert queue.enqueue("c", body) is None  # Full
+
+        result = MagicMock()
+        run = AsyncMock(side_effect=[result, CircuitBreakerOpen("open"), result])
+        ready = MagicMock(return_value=True)
+
+        assert await queue.run_pending(run, ready) == 1
+        assert first.status == "done" and first.result is result
+        assert second.status == "pending"
+
+        assert await queue.run_pending(run, ready) == 1
+        assert second.status == "done"
+        assert queue.to_dict()["pending"] == 0
+        assert queue.to_dict()["rejected"] == 1
+
+
+class TestQuantileSketch:
+    """Tests for the quantile sketch and its rolling windows."""
+
+    def test_quantiles_within_relative_accuracy(self):
+        """Test that every quantile is within the sketch's relative accuracy."""
+        rng = random.Random(7)
+        values = [rng.lognormvariate(7, 1.5) for _ in range(5000)]
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        for value in values:
+            sketch.add(value)
+
+        ordered = sorted(values)
+        for q in (0.0, 0.5, 0.9, 0.99, 0.999, 1.0):
+            exact = ordered[int(q * (len(ordered) - 1))]
+            assert sketch.quantile(q) == pytest.approx(exact, rel=0.01)
+
+    def test_merge_matches_single_sketch(self):
+        """Test that merging two sketches equals sketching all values at once."""
+        combined, left, right = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in range(1, 2001):
+            combined.add(float(value))
+            (left if value % 2 else right).add(float(value))
+        left.merge(right)
+
+        assert left.to_dict() == combined.to_dict()
+        with pytest.raises(ValueError):
+            left.merge(QuantileSketch(relative_accuracy=0.05))
+
+    def test_bucket_count_is_capped(self):
+        """Test that folding the lowest buckets keeps memory bounded."""
+        sketch = QuantileSketch(max_buckets=50)
+        for exponent in range(200):
+            sketch.add(1.1**exponent)
+
+        assert len(sketch._buckets) <= 50
+        assert sketch.quantile(1.0) == pytest.approx(1.1**199)
+
+    def test_rolling_windows_drop_old_slices(self):
+        """Test that values age out of each window as slices pass."""
+        now = [0.0]
+        rolling = RollingQuantiles(slice_seconds=60, windows=(1, 5), clock=lambda: now[0])
+        rolling.add(100.0)
+        now[0] = 120.0
+        rolling.add(200.0)
+
+        assert rolling.to_dict()["1m"]["count"] == 1
+        assert rolling.to_dict()["5m"]["count"] == 2
+
+        now[0] = 300.0
+        assert rolling.to_dict()["5m"]["count"] == 1
+        assert rolling.to_dict()["5m"]["p50"] == pytest.approx(200, rel=0.01)
+        assert len(rolling._slices) == 1
+
+    def test_default_windows_cover_close_to_their_length(self):
+        """Test that the 1m window keeps recent values across a minute boundary."""
+        now = [55.0]
+        rolling = RollingQuantiles(clock=lambda: now[0])
+        rolling.add(100.0)
+
+        now[0] = 61.0
+        assert rolling.to_dict()["1m"]["count"] == 1
+        now[0] = 105.0
+        assert rolling.to_dict()["1m"]["count"] == 1
+        now[0] = 111.0
+        assert rolling.to_dict()["1m"]["count"] == 0
+        assert rolling.to_dict()["5m"]["count"] == 1
+        assert list(rolling.to_dict()) == ["1m", "5m", "15m"]
 
 
 class TestRequestMetrics:
@@ -338,8 +2292,8 @@ class TestRequestMetrics:
     @pytest.mark.asyncio
     async def test_metrics_track_successful_requests(self, metrics):
         """Test that successful requests are tracked."""
-        await metrics.record_request(success=True, latency_ms=100.0)
-        await metrics.record_request(success=True, latency_ms=200.0)
+        metrics.record_request(success=True, latency_ms=100.0)
+        metrics.record_request(success=True, latency_ms=200.0)
 
         assert metrics.total_requests == 2
         assert metrics.successful_requests == 2
@@ -349,8 +2303,8 @@ class TestRequestMetrics:
     @pytest.mark.asyncio
     async def test_metrics_track_failed_requests(self, metrics):
         """Test that failed requests are tracked."""
-        await metrics.record_request(success=True, latency_ms=100.0)
-        await metrics.record_request(success=False, latency_ms=50.0)
+        metrics.record_request(success=True, latency_ms=100.0)
+        metrics.record_request(success=False, latency_ms=50.0)
 
         assert metrics.total_requests == 2
         assert metrics.successful_requests == 1
@@ -360,13 +2314,336 @@ class TestRequestMetrics:
     @pytest.mark.asyncio
     async def test_metrics_to_dict(self, metrics):
         """Test metrics conversion to dictionary."""
-        await metrics.record_request(success=True, latency_ms=100.0)
+        metrics.record_request(success=True, latency_ms=100.0)
 
         result = metrics.to_dict()
         assert "total_requests" in result
         assert "success_rate" in result
         assert "average_latency_ms" in result
 
+    @pytest.mark.asyncio
+    async def test_metrics_latency_percentiles_by_outcome(self, metrics):
+        """Test that successes and failures get separate latency percentiles."""
+        for latency_ms in range(1, 1001):
+            metrics.record_request(success=True, latency_ms=float(latency_ms))
+        metrics.record_request(success=False, latency_ms=30000.0)
+
+        percentiles = metrics.to_dict()["latency_percentiles_ms"]
+        success = percentiles["success"]["1m"]
+        assert success["count"] == 1000
+        assert success["p50"] == pytest.approx(500, rel=0.01)
+        assert success["p99"] == pytest.approx(990, rel=0.01)
+        assert percentiles["failure"]["15m"]["p999"] == pytest.approx(30000, rel=0.01)
+        assert metrics.average_latency_ms == 500.5
+
+    @pytest.mark.asyncio
+    async def test_metrics_record_streaming_generation(self, metrics):
+        """Test that streaming calls record TTFT, inter-token latency and throughput."""
+        metrics.record_generation(
+            model="claude-sonnet-4-20250514",
+            output_tokens=101,
+            generation_ms=2500.0,
+            time_to_first_token_ms=500.0,
+        )
+
+        stats = metrics.generation["claude-sonnet-4-20250514"]
+        assert stats.time_to_first_token_ms.count == 1
+        assert stats.inter_token_latency_ms.mean == 20.0
+        assert stats.output_tokens_per_second.mean == pytest.approx(40.4)
+
+    @pytest.mark.asyncio
+    async def test_metrics_non_streaming_generation_skips_ttft(self, metrics):
+        """Test that non-streaming calls only record throughput."""
+        metrics.record_generation(
+            model="claude-sonnet-4-20250514", output_tokens=500, generation_ms=10000.0
+        )
+
+        stats = metrics.generation["claude-sonnet-4-20250514"]
+        assert stats.time_to_first_token_ms.count == 0
+        assert stats.inter_token_latency_ms.count == 0
+        assert stats.output_tokens_per_second.count == 1
+        assert "claude-sonnet-4-20250514" in metrics.to_dict()["generation"]
+
+    @pytest.mark.asyncio
+    async def test_metrics_track_prompt_profile_cache_hits(self, metrics):
+        """Test prompt cache effectiveness is tracked per prompt profile."""
+        metrics.record_prompt_usage("core+B", 200, 0, 15000)
+        metrics.record_prompt_usage("core+B", 200, 15000, 0)
+
+        profile = metrics.to_dict()["prompt_profiles"]["core+B"]
+        assert profile["requests"] == 2
+        assert profile["cache_hit_ratio"] == 0.5
+
+
+class TestHistogram:
+    """Tests for the fixed-bucket histogram."""
+
+    def test_histogram_cumulative_buckets(self):
+        """Test that buckets are cumulative and end with +Inf."""
+        histogram = Histogram((10.0, 100.0))
+        for value in (5.0, 50.0, 500.0):
+            histogram.observe(value)
+
+        assert histogram.cumulative_counts() == [(10.0, 1), (100.0, 2), (float("inf"), 3)]
+        assert histogram.to_dict()["buckets"]["+Inf"] == 3
+
+    def test_histogram_percentile_interpolates(self):
+        """Test percentile estimation within a bucket."""
+        histogram = Histogram((100.0, 200.0))
+        for _ in range(10):
+            histogram.observe(150.0)
+
+        assert histogram.percentile(0.5) == 150.0
+        assert Histogram((1.0,)).percentile(0.99) == 0.0
+
+
+class TestPrometheusMetrics:
+    """Tests for the Prometheus text exposition at /metrics."""
+
+    def test_histogram_exposition_in_seconds(self):
+        """Test that a millisecond histogram is written as cumulative buckets in seconds."""
+        histogram = Histogram((100.0, 1000.0))
+        for value in (50.0, 500.0, 5000.0):
+            histogram.observe(value)
+        writer = MetricsWriter()
+
+        writer.histogram(
+            "latency_seconds", "Latency.", [({"route": "/a"}, histogram)], scale=0.001
+        )
+
+        assert writer.render().splitlines() == [
+            "# HELP cgt_latency_seconds Latency.",
+            "# TYPE cgt_latency_seconds histogram",
+            'cgt_latency_seconds_bucket{route="/a",le="0.1"} 1',
+            'cgt_latency_seconds_bucket{route="/a",le="1"} 2',
+            'cgt_latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'cgt_latency_seconds_sum{route="/a"} 5.55',
+            'cgt_latency_seconds_count{route="/a"} 3',
+        ]
+
+    def test_metrics_endpoint(self, client, claude_client):
+        """Test that /metrics reports route latency, tokens, cost and breaker state."""
+        claude_client.metrics.record_request(success=True, latency_ms=1200.0)
+        claude_client.metrics.record_usage(
+            input_tokens=1000,
+            output_tokens=500,
+            cache_read_tokens=800,
+            cache_write_tokens=0,
+            cost_usd=0.0105,
+        )
+        app.dependency_overrides[get_claude_client] = lambda: claude_client
+        try:
+            client.get("/health")
+            response = client.get("/metrics")
+        finally:
+            app.dependency_overrides.clear()
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        lines = response.text.splitlines()
+        # Route metrics are process-wide, so other tests' requests count too
+        assert any(
+            line.startswith('cgt_http_requests_total{method="GET",route="/health",status="200"}')
+            for line in lines
+        )
+        assert 'cgt_claude_tokens_total{type="output"} 500' in lines
+        assert "cgt_claude_cost_usd_total 0.0105" in lines
+        assert 'cgt_claude_request_duration_seconds_bucket{outcome="success",le="2.5"} 1' in lines
+        assert 'cgt_circuit_breaker_state{state="closed"} 1' in lines
+        assert 'cgt_limiter_capacity{limiter="claude"} 20' in lines
+
+
+class TestPromptFormat:
+    """Tests for prompt serialisation formats."""
+
+    @pytest.fixture
+    def portfolio(self):
+        """Create a small portfolio request."""
+        return PortfolioAnalyzeRequest(
+            properties=[
+                {
+                    "address": "10 Smith Street, Melbourne VIC 3000",
+                    "property_history": [
+                        {"date": "2015-06-01", "event": "purchase", "price": 600000},
+                        {"date": "2015-06-15", "event": "move_in", "description": "Home | family"},
+                        {
+                            "date": "2024-06-01",
+                            "event": "sale",
+                            "price": 950000,
+                            "agent_fees": 19000,
+                        },
+                    ],
+                }
+            ],
+        )
+
+    def test_compact_matches_pretty_content(self, portfolio):
+        """Test compact JSON carries the same data as pretty JSON, minus nulls."""
+        import json
+
+        pretty = json.loads(format_portfolio_for_claude(portfolio, PromptFormat.PRETTY))
+        compact_text = format_portfolio_for_claude(portfolio, PromptFormat.COMPACT)
+        compact = json.loads(compact_text)
+
+        assert "\n" not in compact_text
+        assert "notes" not in compact["properties"][0]
+        compact_history = compact["properties"][0]["property_history"]
+        assert compact_history == pretty["properties"][0]["property_history"]
+        assert len(compact_text) < len(format_portfolio_for_claude(portfolio, PromptFormat.PRETTY))
+
+    def test_table_format_has_event_rows(self, portfolio):
+        """Test table format renders one escaped row per event."""
+        table = format_portfolio_for_claude(portfolio, PromptFormat.TABLE)
+
+        assert "| date | event | price | agent_fees | description |" in table
+        assert "| 2024-06-01 | sale | 950000 | 19000 |  |" in table
+        assert "Home \\| family" in table
+
+    def test_unknown_prompt_format_rejected_at_startup(self):
+        """Test that a misspelt PROMPT_FORMAT fails settings validation, not each request."""
+        from pydantic import ValidationError
+
+        assert Settings().prompt_format == "pretty"
+        with pytest.raises(ValidationError):
+            Settings(prompt_format="compcat")
+
+
+class TestPromptModules:
+    """Tests for the modular system prompt."""
+
+    def test_sections_cover_whole_prompt(self):
+        """Test that the sections reassemble into the original prompt."""
+        order = ["preamble", *"ABCDEFGHIJKLMNOPQ", "closing"]
+        assert "".join(PROMPT_SECTIONS[name] for name in order) == SYSTEM_PROMPT
+
+    def test_simple_main_residence_uses_core_only(self):
+        """Test that a plain main residence timeline needs no optional modules."""
+        assert select_sections(SIMPLE_MAIN_RESIDENCE.model_dump(mode="json")) == ()
+
+    def test_absence_and_rental_first_select_modules(self):
+        """Test that event patterns select the six-year and first-use modules."""
+        data = {
+            "properties": [
+                {
+                    "address": "1 Test St",
+                    "property_history": [
+                        {"date": "2010-01-01", "event": "purchase"},
+                        {"date": "2010-01-01", "event": "rent_start"},
+                        {"date": "2014-01-01", "event": "move_in"},
+                        {"date": "2018-01-01", "event": "move_out"},
+                    ],
+                }
+            ],
+            "additional_info": {"australian_resident": False},
+        }
+
+        assert select_sections(data) == ("B", "C", "E", "Q")
+
+    def test_blocks_place_core_first_with_breakpoints(self):
+        """Test that the core block is stable and every block is a cache breakpoint."""
+        blocks = build_system_blocks(("K", "B"))
+
+        assert len(blocks) == 2
+        assert blocks[0]["text"] == build_system_blocks(())[0]["text"]
+        assert blocks[1]["text"].startswith(PROMPT_SECTIONS["B"])
+        assert all(block["cache_control"] == {"type": "ephemeral"} for block in blocks)
+
+    def test_monolithic_prompt_when_disabled(self):
+        """Test that modular selection can be turned off."""
+        blocks, profile = select_system_prompt({}, modular=False)
+
+        assert profile == "full"
+        assert blocks[0]["text"] == SYSTEM_PROMPT
+
+    def test_monolithic_structured_prompt_drops_response_format(self):
+        """Test that structured requests never get the markdown format, even unmodularised."""
+        blocks, profile = select_system_prompt({}, modular=False, structured=True)
+
+        assert profile == "structured-full"
+        assert PROMPT_SECTIONS["O"] not in blocks[0]["text"]
+        assert PROMPT_SECTIONS["K"] in blocks[0]["text"]
+        assert warmup_prompts(Settings(modular_system_prompt=False))[1][0] == blocks
+
+
+class TestTokenEstimator:
+    """Tests for offline token estimation."""
+
+    def test_estimate_handles_blocks_and_strings(self):
+        """Test that strings and system blocks estimate the same text equally."""
+        estimator = TokenEstimator(chars_per_token=4.0)
+
+        assert estimator.estimate_tokens("x" * 400) == 100
+        assert estimator.estimate_tokens([{"type": "text", "text": "x" * 400}]) == 100
+        assert estimator.estimate_tokens("") == 0
+
+    def test_calibration_moves_toward_observed_ratio(self):
+        """Test that calibration converges on the billed chars-per-token ratio."""
+        estimator = TokenEstimator(chars_per_token=4.0, smoothing=0.5)
+        for _ in range(20):
+            estimator.calibrate(prompt_chars=3000, actual_tokens=1008)
+
+        assert estimator.chars_per_token == pytest.approx(3.0, rel=0.01)
+        assert estimator.samples == 20
+
+    def test_max_tokens_scales_with_portfolio(self):
+        """Test that the output budget grows with properties and is capped."""
+        small = choose_max_tokens(1, 3, base=2048, per_property=1536, per_event=64, ceiling=16000)
+        large = choose_max_tokens(4, 20, base=2048, per_property=1536, per_event=64, ceiling=16000)
+
+        assert small == 2048 + 1536 + 192
+        assert large > small
+        assert choose_max_tokens(50, 500, 2048, 1536, 64, ceiling=16000) == 16000
+        assert choose_max_tokens(1, 3, 2048, 1536, 64, ceiling=16000, floor=4096) == 4096
+        assert choose_max_tokens(4, 20, 2048, 1536, 64, ceiling=16000, floor=4096) == large
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_estimate_endpoint(self, mock_get_instance, client):
+        """Test the estimate endpoint returns a sized budget without calling Claude."""
+        mock_get_instance.return_value = ClaudeClient(Settings(anthropic_api_key="test-key"))
+
+        response = client.post(
+            "/api/v1/estimate",
+            json={
+                "properties": [
+                    {
+                        "address": "1 Test St",
+                        "property_history": [{"date": "2015-01-01", "event": "purchase"}],
+                    }
+                ]
+            },
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["max_tokens"] == 4096  # claude_max_tokens floor over 2048 + 1536 + 64
+        assert data["input_tokens"] > data["message_tokens"] > 0
+        assert data["prompt_profile"] == "core"
+
+    @patch("app.routers.portfolio.ClaudeClient.get_instance")
+    def test_structured_estimate_counts_tool_schema(self, mock_get_instance, client):
+        """Test that structured estimates include the analysis tool definition."""
+        mock_get_instance.return_value = ClaudeClient(Settings(anthropic_api_key="test-key"))
+        body = {
+            "properties": [
+                {
+                    "address": "1 Test St",
+                    "property_history": [{"date": "2015-01-01", "event": "purchase"}],
+                }
+            ]
+        }
+
+        markdown = client.post("/api/v1/estimate", json=body).json()
+        structured = client.post(
+            "/api/v1/estimate", json={**body, "output_format": "structured"}
+        ).json()
+
+        assert markdown["tool_tokens"] == 0
+        assert structured["tool_tokens"] > TOOL_USE_OVERHEAD_TOKENS
+        assert structured["input_tokens"] == (
+            structured["system_tokens"] + structured["message_tokens"]
+            + structured["tool_tokens"] + REQUEST_OVERHEAD_TOKENS
+        )
+
 
 class TestCORSConfiguration:
     """Tests for CORS configuration."""